@@ -0,0 +1,201 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import numpy as np
+import pandas as pd
+
+
+class _SortedTotal:
+    # A total stored as merged, and sorted by key the first time it is read
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if self.name not in instance._sorted:
+            instance._totals[self.name] = instance._totals[self.name].sort_index()
+            instance._sorted.add(self.name)
+        return instance._totals[self.name]
+
+    def __set__(self, instance, series):
+        instance._totals[self.name] = series
+        instance._sorted.discard(self.name)
+
+
+class PurchaseAggregates:
+    """
+    Mergeable revenue and count totals over a set of purchases.
+
+    Everything ``analyze_data``, ``create_customer_clusters`` and the report
+    need can be derived from these totals, so the raw purchases are scanned
+    once per run and the stages share the result. Partial aggregates built
+    from separate chunks of a purchases file can be merged instead of
+    concatenating the chunks themselves.
+
+    Merging leaves each total in the order its keys were first seen; a total
+    is sorted by key once, the first time it is read, so a long run of merges
+    costs no sorting. Merged sums add the same amounts as ``from_frame`` over
+    the concatenated chunks, but in a different order, so float totals can
+    differ from it in the last bits.
+
+    Attributes
+    ----------
+    product_sales : pd.Series
+        Total PurchaseAmount per ProductID.
+    category_sales : pd.Series
+        Total PurchaseAmount per Category.
+    customer_spending : pd.Series
+        Total PurchaseAmount per CustomerID.
+    customer_counts : pd.Series
+        Number of purchases (non-null ProductIDs) per CustomerID.
+    product_counts : pd.Series
+        Number of purchases per ProductID.
+    category_counts : pd.Series
+        Number of purchases per Category.
+    customer_last_purchase : pd.Series
+        Latest PurchaseDate per CustomerID (NaT when unknown).
+    row_count : int
+        Number of purchases aggregated.
+    """
+
+    product_sales = _SortedTotal()
+    category_sales = _SortedTotal()
+    customer_spending = _SortedTotal()
+    customer_counts = _SortedTotal()
+    product_counts = _SortedTotal()
+    category_counts = _SortedTotal()
+    customer_last_purchase = _SortedTotal()
+
+    def __init__(self, product_sales=None, category_sales=None,
+                 customer_spending=None, customer_counts=None, row_count=0,
+                 product_counts=None, category_counts=None, customer_last_purchase=None):
+        self._totals = {}
+        self._sorted = set()
+        self.product_sales = _or_empty(product_sales, "ProductID", float)
+        self.category_sales = _or_empty(category_sales, "Category", float)
+        self.customer_spending = _or_empty(customer_spending, "CustomerID", float)
+        self.customer_counts = _or_empty(customer_counts, "CustomerID", "int64")
+        self.product_counts = _or_empty(product_counts, "ProductID", "int64")
+        self.category_counts = _or_empty(category_counts, "Category", "int64")
+        self.customer_last_purchase = _or_empty(customer_last_purchase, "CustomerID", "datetime64[ns]", "PurchaseDate")
+        self.row_count = row_count
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "PurchaseAggregates":
+        """
+        Aggregate a frame with 'CustomerID', 'ProductID', 'Category' and 'PurchaseAmount'.
+
+        Each key column is factorized once into integer codes and every total
+        is a single ``np.bincount`` over those codes. Missing keys are skipped
+        and missing amounts count as zero, as in ``groupby().sum()``. Last
+        purchase dates are only filled when the frame has 'PurchaseDate'.
+        """
+        amounts = df["PurchaseAmount"].to_numpy(dtype=float, na_value=np.nan)
+        amounts = np.where(np.isnan(amounts), 0.0, amounts)
+        has_product = df["ProductID"].notna().to_numpy(dtype=float)
+        ones = np.ones(len(df))
+
+        customer_codes, customers = _factorize(df["CustomerID"])
+        product_codes, products = _factorize(df["ProductID"])
+        category_codes, categories = _factorize(df["Category"])
+        if "PurchaseDate" in df.columns:
+            last_purchase = _max_by(customer_codes, customers, df["PurchaseDate"].to_numpy(dtype="datetime64[ns]"))
+        else:
+            last_purchase = pd.Series(pd.NaT, index=customers, dtype="datetime64[ns]", name="PurchaseDate")
+        return cls(
+            product_sales=_sum_by(product_codes, products, amounts),
+            category_sales=_sum_by(category_codes, categories, amounts),
+            customer_spending=_sum_by(customer_codes, customers, amounts),
+            customer_counts=_sum_by(customer_codes, customers, has_product).astype("int64"),
+            row_count=int(df.shape[0]),
+            product_counts=_sum_by(product_codes, products, ones).astype("int64"),
+            category_counts=_sum_by(category_codes, categories, ones).astype("int64"),
+            customer_last_purchase=last_purchase,
+        )
+
+    def merge(self, other: "PurchaseAggregates") -> "PurchaseAggregates":
+        """
+        Combine two partial aggregates into a new one.
+
+        The cost depends on the number of distinct keys, not on the number of
+        purchases either side was built from. Keys new to this side are
+        appended after its own; nothing is sorted until a total is read.
+        """
+        left, right = self._totals, other._totals
+        return PurchaseAggregates(
+            product_sales=_add(left["product_sales"], right["product_sales"]),
+            category_sales=_add(left["category_sales"], right["category_sales"]),
+            customer_spending=_add(left["customer_spending"], right["customer_spending"]),
+            customer_counts=_add(left["customer_counts"], right["customer_counts"]),
+            row_count=self.row_count + other.row_count,
+            product_counts=_add(left["product_counts"], right["product_counts"]),
+            category_counts=_add(left["category_counts"], right["category_counts"]),
+            customer_last_purchase=_latest(left["customer_last_purchase"], right["customer_last_purchase"]),
+        )
+
+    def customer_features(self) -> pd.DataFrame:
+        """
+        Per-customer feature table used by ``create_customer_clusters``.
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns 'CustomerID', 'TotalSpending' and 'PurchaseCount', one row
+            per customer, ordered by CustomerID.
+        """
+        return pd.DataFrame({
+            "TotalSpending": self.customer_spending,
+            "PurchaseCount": self.customer_counts,
+        }).rename_axis("CustomerID").reset_index()
+
+
+def _factorize(keys: pd.Series):
+    codes, uniques = pd.factorize(keys, sort=True)
+    return codes, pd.Index(uniques, name=keys.name)
+
+
+def _sum_by(codes: np.ndarray, uniques: pd.Index, weights: np.ndarray) -> pd.Series:
+    valid = codes >= 0
+    totals = np.bincount(codes[valid], weights=weights[valid], minlength=len(uniques))
+    return pd.Series(totals, index=uniques, name="PurchaseAmount")
+
+
+def _max_by(codes: np.ndarray, uniques: pd.Index, dates: np.ndarray) -> pd.Series:
+    valid = codes >= 0
+    # NaT is the smallest int64, so it loses every comparison
+    latest = np.full(len(uniques), np.iinfo(np.int64).min)
+    np.maximum.at(latest, codes[valid], dates.view("int64")[valid])
+    return pd.Series(latest.view("datetime64[ns]"), index=uniques, name="PurchaseDate")
+
+
+def _or_empty(series, index_name, dtype, name="PurchaseAmount"):
+    if series is None:
+        return pd.Series([], index=pd.Index([], name=index_name), dtype=dtype, name=name)
+    return series
+
+
+def _union(left: pd.Index, right: pd.Index) -> pd.Index:
+    # Left's keys in their order, then right's new ones; no sorting
+    if left.equals(right):
+        return left
+    return left.append(right.difference(left, sort=False))
+
+
+def _add(left: pd.Series, right: pd.Series) -> pd.Series:
+    index = _union(left.index, right.index)
+    totals = np.zeros(len(index), dtype=np.result_type(left.dtype, right.dtype))
+    totals[:len(left)] = left.to_numpy()
+    totals[index.get_indexer(right.index)] += right.to_numpy()
+    return pd.Series(totals, index=index, name=left.name).astype(left.dtype)
+
+
+def _latest(left: pd.Series, right: pd.Series) -> pd.Series:
+    index = _union(left.index, right.index)
+    latest = np.full(len(index), np.iinfo(np.int64).min)
+    latest[:len(left)] = left.to_numpy(dtype="datetime64[ns]").view("int64")
+    positions = index.get_indexer(right.index)
+    # NaT is the smallest int64, as in _max_by
+    latest[positions] = np.maximum(latest[positions], right.to_numpy(dtype="datetime64[ns]").view("int64"))
+    return pd.Series(latest.view("datetime64[ns]"), index=index, name=left.name)
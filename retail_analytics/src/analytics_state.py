@@ -0,0 +1,265 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import hashlib
+import io
+import json
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.aggregates import PurchaseAggregates
+from src.data_loading import validate_purchases
+from src.encrypted_files import is_encrypted_file, open_encrypted
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+# Bytes before the absorbed offset that must be unchanged for a file to count as appended to
+TAIL_CHECK_BYTES = 1 << 12
+
+INTERACTION_COLUMNS = ["CustomerID", "ProductID", "PurchaseAmount"]
+
+
+class AnalyticsState:
+    """
+    Persisted running totals over every purchase file absorbed so far.
+
+    The state holds a ``PurchaseAggregates`` (per-product, per-category and
+    per-customer sums and counts, and each customer's last purchase date),
+    the byte offset up to which each source file has been read, and the
+    recommender's interaction columns as one Parquet part per absorbed batch.
+
+    Absorbing a new daily file, or the rows appended to a known one, parses
+    and validates only those rows; the totals are then merged, at a cost
+    that depends on the number of distinct products, categories and
+    customers rather than on the size of the history.
+
+    Purchase files encrypted at rest (``encrypted_files``) are decrypted as
+    they are read, and offsets refer to their plaintext. The state itself,
+    totals and interactions alike, is written in plaintext; keep ``root``
+    on storage that is as protected as the unencrypted purchases would be.
+
+    Only the totals are maintained incrementally. The interaction parts are
+    kept so the recommender, which has no partial fit, can be retrained on
+    the whole history (see ``interaction_parts``).
+
+    Parameters
+    ----------
+    root : str
+        Directory the state is persisted in.
+    """
+
+    def __init__(self, root="data/state"):
+        self.root = root
+        self.aggregates = PurchaseAggregates()
+        self.files = {}
+        self.parts = 0
+        self.generation = 0
+
+    @classmethod
+    def load(cls, root="data/state") -> "AnalyticsState":
+        """
+        Load the state persisted in ``root``, or an empty state if there is none.
+        """
+        state = cls(root)
+        meta_path = os.path.join(root, "state.json")
+        if not os.path.exists(meta_path):
+            return state
+        with open(meta_path) as f:
+            meta = json.load(f)
+        state.files = meta["files"]
+        state.parts = meta["parts"]
+        state.generation = meta["generation"]
+
+        totals_dir = os.path.join(root, f"totals-{state.generation:05d}")
+        products = pd.read_parquet(os.path.join(totals_dir, "products.parquet"))
+        categories = pd.read_parquet(os.path.join(totals_dir, "categories.parquet"))
+        customers = pd.read_parquet(os.path.join(totals_dir, "customers.parquet"))
+        last_purchase = _column(customers, "CustomerID", "LastPurchaseDate", "PurchaseDate")
+        state.aggregates = PurchaseAggregates(
+            product_sales=_column(products, "ProductID", "Sales", "PurchaseAmount"),
+            category_sales=_column(categories, "Category", "Sales", "PurchaseAmount"),
+            customer_spending=_column(customers, "CustomerID", "Spending", "PurchaseAmount"),
+            customer_counts=_column(customers, "CustomerID", "PurchaseCount", "PurchaseAmount"),
+            row_count=meta["row_count"],
+            product_counts=_column(products, "ProductID", "PurchaseCount", "PurchaseAmount"),
+            category_counts=_column(categories, "Category", "PurchaseCount", "PurchaseAmount"),
+            customer_last_purchase=last_purchase.astype("datetime64[ns]"),
+        )
+        return state
+
+    def absorb(self, purchases_file: str, chunksize=500_000) -> int:
+        """
+        Merge the purchases of ``purchases_file`` not absorbed yet.
+
+        A file seen before is only read from where the last call stopped,
+        provided it was appended to; if its earlier contents changed, a
+        ValueError is raised, since its old rows cannot be subtracted.
+        The new rows are parsed ``chunksize`` rows at a time, so memory
+        does not grow with the size of the append.
+
+        Returns
+        -------
+        int
+            Number of new (validated) rows absorbed.
+        """
+        key = os.path.abspath(purchases_file)
+        record = self.files.get(key)
+
+        with _open_plaintext(purchases_file) as f:
+            size = f.seek(0, io.SEEK_END)
+            if record is None:
+                offset, header = 0, None
+            else:
+                offset, header = record["offset"], record["header"]
+                if size < offset or _tail_digest(f, offset) != record["tail_sha256"]:
+                    raise ValueError(f"{purchases_file} changed since it was absorbed; rebuild the state.")
+            # Only complete lines are absorbed; a partially written last line waits for the next run
+            end = _complete_lines_end(f, offset, size)
+            if end == offset:
+                return 0
+            f.seek(offset)
+            new_rows = self._absorb_chunks(io.BufferedReader(_Range(f, end - offset)), header, chunksize)
+            if new_rows is None:
+                return 0
+            rows, columns = new_rows
+            tail_sha256 = _tail_digest(f, end)
+
+        self.files[key] = {"offset": end, "header": header or columns, "tail_sha256": tail_sha256}
+        log_structured(logger, "info", "Absorbed purchases into analytics state", source=purchases_file,
+                       new_rows=rows, total_rows=self.aggregates.row_count)
+        return rows
+
+    def _absorb_chunks(self, stream, header, chunksize):
+        # Merge and persist the rows of ``stream`` chunk by chunk; the totals
+        # and part count change only once every chunk parsed and validated
+        aggregates, parts, rows, columns = self.aggregates, self.parts, 0, None
+        try:
+            # Keys are read as strings so that separately parsed pieces agree on their type
+            with pd.read_csv(stream, header=None if header else "infer", names=header, chunksize=chunksize,
+                             dtype={"CustomerID": str, "ProductID": str, "Category": str}) as reader:
+                for chunk in reader:
+                    chunk = validate_purchases(chunk)
+                    columns = list(chunk.columns)
+                    aggregates = aggregates.merge(PurchaseAggregates.from_frame(chunk))
+                    self._write_part(chunk[INTERACTION_COLUMNS])
+                    rows += int(chunk.shape[0])
+        except pd.errors.EmptyDataError:
+            pass  # blank lines only
+        except BaseException:
+            self.parts = parts
+            raise
+        if columns is None:
+            self.parts = parts
+            return None
+        self.aggregates = aggregates
+        return rows, columns
+
+    def _write_part(self, interactions: pd.DataFrame):
+        parts_dir = os.path.join(self.root, "interactions")
+        os.makedirs(parts_dir, exist_ok=True)
+        path = os.path.join(parts_dir, f"part-{self.parts:05d}.parquet")
+        pq.write_table(pa.Table.from_pandas(interactions, preserve_index=False), path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.parts += 1
+
+    def interaction_parts(self):
+        """
+        Yield the (CustomerID, ProductID, PurchaseAmount) frame of each
+        absorbed batch, in absorption order, reading one part at a time.
+        """
+        parts_dir = os.path.join(self.root, "interactions")
+        for i in range(self.parts):
+            yield pd.read_parquet(os.path.join(parts_dir, f"part-{i:05d}.parquet"))
+
+    def interactions(self) -> pd.DataFrame:
+        """
+        (CustomerID, ProductID, PurchaseAmount) of every absorbed purchase,
+        in absorption order, for training the recommender. This reads back
+        the whole history.
+        """
+        frames = list(self.interaction_parts())
+        if not frames:
+            return pd.DataFrame(columns=INTERACTION_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def save(self):
+        """
+        Persist the totals and file offsets.
+
+        The totals are written to a new ``totals-<generation>`` directory and
+        ``state.json`` is then atomically replaced to point at it, so an
+        interrupted save leaves the previous state intact.
+        """
+        generation = self.generation + 1
+        totals_dir = os.path.join(self.root, f"totals-{generation:05d}")
+        shutil.rmtree(totals_dir, ignore_errors=True)
+        os.makedirs(totals_dir)
+        aggregates = self.aggregates
+        pd.DataFrame({
+            "Sales": aggregates.product_sales,
+            "PurchaseCount": aggregates.product_counts,
+        }).rename_axis("ProductID").reset_index().to_parquet(os.path.join(totals_dir, "products.parquet"))
+        pd.DataFrame({
+            "Sales": aggregates.category_sales,
+            "PurchaseCount": aggregates.category_counts,
+        }).rename_axis("Category").reset_index().to_parquet(os.path.join(totals_dir, "categories.parquet"))
+        pd.DataFrame({
+            "Spending": aggregates.customer_spending,
+            "PurchaseCount": aggregates.customer_counts,
+            "LastPurchaseDate": aggregates.customer_last_purchase,
+        }).rename_axis("CustomerID").reset_index().to_parquet(os.path.join(totals_dir, "customers.parquet"))
+
+        meta_path = os.path.join(self.root, "state.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"files": self.files, "parts": self.parts, "generation": generation,
+                       "row_count": aggregates.row_count}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        shutil.rmtree(os.path.join(self.root, f"totals-{self.generation:05d}"), ignore_errors=True)
+        self.generation = generation
+
+
+def _column(frame: pd.DataFrame, key: str, column: str, name: str) -> pd.Series:
+    return frame.set_index(key)[column].rename(name)
+
+
+def _open_plaintext(path: str):
+    # Encrypted files are read through a seekable decrypting stream, so offsets are plaintext offsets
+    return open_encrypted(path) if is_encrypted_file(path) else open(path, "rb")
+
+
+def _complete_lines_end(f, offset: int, size: int) -> int:
+    # Position just after the last newline in [offset, size), or offset if there is none
+    end = size
+    while end > offset:
+        start = max(offset, end - TAIL_CHECK_BYTES)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return offset
+
+
+class _Range(io.RawIOBase):
+    # The next ``length`` bytes of ``f``, as a stream of their own
+
+    def __init__(self, f, length: int):
+        self.f = f
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.f.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def _tail_digest(f, offset: int) -> str:
+    start = max(0, offset - TAIL_CHECK_BYTES)
+    f.seek(start)
+    return hashlib.sha256(f.read(offset - start)).hexdigest()
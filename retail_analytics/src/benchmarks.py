@@ -0,0 +1,341 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import date
+from src.clustering import create_customer_clusters
+from src.data_analysis import analyze_data
+from src.data_generation import main as generate_data
+from src.data_loading import filter_data, load_and_validate_purchases
+from src.item_knn import compare_with_knn_basic
+from src.logging_utils import get_logger, log_structured
+from src.recommendations import build_collaborative_filtering_model, recommend_for_customer
+from src.reporting import generate_pdf_report
+from src.resource_usage import ResourceMeter
+
+logger = get_logger(__name__)
+
+DEFAULT_SIZES = (5_000, 1_000_000, 10_000_000)
+DEFAULT_HISTORY = "benchmarks/history.json"
+# A stage regresses when a metric grows by more than this fraction over the baseline
+DEFAULT_THRESHOLD = 0.25
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.05
+MIN_MEMORY_MB = 16.0
+# Surprise's user-based KNNBasic holds a customers x customers matrix; above
+# this many customers the sparse item-item engine is benchmarked instead
+MAX_SURPRISE_CUSTOMERS = 5_000
+
+# Cold-start budgets of the CLI, in seconds from launching ``python src/main.py <command>``
+# to its exit, on the default 5,000-purchase data with warm stage and model caches
+COLD_START_BUDGETS = {"--help": 0.5, "load": 1.5, "recommend": 2.0}
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+BENCHMARK_END_DATE = date(2024, 12, 31)
+BENCHMARK_FILTERS = {"start_date": "2024-07-01", "end_date": "2025-01-01"}
+
+
+def dataset_shape(n_rows: int) -> dict:
+    """
+    Customer and product counts used for a benchmark of ``n_rows`` purchases:
+    ten purchases per customer and at least 50 products, as in the default data.
+    """
+    return {
+        "num_customers": max(10, n_rows // 10),
+        "num_products": max(50, n_rows // 2_000),
+        "num_purchases": n_rows,
+    }
+
+
+def benchmark_stages(n_rows: int, seed=42, workdir=None) -> list:
+    """
+    Generate ``n_rows`` seeded purchases and time every pipeline stage on them.
+
+    Stages run in order on each other's outputs, as in ``run_pipeline``,
+    inside ``workdir`` (a temporary directory by default), where the chart
+    and report are written.
+
+    Returns
+    -------
+    list of dict
+        One record per stage with "stage", "rows" (input rows),
+        "wall_seconds", "cpu_seconds", "rows_per_second" and "peak_memory_mb"
+        (peak RSS growth during the stage).
+    """
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="retail-bench-"))
+        os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+        stack.enter_context(contextlib.chdir(workdir))
+
+        shape = dataset_shape(n_rows)
+        generate_data(**shape, seed=seed, output_dir="data", end_date=BENCHMARK_END_DATE)
+
+        records = []
+
+        def run(stage, rows, fn, *args, **kwargs):
+            with ResourceMeter() as meter:
+                result = fn(*args, **kwargs)
+            records.append({
+                "stage": stage,
+                "rows": int(rows),
+                "wall_seconds": round(meter.wall_seconds, 6),
+                "cpu_seconds": round(meter.cpu_seconds, 6),
+                "rows_per_second": round(rows / meter.wall_seconds, 1) if meter.wall_seconds > 0 else None,
+                "peak_memory_mb": round(meter.peak_rss_delta_mb, 2),
+            })
+            return result
+
+        df = run("load_and_validate_purchases", n_rows, load_and_validate_purchases, "data/purchases.csv")
+        filtered = run("filter_data", len(df), filter_data, df, **BENCHMARK_FILTERS)
+        analysis = run("analyze_data", len(filtered), analyze_data, filtered)
+        clusters = run("create_customer_clusters", len(filtered), create_customer_clusters, filtered)
+
+        engine = "surprise" if shape["num_customers"] <= MAX_SURPRISE_CUSTOMERS else "sparse"
+        algo = run(f"build_collaborative_filtering_model[{engine}]", len(filtered),
+                   build_collaborative_filtering_model, filtered, engine=engine)
+        customer_id = filtered["CustomerID"].iloc[0]
+        recs = run("recommend_for_customer", len(filtered), recommend_for_customer, algo, customer_id, filtered)
+        recommendations_html = "<ul>" + "".join(f"<li>{product}: {amount:.2f}</li>" for product, amount in recs) + "</ul>"
+        run("generate_pdf_report", len(clusters), generate_pdf_report, analysis, clusters, recommendations_html)
+    return records
+
+
+def benchmark_knn_engines(n_rows: int, seed=42):
+    """
+    ``compare_with_knn_basic`` on the filtered purchases of the ``n_rows``
+    benchmark dataset: the item-item ``ItemKNN`` engine against Surprise's
+    ``KNNBasic``.
+
+    Returns
+    -------
+    dict or None
+        The comparison with its "size", or None when the dataset has more
+        than ``MAX_SURPRISE_CUSTOMERS`` customers.
+    """
+    shape = dataset_shape(n_rows)
+    if shape["num_customers"] > MAX_SURPRISE_CUSTOMERS:
+        return None
+    with tempfile.TemporaryDirectory(prefix="retail-bench-") as workdir, contextlib.chdir(workdir):
+        os.makedirs("data")
+        generate_data(**shape, seed=seed, output_dir="data", end_date=BENCHMARK_END_DATE)
+        filtered = filter_data(load_and_validate_purchases("data/purchases.csv"), **BENCHMARK_FILTERS)
+        comparison = compare_with_knn_basic(filtered)
+    comparison["size"] = int(n_rows)
+    return comparison
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, seed=42) -> dict:
+    """
+    Benchmark every stage at each dataset size.
+
+    Returns
+    -------
+    dict
+        A run: "timestamp", "environment" (Python version, platform, CPU
+        count), "results", the stage records of all sizes, and
+        "knn_comparison", the ``benchmark_knn_engines`` results of the sizes
+        small enough for ``KNNBasic``.
+    """
+    results, knn_comparison = [], []
+    for n_rows in sizes:
+        stage_records = benchmark_stages(n_rows, seed=seed)
+        for record in stage_records:
+            record["size"] = int(n_rows)
+        results.extend(stage_records)
+        log_structured(logger, "info", "Benchmarked pipeline stages", size=int(n_rows), results=stage_records)
+        comparison = benchmark_knn_engines(n_rows, seed=seed)
+        if comparison is not None:
+            knn_comparison.append(comparison)
+            log_structured(logger, "info", "Compared KNN engines", **comparison)
+    return {
+        "timestamp": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+        "knn_comparison": knn_comparison,
+    }
+
+
+def load_history(path=DEFAULT_HISTORY) -> dict:
+    """
+    Read the benchmark history: ``{"baseline": run or None, "runs": [run, ...]}``.
+    """
+    if not os.path.exists(path):
+        return {"baseline": None, "runs": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_history(history: dict, path=DEFAULT_HISTORY):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def find_regressions(run: dict, baseline: dict, threshold=DEFAULT_THRESHOLD) -> list:
+    """
+    Compare a run with the baseline, stage by stage and size by size.
+
+    A stage regresses when its wall time or peak memory exceeds the
+    baseline's by more than ``threshold`` (a fraction) and by more than the
+    noise floor (``MIN_SECONDS`` / ``MIN_MEMORY_MB``). Stages or sizes
+    missing from the baseline are not compared.
+
+    Returns
+    -------
+    list of dict
+        One entry per regressed metric with "stage", "size", "metric",
+        "baseline", "current" and "ratio".
+    """
+    if not baseline:
+        return []
+    reference = {(record["stage"], record["size"]): record for record in baseline["results"]}
+    regressions = []
+    for record in run["results"]:
+        previous = reference.get((record["stage"], record["size"]))
+        if previous is None:
+            continue
+        for metric, noise in (("wall_seconds", MIN_SECONDS), ("peak_memory_mb", MIN_MEMORY_MB)):
+            current, before = record[metric], previous[metric]
+            if current > before * (1 + threshold) and current - before > noise:
+                regressions.append({
+                    "stage": record["stage"],
+                    "size": record["size"],
+                    "metric": metric,
+                    "baseline": before,
+                    "current": current,
+                    "ratio": round(current / before, 3) if before else None,
+                })
+    return regressions
+
+
+def parse_import_times(importtime_output: str) -> dict:
+    """
+    Top-level module -> cumulative import seconds, from ``python -X importtime`` output.
+    """
+    seconds = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that triggered them
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            seconds[name.strip()] = seconds.get(name.strip(), 0.0) + int(cumulative) / 1e6
+    return seconds
+
+
+def measure_cold_start(command: str, runs=3, cwd=None) -> dict:
+    """
+    Time ``python src/main.py <command>`` in fresh interpreters, ``runs`` times.
+
+    Returns
+    -------
+    dict
+        "command", "wall_seconds" (fastest run), "import_seconds" (time
+        spent importing, in that run) and "top_imports", the five slowest
+        top-level imports as [module, seconds].
+    """
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-X", "importtime", MAIN_SCRIPT, *command.split()],
+                                   cwd=cwd, capture_output=True, text=True, check=True)
+        wall_seconds = time.perf_counter() - start
+        if best is None or wall_seconds < best[0]:
+            best = (wall_seconds, parse_import_times(completed.stderr))
+    wall_seconds, imports = best
+    top_imports = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        "command": command,
+        "wall_seconds": round(wall_seconds, 3),
+        "import_seconds": round(sum(imports.values()), 3),
+        "top_imports": [[module, round(seconds, 3)] for module, seconds in top_imports],
+    }
+
+
+def check_cold_start(budgets=COLD_START_BUDGETS, runs=3, cwd=None) -> list:
+    """
+    Measure every budgeted command; each record gets its "budget_seconds"
+    and "over_budget".
+    """
+    records = []
+    for command, budget in budgets.items():
+        record = measure_cold_start(command, runs=runs, cwd=cwd)
+        record["budget_seconds"] = budget
+        record["over_budget"] = record["wall_seconds"] > budget
+        records.append(record)
+        log_structured(logger, "info", "Measured CLI cold start", **record)
+    return records
+
+
+def cold_start_main(args) -> int:
+    records = check_cold_start(runs=args.runs)
+    print(f"{'command':<16}{'seconds':>10}{'imports':>10}{'budget':>10}  slowest imports")
+    for record in records:
+        slowest = ", ".join(f"{module} {seconds:.2f}" for module, seconds in record["top_imports"][:3])
+        print(f"{record['command']:<16}{record['wall_seconds']:>10.3f}{record['import_seconds']:>10.3f}"
+              f"{record['budget_seconds']:>10.2f}  {slowest}")
+    over_budget = [record for record in records if record["over_budget"]]
+    if over_budget:
+        log_structured(logger, "error", "CLI cold start over budget", commands=[r["command"] for r in over_budget])
+        return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages at several dataset sizes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Numbers of purchases to benchmark with.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON file with the baseline and past runs.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed fractional slowdown or memory growth over the baseline.")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Make this run the baseline (the first run always is).")
+    parser.add_argument("--cold-start", action="store_true",
+                        help="Instead, time the CLI's startup per command (run from the project directory) "
+                             "against COLD_START_BUDGETS.")
+    parser.add_argument("--runs", type=int, default=3, help="Launches per command with --cold-start.")
+    args = parser.parse_args(argv)
+    if args.cold_start:
+        return cold_start_main(args)
+
+    run = run_benchmarks(args.sizes, seed=args.seed)
+    history = load_history(args.history)
+    regressions = find_regressions(run, history["baseline"], args.threshold)
+    run["regressions"] = regressions
+    history["runs"].append(run)
+    if history["baseline"] is None or args.update_baseline:
+        history["baseline"] = run
+    save_history(history, args.history)
+
+    print(f"{'stage':<48}{'rows':>12}{'seconds':>10}{'rows/s':>14}{'peak MB':>10}")
+    for record in run["results"]:
+        print(f"{record['stage']:<48}{record['rows']:>12}{record['wall_seconds']:>10.3f}"
+              f"{record['rows_per_second'] or 0:>14.0f}{record['peak_memory_mb']:>10.1f}")
+    if run["knn_comparison"]:
+        print(f"\n{'engine':<12}{'size':>12}{'customers':>12}{'items':>8}{'fit seconds':>14}{'peak MB':>10}")
+    for comparison in run["knn_comparison"]:
+        for engine in ("ItemKNN", "KNNBasic"):
+            print(f"{engine:<12}{comparison['size']:>12}{comparison['customers']:>12}{comparison['items']:>8}"
+                  f"{comparison[engine]['fit_seconds']:>14.3f}{comparison[engine]['peak_memory_mb']:>10.1f}")
+    if regressions:
+        log_structured(logger, "error", "Benchmark regressions against baseline", regressions=regressions)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
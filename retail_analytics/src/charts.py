@@ -0,0 +1,261 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import hashlib
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import pandas as pd
+import matplotlib
+# Charts are only saved to files, from worker processes or threads
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import seaborn as sns
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+# Bump when the look of a chart changes, so cached images are redrawn
+CHART_VERSION = 1
+
+
+def top_products_chart(ax, top_products: pd.Series):
+    sns.barplot(x=top_products.index, y=top_products.values, ax=ax)
+    ax.set_title("Top 10 Selling Products by Revenue")
+    ax.set_xlabel("Product ID")
+    ax.set_ylabel("Total Sales")
+
+
+def category_sales_chart(ax, category_sales: pd.Series):
+    sns.barplot(x=category_sales.index, y=category_sales.values, ax=ax)
+    ax.set_title("Revenue by Category")
+    ax.set_xlabel("Category")
+    ax.set_ylabel("Total Sales")
+
+
+def segment_sizes_chart(ax, segment_sizes: pd.Series):
+    sns.barplot(x=segment_sizes.index, y=segment_sizes.values, ax=ax)
+    ax.set_title("Customers per Segment")
+    ax.set_xlabel("Segment")
+    ax.set_ylabel("Customers")
+
+
+def revenue_trend_chart(ax, daily_revenue: pd.Series):
+    ax.plot(daily_revenue.index, daily_revenue.values)
+    ax.set_title("Daily Revenue")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Total Sales")
+
+
+CHARTS = {
+    "top_products": top_products_chart,
+    "category_sales": category_sales_chart,
+    "segment_sizes": segment_sizes_chart,
+    "revenue_trend": revenue_trend_chart,
+}
+
+
+def chart_key(kind: str, data: pd.Series) -> str:
+    """
+    Cache key of a chart: a hash of its kind and of the values and labels it plots.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{kind}:{CHART_VERSION}".encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def render_chart(kind: str, data: pd.Series, path: str) -> str:
+    """
+    Draw one chart to a PNG at ``path``.
+
+    Uses a standalone Agg figure rather than pyplot, so charts can be drawn
+    from several threads at once. The file is written under a temporary name
+    and renamed into place, so a cached image is never partial.
+    """
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    CHARTS[kind](fig.add_subplot(), data)
+    fig.tight_layout()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".png")
+    os.close(fd)
+    try:
+        fig.savefig(tmp_path, format="png")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+class ChartRenderer:
+    """
+    Renders charts in the background, with images cached by the data they plot.
+
+    ``submit`` returns at once with a future; the chart is drawn by a worker
+    (a process by default, so several charts render in parallel) into
+    ``<cache_dir>/<kind>-<key>.png`` and then copied to
+    ``<output_dir>/<kind>.png``, where the report picks it up. A chart whose
+    data is unchanged is copied from the cache without drawing anything.
+    Only the ``max_cached`` most recently used images of each kind are kept.
+
+    Use as a context manager, or call ``close``, to wait for pending charts.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cached images.
+    output_dir : str
+        Directory the current images are copied to.
+    max_workers : int, optional
+        Size of the worker pool.
+    use_processes : bool
+        Render in a process pool; with False, in a thread pool.
+    max_cached : int
+        Cached images kept per chart kind; older ones are deleted after
+        each new render.
+    """
+
+    def __init__(self, cache_dir="data/cache/charts", output_dir="data", max_workers=None, use_processes=True,
+                 max_cached=5):
+        self.cache_dir = cache_dir
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.max_cached = max_cached
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            if self.use_processes:
+                # From a fork server: this process already runs threads (the log listener among them)
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context("forkserver"))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def image_path(self, kind: str) -> str:
+        """
+        Where the current image of ``kind`` is (or will be) written.
+        """
+        return os.path.join(self.output_dir, f"{kind}.png")
+
+    def submit(self, kind: str, data: pd.Series) -> Future:
+        """
+        Queue one chart of ``kind`` (a key of ``CHARTS``).
+
+        Returns
+        -------
+        Future
+            Resolves to the path of the image in ``output_dir``.
+        """
+        if kind not in CHARTS:
+            raise ValueError(f"Unknown chart '{kind}', expected one of {sorted(CHARTS)}.")
+        key = chart_key(kind, data)
+        cached_path = os.path.join(self.cache_dir, f"{kind}-{key}.png")
+        output_path = self.image_path(kind)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        result = Future()
+        if os.path.exists(cached_path):
+            log_structured(logger, "info", "Chart cache hit", chart=kind, key=key)
+            # Mark it recently used, so pruning keeps it
+            os.utime(cached_path)
+            result.set_result(_publish(cached_path, output_path))
+            return result
+
+        def publish(rendered: Future):
+            try:
+                path = _publish(rendered.result(), output_path)
+            except Exception as e:
+                log_structured(logger, "error", "Failed to render chart", chart=kind, error=str(e))
+                result.set_exception(e)
+                return
+            result.set_result(path)
+            log_structured(logger, "info", "Chart rendered", chart=kind, key=key, image_file=output_path)
+            prune_chart_cache(self.cache_dir, kind, keep=self.max_cached)
+
+        self._pool().submit(render_chart, kind, data, cached_path).add_done_callback(publish)
+        return result
+
+    def render_all(self, charts: dict) -> dict:
+        """
+        Queue several charts, ``{kind: data}``; returns ``{kind: future}``.
+        Charts with no data (None or empty) are skipped.
+        """
+        return {kind: self.submit(kind, data) for kind, data in charts.items()
+                if data is not None and len(data)}
+
+    def close(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def prune_chart_cache(cache_dir: str, kind: str, keep: int) -> list:
+    """
+    Delete all but the ``keep`` most recently used cached images of ``kind``.
+
+    Returns
+    -------
+    list
+        Paths of the deleted images.
+    """
+    images = []
+    for name in os.listdir(cache_dir):
+        if name.startswith(f"{kind}-") and name.endswith(".png"):
+            path = os.path.join(cache_dir, name)
+            try:
+                images.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass  # Pruned by another renderer
+    images.sort(reverse=True)
+    removed = []
+    for _, path in images[keep:]:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+    if removed:
+        log_structured(logger, "info", "Pruned chart cache", chart=kind, removed=len(removed), kept=keep)
+    return removed
+
+
+def wait_for_charts(futures: dict) -> dict:
+    """
+    Wait for the charts queued by ``ChartRenderer.render_all``.
+
+    Returns
+    -------
+    dict
+        Chart kind -> image path, for every chart that was written; charts
+        that failed (already logged by the renderer) are left out.
+    """
+    paths = {}
+    for kind, future in futures.items():
+        try:
+            paths[kind] = future.result()
+        except Exception:
+            pass
+    return paths
+
+
+def _publish(cached_path: str, output_path: str) -> str:
+    # Copy under a temporary name first, so the report never reads a partial image
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".png")
+    os.close(fd)
+    shutil.copyfile(cached_path, tmp_path)
+    os.replace(tmp_path, output_path)
+    return output_path
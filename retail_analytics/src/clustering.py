@@ -1,14 +1,32 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+import time
+import multiprocessing
+import sklearn
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
 from sklearn.preprocessing import StandardScaler
+from src.aggregates import PurchaseAggregates
 from src.logging_utils import get_logger, log_structured
+from src.model_store import content_key
+from src.segment_assigner import SegmentAssigner
 
 logger = get_logger(__name__)
 
-def create_customer_clusters(df: pd.DataFrame, n_clusters=4):
+CLUSTERING_MODES = ("full", "minibatch")
+
+# Segment names in order of average spending, lowest first; clusters past these are numbered
+SPEND_LABELS = ["Low Spenders", "Moderate Spenders", "High Spenders", "Very High Spenders"]
+
+def _spend_labels(n_clusters):
+    return [SPEND_LABELS[i] if i < len(SPEND_LABELS) else f"Cluster {i}" for i in range(n_clusters)]
+
+def create_customer_clusters(df: pd.DataFrame = None, n_clusters=4, aggregates: PurchaseAggregates = None,
+                             model_store=None, mode="full", batch_size=4096, init_centroids=None,
+                             return_assigner=False):
     """
     Creates customer clusters using K-Means based on aggregated purchase data.
     Uses feature scaling to ensure better clustering results.
@@ -17,51 +35,98 @@ def create_customer_clusters(df: pd.DataFrame, n_clusters=4):
     -----------
     df : pd.DataFrame
         DataFrame containing at least 'CustomerID', 'PurchaseAmount', and 'ProductID'.
-    n_clusters : int
-        Desired number of clusters for K-Means.
+    n_clusters : int or "auto"
+        Desired number of clusters for K-Means. "auto" picks it with
+        ``select_cluster_count``, whose per-k diagnostics are logged; use
+        ``auto_cluster_customers`` to get them back as a DataFrame.
+    aggregates : PurchaseAggregates, optional
+        Precomputed per-customer totals shared with the other pipeline
+        stages. When given, df is not needed; otherwise they are built from df.
+    model_store : ModelStore, optional
+        Store for the fitted scaler, K-Means model and label mapping, keyed
+        by the customer features and hyperparameters. When it already holds
+        a model for this input, that model is loaded instead of refitted.
+    mode : str
+        "full" runs K-Means over all customers. "minibatch" scales and fits
+        ``MiniBatchKMeans`` with ``partial_fit`` over chunks of customers,
+        warm-started from the previous run's centroids when available.
+    batch_size : int
+        Customers per chunk in "minibatch" mode.
+    init_centroids : array-like, optional
+        Starting centroids in unscaled (TotalSpending, PurchaseCount) units for
+        "minibatch" mode. Defaults to the centroids of the latest model with
+        the same ``n_clusters`` in ``model_store``.
+    return_assigner : bool
+        Also return a ``SegmentAssigner`` for labelling new customers with
+        this model without refitting.
 
     Returns:
     --------
     customer_group : pd.DataFrame
         A DataFrame where each row is a customer,
         with columns for total spending, purchase count, cluster ID, and cluster label.
+    assigner : SegmentAssigner
+        Only when ``return_assigner`` is True.
     """
 
-    # 1. Aggregate Data by Customer
-    customer_group = df.groupby("CustomerID").agg({
-        "PurchaseAmount": "sum",   # total spending
-        "ProductID": "count"      # total purchase count
-    }).rename(columns={
-        "PurchaseAmount": "TotalSpending",
-        "ProductID": "PurchaseCount"
-    })
-    customer_group = customer_group.reset_index()  # ensure 'CustomerID' is a column
+    # 1. Aggregate Data by Customer (total spending and purchase count)
+    if aggregates is None:
+        aggregates = PurchaseAggregates.from_frame(df)
+    customer_group = aggregates.customer_features()
+
+    if mode not in CLUSTERING_MODES:
+        raise ValueError(f"Unknown clustering mode '{mode}', expected one of {CLUSTERING_MODES}.")
 
     # 2. Feature Scaling
     features = ["TotalSpending", "PurchaseCount"]
     # If you've added more features, include them here, e.g. "AvgPurchaseValue"
+
+    if n_clusters == "auto":
+        n_clusters, _ = select_cluster_count(customer_group[features])
     
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(customer_group[features])
+    model_key = None
+    stored = None
+    if model_store is not None:
+        params = {"n_clusters": n_clusters, "random_state": 42, "sklearn": sklearn.__version__}
+        if mode == "minibatch":
+            params.update(mode=mode, batch_size=batch_size)
+        model_key = content_key(customer_group[features], params)
+        if model_store.contains("clustering", model_key):
+            stored, _ = model_store.load("clustering", model_key)
 
-    # 3. K-Means Clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    cluster_labels = kmeans.fit_predict(X_scaled)
+    if stored is not None:
+        # Same data and parameters: reuse the fitted model
+        scaler, kmeans = stored["scaler"], stored["kmeans"]
+        cluster_labels = kmeans.predict(scaler.transform(customer_group[features]))
+    elif mode == "minibatch":
+        if init_centroids is None and model_store is not None:
+            previous = model_store.latest("clustering", n_clusters=n_clusters)
+            if previous is not None:
+                previous_model = previous[0]
+                init_centroids = previous_model["scaler"].inverse_transform(previous_model["kmeans"].cluster_centers_)
+        scaler, kmeans, cluster_labels = _fit_minibatch(
+            customer_group[features].to_numpy(dtype=float), n_clusters, batch_size, init_centroids)
+    else:
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(customer_group[features])
+
+        # 3. K-Means Clustering
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+        cluster_labels = kmeans.fit_predict(X_scaled)
     customer_group["Cluster"] = cluster_labels
 
     # 4. Analyze each cluster’s average stats (for labeling or further insights)
-    cluster_info = (
-        customer_group.groupby("Cluster")
-        .agg({
-            "TotalSpending": "mean",
-            "PurchaseCount": "mean"
-        })
-        .reset_index()
-        .rename(columns={
-            "TotalSpending": "AvgSpending",
-            "PurchaseCount": "AvgPurchaseCount"
-        })
-    )
+    #    Cluster IDs are already 0..n_clusters-1, so bincount replaces a groupby
+    cluster_sizes = np.bincount(cluster_labels, minlength=n_clusters)
+    present = cluster_sizes > 0
+    cluster_info = pd.DataFrame({
+        "Cluster": np.arange(n_clusters)[present],
+        "AvgSpending": np.bincount(cluster_labels, weights=customer_group["TotalSpending"].to_numpy(),
+                                   minlength=n_clusters)[present] / cluster_sizes[present],
+        "AvgPurchaseCount": np.bincount(cluster_labels, weights=customer_group["PurchaseCount"].to_numpy(dtype=float),
+                                        minlength=n_clusters)[present] / cluster_sizes[present],
+        "CustomerCount": cluster_sizes[present],
+    })
 
     # 5. Dynamic Label Assignment
     #    Example: Label clusters in ascending order of AvgSpending as:
@@ -71,20 +136,20 @@ def create_customer_clusters(df: pd.DataFrame, n_clusters=4):
     cluster_info_sorted = cluster_info.sort_values("AvgSpending").reset_index(drop=True)
     
     
-    labels_map = {
-        0: "Low Spenders",
-        1: "Moderate Spenders",
-        2: "High Spenders",
-        3: "Very High Spenders"
-    }
+    labels = _spend_labels(len(cluster_info_sorted))
     
     # For each sorted cluster, map it to a label
     cluster_id_to_label = {}
     for i, row in cluster_info_sorted.iterrows():
         actual_cluster_id = row["Cluster"]
-        # If we have fewer or more than 4 clusters, you can handle that with a fallback or dynamic naming
-        label = labels_map[i] if i in labels_map else f"Cluster {i}"
-        cluster_id_to_label[actual_cluster_id] = label
+        cluster_id_to_label[actual_cluster_id] = labels[i]
+
+    if stored is not None:
+        cluster_id_to_label = stored["labels"]
+    elif model_store is not None:
+        model_store.save("clustering", model_key, {
+            "scaler": scaler, "kmeans": kmeans, "labels": cluster_id_to_label,
+        }, meta={"n_clusters": n_clusters, "mode": mode, "customer_count": int(customer_group.shape[0])})
 
     # Apply labels
     customer_group["ClusterLabel"] = customer_group["Cluster"].map(cluster_id_to_label)
@@ -98,4 +163,171 @@ def create_customer_clusters(df: pd.DataFrame, n_clusters=4):
         cluster_summary=cluster_info.to_dict(orient="records")
     )
 
+    if return_assigner:
+        return customer_group, SegmentAssigner.from_model(scaler, kmeans, cluster_id_to_label)
     return customer_group
+
+
+def select_cluster_count(features: pd.DataFrame, k_values=range(2, 9), criterion="silhouette",
+                         sample_size=10_000, time_budget=None, max_workers=None, random_state=42):
+    """
+    Choose the number of clusters by fitting every candidate k in parallel.
+
+    Each candidate is fitted in its own worker process on the same stratified
+    sample of customers (stratified by spending decile, so the few heavy
+    spenders are represented). Inertia and silhouette score are computed on
+    that sample.
+
+    Parameters
+    ----------
+    features : pd.DataFrame
+        Unscaled customer features, one row per customer.
+    k_values : iterable of int
+        Candidate cluster counts.
+    criterion : str
+        "silhouette" picks the k with the highest silhouette score; "elbow"
+        picks the point of the inertia curve farthest from the straight line
+        between its ends.
+    sample_size : int
+        Customers in the stratified sample.
+    time_budget : float, optional
+        Seconds allowed for the candidates. When it runs out, the worker
+        processes still fitting are terminated and the choice is made among
+        the finished candidates.
+    max_workers : int, optional
+        Worker processes; defaults to all cores.
+    random_state : int
+        Seed for sampling and K-Means.
+
+    Returns
+    -------
+    n_clusters : int
+        The chosen number of clusters.
+    diagnostics : pd.DataFrame
+        One row per finished k with "k", "inertia", "silhouette",
+        "fit_seconds" and "elbow_distance", sorted by k.
+    """
+    if criterion not in ("silhouette", "elbow"):
+        raise ValueError(f"Unknown criterion '{criterion}', expected 'silhouette' or 'elbow'.")
+    X = StandardScaler().fit_transform(features.to_numpy(dtype=float))
+    sample = X[_stratified_sample(features.iloc[:, 0].to_numpy(dtype=float), sample_size, random_state)]
+    k_values = [k for k in k_values if 2 <= k < len(sample)]
+    if not k_values:
+        raise ValueError("Not enough customers to compare cluster counts.")
+
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    # A Pool rather than an executor: its workers can be terminated, so the budget bounds CPU time too.
+    # Workers come from a fork server: forking this process, which already runs the log listener
+    # and BLAS/OpenMP threads, could leave a child waiting on a lock no thread will release.
+    # The server imports scikit-learn once, so workers start with it loaded.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["sklearn.cluster", "sklearn.metrics"])
+    pool = context.Pool(processes=max_workers)
+    try:
+        pending = [pool.apply_async(_evaluate_cluster_count, (sample, k, random_state)) for k in k_values]
+        for result in pending:
+            result.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        done = [result.get() for result in pending if result.ready()]
+        abandoned = len(pending) - len(done)
+    finally:
+        pool.terminate()
+        pool.join()
+    if not done:
+        raise TimeoutError(f"No cluster count finished within {time_budget} seconds.")
+
+    diagnostics = pd.DataFrame(done).sort_values("k").reset_index(drop=True)
+    diagnostics["elbow_distance"] = _elbow_distances(diagnostics["k"].to_numpy(), diagnostics["inertia"].to_numpy())
+    column = "silhouette" if criterion == "silhouette" else "elbow_distance"
+    n_clusters = int(diagnostics.loc[diagnostics[column].idxmax(), "k"])
+
+    log_structured(logger, "info", "Selected cluster count", n_clusters=n_clusters, criterion=criterion,
+                   abandoned=abandoned, diagnostics=diagnostics.round(4).to_dict("records"))
+    return n_clusters, diagnostics
+
+def auto_cluster_customers(df: pd.DataFrame = None, aggregates: PurchaseAggregates = None, **select_options):
+    """
+    Pick the number of clusters with ``select_cluster_count`` and cluster all customers with it.
+
+    Returns
+    -------
+    customer_group : pd.DataFrame
+        As returned by ``create_customer_clusters``.
+    diagnostics : pd.DataFrame
+        Per-k diagnostics from ``select_cluster_count``.
+    """
+    if aggregates is None:
+        aggregates = PurchaseAggregates.from_frame(df)
+    features = aggregates.customer_features()[["TotalSpending", "PurchaseCount"]]
+    n_clusters, diagnostics = select_cluster_count(features, **select_options)
+    return create_customer_clusters(n_clusters=n_clusters, aggregates=aggregates), diagnostics
+
+def _stratified_sample(values: np.ndarray, sample_size, random_state, n_strata=10):
+    # Same share of every decile of values, so the tails are represented
+    if len(values) <= sample_size:
+        return np.arange(len(values))
+    rng = np.random.default_rng(random_state)
+    ranks = np.argsort(np.argsort(values, kind="stable"), kind="stable")
+    strata = ranks * n_strata // len(values)
+    fraction = sample_size / len(values)
+    picked = []
+    for stratum in range(n_strata):
+        members = np.flatnonzero(strata == stratum)
+        picked.append(rng.choice(members, size=max(1, int(round(len(members) * fraction))), replace=False))
+    return np.sort(np.concatenate(picked))
+
+def _evaluate_cluster_count(X: np.ndarray, k, random_state):
+    start = time.perf_counter()
+    kmeans = KMeans(n_clusters=k, random_state=random_state)
+    labels = kmeans.fit_predict(X)
+    fit_seconds = time.perf_counter() - start
+    silhouette = silhouette_score(X, labels) if len(set(labels)) > 1 else np.nan
+    return {"k": k, "inertia": float(kmeans.inertia_), "silhouette": float(silhouette), "fit_seconds": fit_seconds}
+
+def _elbow_distances(k: np.ndarray, inertia: np.ndarray) -> np.ndarray:
+    # Distance of each (k, inertia) point below the chord joining the first and last points
+    if len(k) < 3:
+        return np.zeros(len(k))
+    x = (k - k[0]) / (k[-1] - k[0])
+    span = inertia[0] - inertia[-1]
+    y = (inertia - inertia[-1]) / span if span else np.zeros(len(k))
+    return (1 - x) - y
+
+def _fit_minibatch(X: np.ndarray, n_clusters, batch_size, init_centroids=None, max_epochs=10, tol=1e-4):
+    """
+    Fit the scaler and ``MiniBatchKMeans`` with ``partial_fit`` over chunks of customers.
+
+    Chunks are drawn from a shuffled order, for at most ``max_epochs`` passes.
+    Fitting stops as soon as a smoothed average of the squared centroid
+    movement per chunk falls below ``tol`` (in scaled units), which a good
+    warm start reaches within a few chunks. ``init_centroids`` are given in
+    unscaled units so that centroids from a previous run still apply after
+    the scaler changes.
+    """
+    scaler = StandardScaler()
+    for start in range(0, len(X), batch_size):
+        scaler.partial_fit(X[start:start + batch_size])
+    X_scaled = scaler.transform(X)
+
+    if init_centroids is not None:
+        init = scaler.transform(np.asarray(init_centroids, dtype=float))
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1,
+                                 batch_size=batch_size, random_state=42)
+    else:
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=42)
+
+    order = np.random.default_rng(42).permutation(len(X_scaled))
+    starts = list(range(0, len(order), batch_size)) * max_epochs
+    smoothed_shift = None
+    for step, start in enumerate(starts, 1):
+        previous = None if step == 1 else kmeans.cluster_centers_.copy()
+        kmeans.partial_fit(X_scaled[order[start:start + batch_size]])
+        if previous is None:
+            continue
+        shift = float(((kmeans.cluster_centers_ - previous) ** 2).sum())
+        smoothed_shift = shift if smoothed_shift is None else 0.7 * smoothed_shift + 0.3 * shift
+        if smoothed_shift < tol:
+            break
+
+    log_structured(logger, "info", "Mini-batch clustering converged",
+                   chunks=step, customers=len(X), warm_start=init_centroids is not None, batch_size=batch_size)
+    return scaler, kmeans, kmeans.predict(X_scaled)
@@ -0,0 +1,171 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import hashlib
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_fingerprint(path: str) -> dict:
+    """
+    Cheap identity of a source file: its size and modification time.
+
+    Parameters
+    ----------
+    path : str
+        File to fingerprint.
+
+    Returns
+    -------
+    dict
+        ``{"size": int, "mtime_ns": int}``
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of a file's contents, read in fixed-size blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(source_file: str, cache_dir: str, suffix: str) -> str:
+    """
+    Path in ``cache_dir`` of a file derived from ``source_file``, e.g.
+    ``purchases-<hash>.parquet`` for suffix ".parquet". The name includes a
+    hash of the source's absolute path, so same-named files in different
+    directories do not collide.
+    """
+    source = os.path.abspath(source_file)
+    base = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, f"{base}-{hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]}{suffix}")
+
+
+def _cache_paths(source_file: str, cache_dir: str):
+    return cache_path(source_file, cache_dir, ".parquet"), cache_path(source_file, cache_dir, ".meta.json")
+
+
+def _read_meta(meta_path: str):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path: str, meta: dict):
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def is_cache_valid(source_file: str, cache_dir: str) -> bool:
+    """
+    Check whether the cached frame for ``source_file`` is still current.
+
+    The cache must have been built from the same file (by absolute path).
+    Size and mtime are then compared. If only the mtime moved (the file was
+    touched or copied), the content hash decides, and the metadata is
+    refreshed so the next lookup takes the fast path again.
+
+    Parameters
+    ----------
+    source_file : str
+        Path of the CSV the cache was built from.
+    cache_dir : str
+        Directory holding the cache files.
+
+    Returns
+    -------
+    bool
+        True if the cache can be read instead of re-parsing the CSV.
+    """
+    data_path, meta_path = _cache_paths(source_file, cache_dir)
+    meta = _read_meta(meta_path)
+    if meta is None or not os.path.exists(data_path):
+        return False
+    if meta.get("source") != os.path.abspath(source_file):
+        return False
+
+    current = file_fingerprint(source_file)
+    if current["size"] != meta.get("size"):
+        return False
+    if current["mtime_ns"] == meta.get("mtime_ns"):
+        return True
+
+    if file_digest(source_file) != meta.get("sha256"):
+        return False
+    meta["mtime_ns"] = current["mtime_ns"]
+    _write_meta(meta_path, meta)
+    return True
+
+
+def read_cached_frame(source_file: str, cache_dir: str, columns=None) -> pd.DataFrame:
+    """
+    Read the validated frame for ``source_file`` from its Parquet cache.
+
+    The file is memory-mapped and converted column by column, so only the
+    requested columns are read and numeric columns are not copied twice.
+
+    Parameters
+    ----------
+    source_file : str
+        Path of the CSV the cache was built from.
+    cache_dir : str
+        Directory holding the cache files.
+    columns : list of str, optional
+        Subset of columns to read. All columns are read when omitted.
+
+    Returns
+    -------
+    pd.DataFrame
+        The cached, already-typed purchases frame.
+    """
+    data_path, _ = _cache_paths(source_file, cache_dir)
+    table = pq.read_table(data_path, columns=columns, memory_map=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def write_cached_frame(df: pd.DataFrame, source_file: str, cache_dir: str):
+    """
+    Store a validated frame as Parquet, keyed by the source file's identity.
+
+    Both files are written to temporary names and renamed into place, so a
+    crash mid-write never leaves a cache that looks valid.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Validated purchases frame.
+    source_file : str
+        Path of the CSV ``df`` was parsed from.
+    cache_dir : str
+        Directory holding the cache files.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, meta_path = _cache_paths(source_file, cache_dir)
+
+    tmp_path = data_path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(df), tmp_path)
+    os.replace(tmp_path, data_path)
+
+    meta = file_fingerprint(source_file)
+    meta["sha256"] = file_digest(source_file)
+    meta["source"] = os.path.abspath(source_file)
+    meta["row_count"] = int(df.shape[0])
+    _write_meta(meta_path, meta)
+    log_structured(logger, "info", "Wrote columnar purchases cache", cache_file=data_path, row_count=meta["row_count"])
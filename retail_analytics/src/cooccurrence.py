@@ -0,0 +1,293 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class ItemCooccurrence:
+    """
+    How many customers bought each pair of products, kept up to date as purchases arrive.
+
+    ``counts[i, j]`` is the number of customers who bought both product i
+    and product j; the diagonal is the number of customers who bought each
+    product. With B the boolean customer x product purchase matrix,
+    ``counts = B.T @ B``. When new purchases add the (customer, product)
+    pairs N, the counts grow by ``N.T @ B + B.T @ N + N.T @ N`` evaluated
+    over the affected customers' rows and products only.
+
+    Those increments, and the new pairs, are kept in per-row dictionaries
+    next to the CSR matrices and folded into them only once they hold more
+    than ``merge_fraction`` of the matrices' entries. An update therefore
+    costs what the batch and the affected customers bought, plus an
+    amortized share of the occasional merge, rather than a rebuild. Lookups
+    (``customer_count``, ``also_bought``, ``purchased_rows``) read both
+    parts without merging; the ``purchased`` and ``counts`` attributes
+    merge first.
+
+    Parameters
+    ----------
+    merge_fraction : float
+        Pending entries, as a fraction of the merged ones, that trigger a merge.
+    min_merge : int
+        Pending entries always allowed before a merge.
+
+    Attributes
+    ----------
+    customer_ids, item_ids : pd.Index
+        Row and column order of ``purchased`` (and of ``counts``).
+    purchased : scipy.sparse.csr_matrix
+        Boolean customer x product matrix.
+    counts : scipy.sparse.csr_matrix
+        Product x product co-purchase counts.
+    """
+
+    def __init__(self, merge_fraction=0.25, min_merge=1 << 14):
+        self.merge_fraction = merge_fraction
+        self.min_merge = min_merge
+        self._customers = _Positions("CustomerID")
+        self._items = _Positions("ProductID")
+        self._purchased = sparse.csr_matrix((0, 0), dtype=bool)
+        self._counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+        # Row -> columns bought, and product row -> {product: increment}, not merged yet
+        self._pending_purchased = {}
+        self._pending_counts = {}
+        self._pending_size = 0
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, **kwargs) -> "ItemCooccurrence":
+        """
+        Co-purchase counts of a frame with 'CustomerID' and 'ProductID'.
+        """
+        cooccurrence = cls(**kwargs)
+        cooccurrence.update(df)
+        return cooccurrence
+
+    @property
+    def customer_ids(self) -> pd.Index:
+        return self._customers.index()
+
+    @property
+    def item_ids(self) -> pd.Index:
+        return self._items.index()
+
+    @property
+    def purchased(self) -> sparse.csr_matrix:
+        self._merge()
+        return self._purchased
+
+    @property
+    def counts(self) -> sparse.csr_matrix:
+        self._merge()
+        return self._counts
+
+    def update(self, df: pd.DataFrame) -> pd.Index:
+        """
+        Add the purchases in ``df``.
+
+        Returns
+        -------
+        pd.Index
+            Customers who bought a product they had not bought before; only
+            their co-occurrences changed.
+        """
+        df = df[df["CustomerID"].notna() & df["ProductID"].notna()]
+        rows = self._customers.add(df["CustomerID"])
+        cols = self._items.add(df["ProductID"])
+        rows, cols = _unique_pairs(rows, cols, len(self._items))
+        new = ~self._known(rows, cols)
+        rows, cols = rows[new], cols[new]
+        affected = np.unique(rows)
+        if len(affected) == 0:
+            return self._customers.ids(affected)
+
+        # Increments over the products the affected customers bought, before and now
+        before = self.purchased_rows(affected).tocoo()
+        local_rows = np.searchsorted(affected, rows)
+        products = np.union1d(before.col, cols)
+        shape = (len(affected), len(products))
+        added = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (local_rows, np.searchsorted(products, cols))),
+                                  shape=shape)
+        bought = sparse.csr_matrix((np.ones(len(before.row), dtype=np.int64),
+                                    (before.row, np.searchsorted(products, before.col))), shape=shape)
+        delta = added.T @ bought
+        delta = (delta + delta.T + added.T @ added).tocoo()
+        increments = (products[delta.row], products[delta.col], delta.data)
+
+        if len(rows) + len(delta.data) > self._merge_threshold():
+            # A large batch (such as the first one) is folded in directly
+            self._merge(pairs=(rows, cols), increments=increments)
+        else:
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                self._pending_purchased.setdefault(row, set()).add(col)
+            for i, j, value in zip(*(part.tolist() for part in increments)):
+                counts = self._pending_counts.setdefault(i, {})
+                counts[j] = counts.get(j, 0) + value
+            self._pending_size += len(rows) + len(delta.data)
+            if self._pending_size > self._merge_threshold():
+                self._merge()
+        return self._customers.ids(affected)
+
+    def customer_rows(self, customer_ids) -> np.ndarray:
+        """
+        Positions of ``customer_ids`` in ``customer_ids`` order; -1 for unknown customers.
+        """
+        return np.array([self._customers.get(customer_id) for customer_id in customer_ids], dtype=np.int64)
+
+    def purchased_rows(self, rows, n_items=None) -> sparse.coo_matrix:
+        """
+        Boolean (len(rows) x products) matrix of what the customers at
+        positions ``rows`` bought, limited to the first ``n_items`` products
+        when given.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        n_items = len(self._items) if n_items is None else n_items
+        in_base = rows < self._purchased.shape[0]
+        merged = self._purchased[rows[in_base]].tocoo()
+        out_rows = [np.flatnonzero(in_base)[merged.row]]
+        out_cols = [merged.col]
+        for position, row in enumerate(rows.tolist()):
+            pending = self._pending_purchased.get(row)
+            if pending:
+                out_rows.append(np.full(len(pending), position))
+                out_cols.append(np.fromiter(pending, dtype=np.int64, count=len(pending)))
+        out_rows, out_cols = np.concatenate(out_rows), np.concatenate(out_cols).astype(np.int64)
+        keep = out_cols < n_items
+        return sparse.coo_matrix((np.ones(int(keep.sum()), dtype=bool), (out_rows[keep], out_cols[keep])),
+                                 shape=(len(rows), n_items))
+
+    def customer_count(self, item_id) -> int:
+        """
+        Number of customers who bought ``item_id``.
+        """
+        col = self._items.get(item_id)
+        if col < 0:
+            return 0
+        merged = int(self._counts[col, col]) if col < self._counts.shape[0] else 0
+        return merged + self._pending_counts.get(col, {}).get(col, 0)
+
+    def also_bought(self, item_id, n=10) -> list:
+        """
+        Products most often bought by customers who bought ``item_id``.
+
+        Returns
+        -------
+        list of tuples
+            (product ID, customers who bought both, share of ``item_id``'s
+            customers), most frequent first; ties in product order.
+        """
+        col = self._items.get(item_id)
+        if col < 0:
+            return []
+        row = self._count_row(col)
+        mask = row.index != col
+        items, together = row.index[mask], row.to_numpy()[mask]
+        order = np.lexsort((items, -together))[:n]
+        buyers = row.get(col, 0)
+        return [(self._items[item], int(count), float(count / buyers))
+                for item, count in zip(items[order], together[order])]
+
+    def _count_row(self, col: int) -> pd.Series:
+        # Product -> co-purchase count of one product, merged and pending parts added
+        if col < self._counts.shape[0]:
+            merged = self._counts.getrow(col)
+            row = pd.Series(merged.data, index=merged.indices)
+        else:
+            row = pd.Series(dtype=np.int64)
+        pending = self._pending_counts.get(col)
+        if pending:
+            row = row.add(pd.Series(pending), fill_value=0).astype(np.int64)
+        return row[row != 0]
+
+    def _known(self, rows, cols) -> np.ndarray:
+        # Which (row, col) pairs were already bought, merged or pending
+        known = np.zeros(len(rows), dtype=bool)
+        in_base = (rows < self._purchased.shape[0]) & (cols < self._purchased.shape[1])
+        if in_base.any():
+            known[in_base] = np.asarray(self._purchased[rows[in_base], cols[in_base]]).ravel()
+        if self._pending_purchased:
+            pending = self._pending_purchased
+            known |= np.fromiter((col in pending.get(row, ()) for row, col in zip(rows.tolist(), cols.tolist())),
+                                 dtype=bool, count=len(rows))
+        return known
+
+    def _merge_threshold(self) -> float:
+        return max(self.min_merge, self.merge_fraction * (self._purchased.nnz + self._counts.nnz))
+
+    def _merge(self, pairs=None, increments=None):
+        # Rebuild the CSR matrices from their entries plus everything pending
+        if not self._pending_size and pairs is None and self._purchased.shape == (len(self._customers),
+                                                                                 len(self._items)):
+            return
+        row_parts, col_parts = [self._purchased.tocoo().row], [self._purchased.tocoo().col]
+        for row, cols in self._pending_purchased.items():
+            row_parts.append(np.full(len(cols), row))
+            col_parts.append(np.fromiter(cols, dtype=np.int64, count=len(cols)))
+        if pairs is not None:
+            row_parts.append(pairs[0])
+            col_parts.append(pairs[1])
+        rows, cols = np.concatenate(row_parts), np.concatenate(col_parts)
+        self._purchased = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                            shape=(len(self._customers), len(self._items)))
+
+        counts = self._counts.tocoo()
+        i_parts, j_parts, value_parts = [counts.row], [counts.col], [counts.data]
+        for i, row in self._pending_counts.items():
+            i_parts.append(np.full(len(row), i))
+            j_parts.append(np.fromiter(row.keys(), dtype=np.int64, count=len(row)))
+            value_parts.append(np.fromiter(row.values(), dtype=np.int64, count=len(row)))
+        if increments is not None:
+            i_parts.append(increments[0])
+            j_parts.append(increments[1])
+            value_parts.append(increments[2])
+        # Duplicate entries are summed
+        self._counts = sparse.csr_matrix(
+            (np.concatenate(value_parts).astype(np.int64), (np.concatenate(i_parts), np.concatenate(j_parts))),
+            shape=(len(self._items), len(self._items)))
+        self._pending_purchased, self._pending_counts, self._pending_size = {}, {}, 0
+
+
+class _Positions:
+    # Position of each ID in order of first appearance, grown without copying
+
+    def __init__(self, name):
+        self.name = name
+        self._ids = []
+        self._positions = {}
+        self._index = pd.Index([], dtype=object, name=name)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, position):
+        return self._ids[position]
+
+    def get(self, value) -> int:
+        return self._positions.get(value, -1)
+
+    def add(self, values: pd.Series) -> np.ndarray:
+        # Positions of ``values``, assigning new ones to IDs not seen yet
+        codes, uniques = pd.factorize(values)
+        positions = np.empty(len(uniques), dtype=np.int64)
+        for k, value in enumerate(uniques.tolist()):
+            position = self._positions.get(value)
+            if position is None:
+                position = self._positions[value] = len(self._ids)
+                self._ids.append(value)
+            positions[k] = position
+        return positions[codes]
+
+    def ids(self, positions) -> pd.Index:
+        return pd.Index([self._ids[position] for position in positions.tolist()], dtype=object, name=self.name)
+
+    def index(self) -> pd.Index:
+        # Rebuilt only after new IDs were added
+        if len(self._index) != len(self._ids):
+            self._index = pd.Index(self._ids, dtype=object, name=self.name)
+        return self._index
+
+
+def _unique_pairs(rows, cols, n_cols):
+    keys = np.unique(rows.astype(np.int64) * max(n_cols, 1) + cols)
+    return keys // max(n_cols, 1), keys % max(n_cols, 1)
@@ -2,54 +2,99 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from src.aggregates import PurchaseAggregates
 from src.logging_utils import get_logger, log_structured
+from src.revenue_cube import RevenueCube
 
 logger = get_logger(__name__)
 
-def analyze_data(df: pd.DataFrame):
+def analyze_data(df: pd.DataFrame = None, aggregates: PurchaseAggregates = None, cube: RevenueCube = None,
+                 start_date=None, end_date=None, category=None):
     """
     Analyze the purchase data and generate insights.
 
+    Charts are not drawn here; pass the results to ``analysis_charts`` and a
+    ``ChartRenderer`` to render them in the background.
+
     Args:
         df: DataFrame with purchase data, including columns
             - CustomerID
             - ProductID
             - Category
             - PurchaseAmount
+        aggregates: Precomputed PurchaseAggregates of df (e.g. merged from
+            chunks in streaming mode). When given, df is not needed, and the
+            average spend is exact even when a cube is also given.
+        cube: RevenueCube over the unfiltered purchases. When given, the
+            insights are read from the cube for the filter below, falling
+            back to df (or aggregates) if the filter cannot be expressed
+            against it. Without aggregates, the average spend is then
+            estimated from distinct-customer sketches.
+        start_date, end_date, category: The filter_data arguments df was
+            selected with.
 
     Returns:
         dict: A dictionary containing the insights:
             - top_products: Series of top-selling products by revenue
             - category_sales: Series of top categories by revenue
             - avg_spend_per_customer: average spending per customer
+            - daily_revenue: Series of revenue by day, or None when only
+              aggregates are given
     """
+    cube_slice = None
+    if cube is not None:
+        cube_slice = cube.query(start_date, end_date, category)
+    if cube_slice is None and aggregates is None:
+        aggregates = PurchaseAggregates.from_frame(df)
+    totals = cube_slice if cube_slice is not None else aggregates
+
     # Top-selling products
-    product_sales = df.groupby("ProductID")["PurchaseAmount"].sum().sort_values(ascending=False).head(10)
+    product_sales = totals.product_sales.sort_values(ascending=False).head(10)
     log_structured(logger, "info", "Top products", top_products=product_sales.to_dict())
     #print(f"Product Sales: {product_sales}")
 
     # Top categories
-    category_sales = df.groupby("Category")["PurchaseAmount"].sum().sort_values(ascending=False)
+    category_sales = totals.category_sales.sort_values(ascending=False)
     log_structured(logger, "info", "Category sales", category_sales=category_sales.to_dict())
 
-    # Average spending per customer
-    avg_spend = df.groupby("CustomerID")["PurchaseAmount"].sum().mean()
+    # Average spending per customer; the cube's distinct-customer count is only an estimate
+    if aggregates is not None:
+        avg_spend = aggregates.customer_spending.mean()
+    else:
+        avg_spend = cube_slice.revenue / cube_slice.customer_count if cube_slice.customer_count else float("nan")
     log_structured(logger, "info", f"Average spending per customer: {avg_spend:.2f}")
 
-    # Visual Insights
-    plt.figure(figsize=(10,6))
-    sns.barplot(x=product_sales.index, y=product_sales.values)
-    plt.title("Top 10 Selling Products by Revenue")
-    plt.xlabel("Product ID")
-    plt.ylabel("Total Sales")
-    plt.tight_layout()
-    plt.savefig("data/top_products.png")
-    plt.close()
+    # Revenue trend, for the trend chart
+    if cube_slice is not None:
+        daily_revenue = cube_slice.daily_revenue
+    elif df is not None and "PurchaseDate" in df.columns:
+        daily_revenue = df.groupby(df["PurchaseDate"].dt.floor("D"))["PurchaseAmount"].sum()
+    else:
+        daily_revenue = None
 
     return {
         "top_products": product_sales,
         "category_sales": category_sales,
-        "avg_spend_per_customer": avg_spend
+        "avg_spend_per_customer": avg_spend,
+        "daily_revenue": daily_revenue
+    }
+
+def analysis_charts(analysis_results: dict, cluster_df: pd.DataFrame = None) -> dict:
+    """
+    The data of every chart for the analysis results, as ``ChartRenderer.render_all`` takes it.
+
+    Args:
+        analysis_results: Output of analyze_data.
+        cluster_df: Output of create_customer_clusters, for the segment chart.
+
+    Returns:
+        dict: Chart kind -> Series to plot.
+    """
+    charts = {
+        "top_products": analysis_results["top_products"],
+        "category_sales": analysis_results["category_sales"],
+        "revenue_trend": analysis_results.get("daily_revenue"),
     }
+    if cluster_df is not None:
+        charts["segment_sizes"] = cluster_df["ClusterLabel"].value_counts(sort=False).sort_index()
+    return charts
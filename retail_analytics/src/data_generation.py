@@ -1,97 +1,198 @@
-import uuid
-import random
-import csv
-from datetime import datetime, timedelta
+import argparse
+import os
+from datetime import date
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 
 CATEGORIES = ["Electronics", "Books", "Clothing", "Home", "Toys"]
 NUM_CUSTOMERS = 500
 NUM_PRODUCTS = 50
 NUM_PURCHASES = 5000
 
-def generate_customers():
+# Shape of the synthetic distributions
+ZIPF_EXPONENT = 1.1          # product popularity ~ 1 / rank**ZIPF_EXPONENT
+ACTIVITY_SIGMA = 1.0         # lognormal spread of how often customers buy
+SPEND_SIGMA = 0.5            # lognormal spread of how much customers spend per purchase
+PRICE_MEDIAN = 60.0          # median list price of a product
+PRICE_SIGMA = 0.8
+AMOUNT_RANGE = (5.0, 5000.0)
+HISTORY_DAYS = 366           # purchase dates span the last year, as before
+
+def generate_customers(num_customers=NUM_CUSTOMERS, rng=None):
     """
-    Generate a list of unique customer IDs.
+    Generate unique customer IDs.
+
+    The IDs are 8 hexadecimal characters, like the first 8 characters of a
+    UUID4, drawn without replacement from the generator.
+
+    Args:
+        num_customers: Number of customers.
+        rng: numpy Generator; a fresh unseeded one if omitted.
 
-    The customer IDs are just the first 8 characters of a UUID4.
+    Returns:
+        np.ndarray: Customer IDs as strings.
     """
-    customers = []
-    for _ in range(NUM_CUSTOMERS):
-        customer_id = str(uuid.uuid4())[:8]  # short unique ID
-        customers.append(customer_id)
-    return customers
+    rng = rng or np.random.default_rng()
+    ids = rng.choice(1 << 32, size=num_customers, replace=False).astype(">u4")
+    # Hex-encode all IDs at once and split the string into 8-character pieces
+    hex_ids = np.frombuffer(ids.tobytes().hex().encode("ascii"), dtype="S8")
+    return hex_ids.astype(str)
 
-def generate_products():
+def generate_products(num_products=NUM_PRODUCTS, rng=None):
     """
-    Generate a list of products with unique IDs and random categories.
+    Generate products with unique IDs, random categories and list prices.
+
+    The product IDs are formatted as 'PXXX', zero-padded to at least three
+    digits. Each product is randomly assigned to a category from CATEGORIES.
 
-    The product IDs are formatted as 'PXXX', where XXX represents a three-digit number.
-    Each product is randomly assigned to a category from the predefined CATEGORIES list.
+    Args:
+        num_products: Number of products.
+        rng: numpy Generator; a fresh unseeded one if omitted.
 
     Returns:
-        list: A list of tuples, each containing a product ID and its category.
+        tuple: (product IDs, categories, list prices) as arrays.
     """
-    products = []
-    for i in range(NUM_PRODUCTS):
-        product_id = f"P{i:03d}"  # Create a unique product ID
-        category = random.choice(CATEGORIES)  # Randomly select a category
-        products.append((product_id, category))  # Add the product to the list
-    return products
-
-def generate_purchases(customers, products):
+    rng = rng or np.random.default_rng()
+    width = max(3, len(str(num_products - 1)))
+    product_ids = np.char.add("P", np.char.zfill(np.arange(num_products).astype(str), width))
+    categories = np.asarray(CATEGORIES)[rng.integers(0, len(CATEGORIES), num_products)]
+    prices = rng.lognormal(np.log(PRICE_MEDIAN), PRICE_SIGMA, num_products)
+    return product_ids, categories, prices
+
+def seasonal_day_weights(end_date: date, days=HISTORY_DAYS):
     """
-    Generate a list of purchases, where each purchase is a tuple representing the customer ID,
-    product ID, category, purchase amount, and purchase date.
+    Relative purchase volume for each of the ``days`` days ending at ``end_date``.
+
+    Weekends sell 30% more than weekdays, and there is a yearly cycle
+    peaking in late November / December.
 
-    The purchases are randomly distributed across the customers and products, with random
-    purchase amounts and dates within the last year.
+    Returns:
+        tuple: (dates as datetime64[D], probabilities summing to 1)
+    """
+    dates = np.datetime64(end_date, "D") - np.arange(days)
+    weekday = (dates.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday; Monday == 0
+    day_of_year = (dates - dates.astype("datetime64[Y]")).astype(np.int64)
+    weights = (1.0 + 0.3 * (weekday >= 5)) * (1.0 + 0.4 * np.cos(2 * np.pi * (day_of_year - 345) / 365.25))
+    return dates, weights / weights.sum()
+
+def generate_purchases(customers, products, num_purchases=NUM_PURCHASES, rng=None,
+                       chunksize=1_000_000, end_date=None):
+    """
+    Generate purchases in chunks of at most ``chunksize`` rows.
+
+    Product popularity follows a Zipf law over a random ranking of the
+    products. How often a customer buys and how much they spend per purchase
+    are both lognormal per customer, so a minority of customers account for
+    most of the revenue. Dates follow ``seasonal_day_weights``.
 
     Args:
-        customers: A list of unique customer IDs.
-        products: A list of tuples, each containing a product ID and its category.
+        customers: Customer IDs from generate_customers.
+        products: (product IDs, categories, prices) from generate_products.
+        num_purchases: Total number of purchases.
+        rng: numpy Generator; a fresh unseeded one if omitted.
+        chunksize: Maximum rows per chunk; bounds memory use.
+        end_date: Latest purchase date (datetime.date); defaults to today.
+
+    Yields:
+        pa.Table: Columns CustomerID, ProductID, Category, PurchaseAmount
+        and PurchaseDate (date32).
+    """
+    rng = rng or np.random.default_rng()
+    product_ids, categories, prices = products
+    product_weights = np.empty(len(product_ids))
+    product_weights[rng.permutation(len(product_ids))] = 1.0 / np.arange(1, len(product_ids) + 1) ** ZIPF_EXPONENT
+    product_cdf = np.cumsum(product_weights / product_weights.sum())
+    customer_cdf = np.cumsum(rng.lognormal(0.0, ACTIVITY_SIGMA, len(customers)))
+    customer_cdf /= customer_cdf[-1]
+    spend_levels = rng.lognormal(0.0, SPEND_SIGMA, len(customers))
+    dates, day_probabilities = seasonal_day_weights(end_date or date.today())
+    day_cdf = np.cumsum(day_probabilities)
+    # Arrow copies of the lookup tables; each chunk takes from them without building Python strings
+    customer_table, product_table, category_table = pa.array(customers), pa.array(product_ids), pa.array(categories)
+
+    for start in range(0, num_purchases, chunksize):
+        size = min(chunksize, num_purchases - start)
+        # Inverse-CDF sampling; clip guards against the cdf ending just below 1.0
+        product = np.minimum(np.searchsorted(product_cdf, rng.random(size), side="right"), len(product_ids) - 1)
+        customer = np.minimum(np.searchsorted(customer_cdf, rng.random(size), side="right"), len(customers) - 1)
+        day = np.minimum(np.searchsorted(day_cdf, rng.random(size), side="right"), len(dates) - 1)
+        amounts = prices[product] * spend_levels[customer] * rng.uniform(0.8, 1.2, size)
+        amounts = np.clip(amounts, *AMOUNT_RANGE).round(2)
+        yield pa.table({
+            "CustomerID": customer_table.take(customer),
+            "ProductID": product_table.take(product),
+            "Category": category_table.take(product),
+            "PurchaseAmount": pa.array(amounts),
+            "PurchaseDate": pa.array(dates[day]),
+        })
+
+def save_to_csv(customers, products, purchases, output_dir="data", parquet=False):
+    """
+    Write customers.csv, products.csv and purchases.csv (and, with
+    ``parquet``, purchases.parquet) to ``output_dir``.
+
+    Purchases are written chunk by chunk as they are generated, so memory use
+    does not grow with the number of purchases.
 
     Returns:
-        list: A list of tuples, each containing the customer ID, product ID, category,
-        purchase amount, and purchase date.
+        int: Number of purchases written.
     """
-    purchases = []
-    today = datetime.now()
-    for _ in range(NUM_PURCHASES):
-        customer_id = random.choice(customers)
-        product_id, category = random.choice(products)
-        purchase_amount = round(random.uniform(5, 500), 2)
-        days_offset = random.randint(0, 365)
-        purchase_date = today - timedelta(days=days_offset)
-        purchases.append((customer_id, product_id, category, purchase_amount, purchase_date))
-    return purchases
-
-def save_to_csv(customers, products, purchases):
-    # Save customers
-    with open('data/customers.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["CustomerID"])
-        for c in customers:
-            writer.writerow([c])
-
-    # Save products
-    with open('data/products.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["ProductID", "Category"])
-        for p in products:
-            writer.writerow(list(p))
-
-    # Save purchases
-    with open('data/purchases.csv', 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["CustomerID", "ProductID", "Category", "PurchaseAmount", "PurchaseDate"])
-        for pur in purchases:
-            writer.writerow([pur[0], pur[1], pur[2], pur[3], pur[4].strftime("%Y-%m-%d")])
-
-def main():
-    customers = generate_customers()
-    products = generate_products()
-    purchases = generate_purchases(customers, products)
-    save_to_csv(customers, products, purchases)
+    os.makedirs(output_dir, exist_ok=True)
+    product_ids, categories, _ = products
+    for name, table in [("customers.csv", pa.table({"CustomerID": customers})),
+                        ("products.csv", pa.table({"ProductID": product_ids, "Category": categories}))]:
+        with open(os.path.join(output_dir, name), "wb") as f:
+            writer = _csv_writer(f, table)
+            writer.write_table(table)
+            writer.close()
+
+    csv_writer = parquet_writer = None
+    row_count = 0
+    with open(os.path.join(output_dir, "purchases.csv"), "wb") as f:
+        try:
+            for chunk in purchases:
+                if csv_writer is None:
+                    csv_writer = _csv_writer(f, chunk)
+                    if parquet:
+                        parquet_writer = pq.ParquetWriter(os.path.join(output_dir, "purchases.parquet"), chunk.schema)
+                csv_writer.write_table(chunk)
+                if parquet_writer is not None:
+                    parquet_writer.write_table(chunk)
+                row_count += chunk.num_rows
+        finally:
+            if csv_writer is not None:
+                csv_writer.close()
+            if parquet_writer is not None:
+                parquet_writer.close()
+    return row_count
+
+def _csv_writer(f, table):
+    # Same layout as csv.writer: an unquoted header and unquoted values,
+    # since IDs, categories and dates never contain delimiters or quotes
+    f.write((",".join(table.column_names) + "\n").encode("utf-8"))
+    return pa_csv.CSVWriter(f, table.schema,
+                            write_options=pa_csv.WriteOptions(include_header=False, quoting_style="none"))
+
+def main(num_customers=NUM_CUSTOMERS, num_products=NUM_PRODUCTS, num_purchases=NUM_PURCHASES,
+         seed=None, chunksize=1_000_000, output_dir="data", parquet=False, end_date=None):
+    rng = np.random.default_rng(seed)
+    customers = generate_customers(num_customers, rng)
+    products = generate_products(num_products, rng)
+    purchases = generate_purchases(customers, products, num_purchases, rng, chunksize=chunksize, end_date=end_date)
+    save_to_csv(customers, products, purchases, output_dir=output_dir, parquet=parquet)
     print("Synthetic data generated successfully!")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate synthetic retail data.")
+    parser.add_argument("--customers", type=int, default=NUM_CUSTOMERS)
+    parser.add_argument("--products", type=int, default=NUM_PRODUCTS)
+    parser.add_argument("--purchases", type=int, default=NUM_PURCHASES)
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible output.")
+    parser.add_argument("--chunksize", type=int, default=1_000_000, help="Purchases generated and written at a time.")
+    parser.add_argument("--output-dir", default="data")
+    parser.add_argument("--parquet", action="store_true", help="Also write purchases.parquet.")
+    args = parser.parse_args()
+    main(args.customers, args.products, args.purchases, seed=args.seed, chunksize=args.chunksize,
+         output_dir=args.output_dir, parquet=args.parquet)
@@ -3,25 +3,79 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
 import pandas as pd
 import datetime
-import re
+from contextlib import nullcontext
+from src.columnar_cache import is_cache_valid, read_cached_frame, write_cached_frame
+from src.encrypted_files import is_encrypted_file, open_encrypted, plaintext_name
+from src.filters import sanitize_category
 from src.logging_utils import get_logger, log_structured
 
 logger = get_logger(__name__)
 
-def load_and_validate_purchases(purchases_file: str) -> pd.DataFrame:
-    try:
-        df = pd.read_csv(purchases_file)
-        # Basic Schema Checks
-        required_columns = ["CustomerID", "ProductID", "Category", "PurchaseAmount", "PurchaseDate"]
-        if not all(col in df.columns for col in required_columns):
-            raise ValueError("Purchases file schema does not match expected format.")
+REQUIRED_COLUMNS = ["CustomerID", "ProductID", "Category", "PurchaseAmount", "PurchaseDate"]
+
+def validate_purchases(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the purchases schema checks and type coercions to a raw frame.
+
+    Rows whose PurchaseDate cannot be parsed are dropped in place.
+    """
+    # Basic Schema Checks
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        raise ValueError("Purchases file schema does not match expected format.")
+
+    # Convert dates
+    df["PurchaseDate"] = pd.to_datetime(df["PurchaseDate"], errors="coerce")
+    df.dropna(subset=["PurchaseDate"], inplace=True)
+
+    # Basic type checks
+    df["PurchaseAmount"] = df["PurchaseAmount"].astype(float)
+    return df
 
-        # Convert dates
-        df["PurchaseDate"] = pd.to_datetime(df["PurchaseDate"], errors="coerce")
-        df.dropna(subset=["PurchaseDate"], inplace=True)
+def load_and_validate_purchases(purchases_file: str, cache_dir=None, columns=None) -> pd.DataFrame:
+    """
+    Load the purchases CSV and validate its schema and types.
 
-        # Basic type checks
-        df["PurchaseAmount"] = df["PurchaseAmount"].astype(float)
+    Parameters
+    ----------
+    purchases_file : str
+        Path of the purchases CSV, or of a Parquet file with the same columns
+        (e.g. from ``data_generation.py --parquet``). Either may be encrypted
+        at rest (``encrypted_files``, e.g. "purchases.csv.enc"); it is then
+        decrypted chunk by chunk while it is parsed.
+    cache_dir : str, optional
+        Directory for a columnar (Parquet) cache of the validated frame. When
+        set, the CSV is only parsed and validated if it changed since the
+        cache was written. Ignored for encrypted files, since the cache
+        would hold their plaintext.
+    columns : list of str, optional
+        Columns to return, e.g. ``["CustomerID", "ProductID", "PurchaseAmount"]``
+        for clustering. With a warm cache only these columns are read.
+
+    Returns
+    -------
+    pd.DataFrame
+        Validated purchases.
+    """
+    try:
+        encrypted = is_encrypted_file(purchases_file)
+        if encrypted and cache_dir:
+            log_structured(logger, "info", "Columnar cache skipped for encrypted purchases file",
+                           purchases_file=purchases_file)
+            cache_dir = None
+        if cache_dir and is_cache_valid(purchases_file, cache_dir):
+            df = read_cached_frame(purchases_file, cache_dir, columns=columns)
+            log_structured(logger, "info", "Loaded purchases from columnar cache", row_count=df.shape[0])
+            return df
+
+        with open_encrypted(purchases_file) if encrypted else nullcontext(purchases_file) as source:
+            if plaintext_name(purchases_file).endswith(".parquet"):
+                df = validate_purchases(pd.read_parquet(source))
+            else:
+                df = validate_purchases(pd.read_csv(source))
+        if cache_dir:
+            write_cached_frame(df, purchases_file, cache_dir)
+        if columns is not None:
+            df = df[columns]
 
         log_structured(logger, "info", "Loaded and validated purchases data", row_count=df.shape[0])
         return df
@@ -29,17 +83,83 @@ def load_and_validate_purchases(purchases_file: str) -> pd.DataFrame:
         log_structured(logger, "error", f"Error loading purchases file: {e}")
         raise
 
-def filter_data(df: pd.DataFrame, start_date=None, end_date=None, category=None) -> pd.DataFrame:
-    filtered_df = df.copy()
-    if start_date:
-        filtered_df = filtered_df[filtered_df["PurchaseDate"] >= pd.to_datetime(start_date)]
-    if end_date:
-        filtered_df = filtered_df[filtered_df["PurchaseDate"] <= pd.to_datetime(end_date)]
-    if category:
-        # Sanitization: allow only alphanumeric/spaces to prevent injection
-        category_sanitized = re.sub(r'[^a-zA-Z0-9\s]+', '', category)
-        filtered_df = filtered_df[filtered_df["Category"] == category_sanitized]
+def iter_purchase_chunks(purchases_file: str, chunksize=500_000):
+    """
+    Read and validate the purchases CSV in bounded-size chunks.
+
+    Each chunk goes through the same checks as ``load_and_validate_purchases``,
+    so peak memory tracks ``chunksize`` rather than the size of the file.
+
+    Parameters
+    ----------
+    purchases_file : str
+        Path of the purchases CSV, possibly encrypted at rest; only one
+        decrypted chunk of the file is held in memory at a time.
+    chunksize : int
+        Number of CSV rows per chunk.
+
+    Yields
+    ------
+    pd.DataFrame
+        Validated chunk of purchases.
+    """
+    try:
+        row_count = 0
+        encrypted = is_encrypted_file(purchases_file)
+        with open_encrypted(purchases_file) if encrypted else nullcontext(purchases_file) as source, \
+                pd.read_csv(source, chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunk = validate_purchases(chunk)
+                row_count += chunk.shape[0]
+                yield chunk
+        log_structured(logger, "info", "Streamed and validated purchases data", row_count=row_count, chunksize=chunksize)
+    except Exception as e:
+        log_structured(logger, "error", f"Error streaming purchases file: {e}")
+        raise
+
+def filter_data(df: pd.DataFrame, start_date=None, end_date=None, category=None, index=None) -> pd.DataFrame:
+    """
+    Filter purchases by an inclusive date range and/or a category.
+
+    All predicates are combined into a single mask, so only the selected rows
+    are copied. The result is always a new frame (a full copy when there
+    are no predicates), so callers may modify it without touching ``df``.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Validated purchases.
+    start_date, end_date : str, optional
+        Inclusive PurchaseDate bounds.
+    category : str, optional
+        Category to keep; sanitized to alphanumerics and spaces.
+    index : PurchaseIndex, optional
+        Index built over ``df`` (see ``src.query_index``). When given, the
+        rows are found by binary search and category lookup instead of masks.
+
+    Returns
+    -------
+    pd.DataFrame
+        The filtered purchases.
+    """
+    category_sanitized = sanitize_category(category) if category else None
+
+    if index is not None:
+        filtered_df = index.select(start_date, end_date, category).frame(copy=True)
+    else:
+        mask = None
+        if start_date:
+            mask = _and(mask, df["PurchaseDate"] >= pd.to_datetime(start_date))
+        if end_date:
+            mask = _and(mask, df["PurchaseDate"] <= pd.to_datetime(end_date))
+        if category:
+            # Sanitization: allow only alphanumeric/spaces to prevent injection
+            mask = _and(mask, df["Category"] == category_sanitized)
+        filtered_df = df.copy() if mask is None else df[mask]
 
     log_structured(logger, "info", "Data filtered", 
-                   start_date=start_date, end_date=end_date, category=category_sanitized if category else None)
+                   start_date=start_date, end_date=end_date, category=category_sanitized)
     return filtered_df
+
+def _and(mask, condition):
+    return condition if mask is None else mask & condition
@@ -0,0 +1,261 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import argparse
+import io
+import struct
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from src import security
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+# File layout: header, then chunks of [plaintext length][ciphertext][GCM tag].
+# Every chunk but the last holds exactly chunk_size bytes of plaintext.
+MAGIC = b"RAENC\x00\x00\x01"
+HEADER = struct.Struct(">8sI8s")      # magic, chunk size, random nonce prefix
+CHUNK_HEADER = struct.Struct(">I")    # plaintext length of the chunk
+NONCE_SUFFIX = struct.Struct(">I")    # chunk index
+CHUNK_AAD = struct.Struct(">I?")      # chunk index, last chunk
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 1 << 20
+ENCRYPTED_SUFFIX = ".enc"
+
+
+def _aes_key(key=None) -> bytes:
+    key = security.SECRET_KEY if key is None else key
+    key = key.encode("utf-8") if isinstance(key, str) else bytes(key)
+    if len(key) not in (16, 24, 32):
+        raise ValueError("The encryption key (SECRET_KEY) must be 16, 24 or 32 bytes long.")
+    return key
+
+
+def _chunk_cipher(key: bytes, header: bytes, nonce_prefix: bytes, index: int, last: bool):
+    # A chunk's nonce is unique within the file, and the header, index and
+    # last-chunk flag are authenticated with it, so chunks cannot be swapped,
+    # moved between files, dropped from the end or appended
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce_prefix + NONCE_SUFFIX.pack(index), mac_len=TAG_SIZE)
+    cipher.update(header + CHUNK_AAD.pack(index, last))
+    return cipher
+
+
+def is_encrypted_file(path: str) -> bool:
+    """
+    Whether ``path`` is in the encrypted-at-rest format (checked by its magic bytes).
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class EncryptingWriter(io.RawIOBase):
+    """
+    Writable binary stream that encrypts to ``path`` in the chunked format.
+
+    Plaintext is buffered one chunk at a time and each chunk is sealed with
+    AES-GCM as soon as the next one starts, so memory stays at about
+    ``chunk_size`` whatever the amount written. The file is only valid once
+    closed, when the last chunk is written.
+    """
+
+    def __init__(self, path: str, key=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__()
+        self._key = _aes_key(key)
+        self.chunk_size = chunk_size
+        self._nonce_prefix = get_random_bytes(8)
+        self._header = HEADER.pack(MAGIC, chunk_size, self._nonce_prefix)
+        self._file = open(path, "wb")
+        self._file.write(self._header)
+        self._buffer = bytearray()
+        self._index = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        # Keep at least one byte back: the last chunk is only known at close
+        while len(self._buffer) > self.chunk_size:
+            self._seal(bytes(self._buffer[:self.chunk_size]), last=False)
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _seal(self, plaintext: bytes, last: bool):
+        cipher = _chunk_cipher(self._key, self._header, self._nonce_prefix, self._index, last)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        self._file.write(CHUNK_HEADER.pack(len(plaintext)) + ciphertext + tag)
+        self._index += 1
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._seal(bytes(self._buffer), last=True)
+                self._buffer.clear()
+            finally:
+                self._file.close()
+        super().close()
+
+
+class DecryptingReader(io.RawIOBase):
+    """
+    Readable, seekable binary stream over a file in the chunked format.
+
+    Only the chunk being read is decrypted and held in memory. Every chunk is
+    authenticated before any of its bytes are returned, so tampered,
+    reordered or truncated files raise ``ValueError`` instead of yielding
+    altered data. Seeking jumps straight to the chunk holding the position,
+    which lets Parquet readers fetch only the parts they need.
+    """
+
+    def __init__(self, path: str, key=None):
+        super().__init__()
+        self._key = _aes_key(key)
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._header = self._file.read(HEADER.size)
+            if len(self._header) != HEADER.size:
+                raise ValueError(f"{path} is not an encrypted purchases file.")
+            magic, self.chunk_size, self._nonce_prefix = HEADER.unpack(self._header)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not an encrypted purchases file.")
+
+            self._record_size = CHUNK_HEADER.size + self.chunk_size + TAG_SIZE
+            body_size = os.fstat(self._file.fileno()).st_size - HEADER.size
+            self.chunk_count = max(1, -(-body_size // self._record_size))
+            self._file.seek(HEADER.size + (self.chunk_count - 1) * self._record_size)
+            last_length = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size) or b"\xff" * 4)[0]
+            if last_length > self.chunk_size:
+                raise ValueError(f"{path} is truncated or corrupt.")
+            self.size = (self.chunk_count - 1) * self.chunk_size + last_length
+        except BaseException:
+            self._file.close()
+            raise
+        self._position = 0
+        self._chunk_index = None
+        self._chunk = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence=io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        if base + offset < 0:
+            raise ValueError("Negative seek position.")
+        self._position = base + offset
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.size:
+            return 0
+        index, offset = divmod(self._position, self.chunk_size)
+        chunk = self._read_chunk(index)
+        count = min(len(buffer), len(chunk) - offset)
+        buffer[:count] = chunk[offset:offset + count]
+        self._position += count
+        return count
+
+    def _read_chunk(self, index: int) -> bytes:
+        if index != self._chunk_index:
+            self._file.seek(HEADER.size + index * self._record_size)
+            record = self._file.read(self._record_size)
+            length = CHUNK_HEADER.unpack_from(record)[0] if len(record) >= CHUNK_HEADER.size else -1
+            last = index == self.chunk_count - 1
+            if length < 0 or len(record) != CHUNK_HEADER.size + length + TAG_SIZE or (not last and length != self.chunk_size):
+                raise ValueError(f"Chunk {index} of {self.path} is truncated or corrupt.")
+            ciphertext = record[CHUNK_HEADER.size:CHUNK_HEADER.size + length]
+            tag = record[CHUNK_HEADER.size + length:]
+            cipher = _chunk_cipher(self._key, self._header, self._nonce_prefix, index, last)
+            try:
+                self._chunk = cipher.decrypt_and_verify(ciphertext, tag)
+            except ValueError:
+                raise ValueError(f"Chunk {index} of {self.path} failed authentication "
+                                 "(wrong key, or the file was modified).") from None
+            self._chunk_index = index
+        return self._chunk
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._chunk = b""
+        super().close()
+
+
+def open_encrypted(path: str, mode="rb", key=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Open a file in the encrypted-at-rest format as a buffered binary stream.
+
+    Parameters
+    ----------
+    path : str
+        File to read ("rb") or create ("wb").
+    mode : str
+        "rb" or "wb".
+    key : str or bytes, optional
+        AES key of 16, 24 or 32 bytes; defaults to SECRET_KEY.
+    chunk_size : int
+        Plaintext bytes per authenticated chunk, when writing.
+
+    Returns
+    -------
+    io.BufferedReader or io.BufferedWriter
+        Usable wherever pandas accepts a file, e.g. ``pd.read_csv`` or
+        ``df.to_csv``, so plaintext never has to be written to disk.
+    """
+    if mode == "rb":
+        reader = DecryptingReader(path, key=key)
+        return io.BufferedReader(reader, buffer_size=min(reader.chunk_size, io.DEFAULT_BUFFER_SIZE * 16))
+    if mode == "wb":
+        return io.BufferedWriter(EncryptingWriter(path, key=key, chunk_size=chunk_size))
+    raise ValueError(f"Unsupported mode '{mode}', expected 'rb' or 'wb'.")
+
+
+def encrypt_file(source_path: str, target_path=None, key=None, chunk_size=DEFAULT_CHUNK_SIZE) -> str:
+    """
+    Encrypt an existing file, streaming it chunk by chunk.
+
+    Returns the encrypted file's path (``source_path`` + ".enc" by default).
+    The target must be a different file: opening it for writing would
+    truncate the source before it is read.
+    """
+    target_path = target_path or source_path + ENCRYPTED_SUFFIX
+    if os.path.exists(target_path) and os.path.samefile(source_path, target_path):
+        raise ValueError(f"Cannot encrypt {source_path} onto itself; choose another target.")
+    with open(source_path, "rb") as source, open_encrypted(target_path, "wb", key=key, chunk_size=chunk_size) as target:
+        while True:
+            data = source.read(chunk_size)
+            if not data:
+                break
+            target.write(data)
+    log_structured(logger, "info", "Encrypted file", source_file=source_path, encrypted_file=target_path)
+    return target_path
+
+
+def plaintext_name(path: str) -> str:
+    """
+    Name of the file ``path`` encrypts, which gives its format (e.g. "purchases.parquet.enc").
+    """
+    return path[:-len(ENCRYPTED_SUFFIX)] if path.endswith(ENCRYPTED_SUFFIX) else path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt a purchases file at rest with SECRET_KEY.")
+    parser.add_argument("source", help="Plaintext CSV or Parquet file.")
+    parser.add_argument("target", nargs="?", default=None, help="Encrypted file (default: source + .enc).")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Plaintext bytes per authenticated chunk.")
+    args = parser.parse_args(argv)
+    print(encrypt_file(args.source, args.target, chunk_size=args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from src.item_knn import ItemKNN
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+DEFAULT_PARAM_GRID = {
+    "engine": ["surprise"],
+    "k": [20, 40],
+    "similarity": ["msd", "cosine"],
+    "user_based": [True],
+    "rating_scale": ["fixed"],
+}
+
+# Rating scale used by build_collaborative_filtering_model
+FIXED_RATING_SCALE = (0, 5000)
+
+
+def parameter_grid(param_grid: dict):
+    """
+    Expand a dict of lists into every combination of parameters.
+
+    Combinations that do not apply to an engine are dropped: the sparse
+    engine is always item-based and has no "msd" similarity.
+    """
+    names = sorted(param_grid)
+    for values in itertools.product(*(param_grid[name] for name in names)):
+        params = dict(zip(names, values))
+        if params.get("engine") == "sparse":
+            if params.get("similarity") == "msd" or params.get("user_based", False):
+                continue
+        yield params
+
+
+def evaluate_recommenders(df: pd.DataFrame, param_grid=None, n_splits=5, top_n=5,
+                          relevance_threshold=None, max_workers=None, random_state=42) -> pd.DataFrame:
+    """
+    K-fold cross-validation of the recommender over a parameter grid, in parallel.
+
+    Customer and product IDs are factorized to integer codes and, together
+    with the ratings and fold assignments, placed in shared memory once.
+    Each (parameters, fold) task then runs in a worker process that attaches
+    to those arrays by name instead of receiving a pickled DataFrame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with 'CustomerID', 'ProductID', 'PurchaseAmount' columns.
+    param_grid : dict, optional
+        Lists of values for "engine" ("surprise" or "sparse"), "k",
+        "similarity" ("msd", "cosine", "pearson"), "user_based" and
+        "rating_scale" ("fixed" for (0, 5000) or "data" for the observed
+        min/max). Defaults to ``DEFAULT_PARAM_GRID``.
+    n_splits : int
+        Number of folds.
+    top_n : int
+        Cut-off for precision@N and recall@N.
+    relevance_threshold : float, optional
+        A held-out purchase is relevant when its amount is at least this.
+        Defaults to the median purchase amount.
+    max_workers : int, optional
+        Worker processes; defaults to all cores.
+    random_state : int
+        Seed for the fold assignment.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per (parameters, fold) with the parameters, "fold", "rmse",
+        "precision_at_n", "recall_at_n", "fit_seconds" and "test_seconds".
+    """
+    param_grid = DEFAULT_PARAM_GRID if param_grid is None else param_grid
+    user_codes, _ = pd.factorize(df["CustomerID"])
+    item_codes, _ = pd.factorize(df["ProductID"])
+    ratings = df["PurchaseAmount"].to_numpy(dtype=float)
+    folds = np.random.default_rng(random_state).permutation(len(df)) % n_splits
+    if relevance_threshold is None:
+        relevance_threshold = float(np.median(ratings))
+
+    arrays = {
+        "users": user_codes.astype(np.int64),
+        "items": item_codes.astype(np.int64),
+        "ratings": ratings,
+        "folds": folds.astype(np.int32),
+    }
+    segments = {}
+    try:
+        specs = {}
+        for name, array in arrays.items():
+            segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            segments[name] = segment
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+            specs[name] = (segment.name, array.shape, array.dtype.str)
+
+        tasks = [(params, fold) for params in parameter_grid(param_grid) for fold in range(n_splits)]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_evaluate_fold, specs, params, fold, top_n, relevance_threshold)
+                for params, fold in tasks
+            ]
+            rows = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+    finally:
+        for segment in segments.values():
+            segment.close()
+            segment.unlink()
+
+    results = pd.DataFrame(rows)
+    best = summarize_evaluation(results).iloc[0] if rows else None
+    log_structured(logger, "info", "Recommender evaluation completed",
+                   task_count=len(tasks), n_splits=n_splits, elapsed_seconds=round(elapsed, 4),
+                   best_params=json.loads(best[sorted(param_grid)].to_json()) if best is not None else None,
+                   best_rmse=float(best["rmse"]) if best is not None else None)
+    return results
+
+
+def summarize_evaluation(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Average the per-fold metrics of ``evaluate_recommenders`` per parameter set,
+    best RMSE first.
+    """
+    metrics = ["rmse", "precision_at_n", "recall_at_n", "fit_seconds", "test_seconds"]
+    params = [column for column in results.columns if column not in metrics + ["fold"]]
+    return (
+        results.groupby(params, dropna=False)[metrics].mean()
+        .sort_values("rmse")
+        .reset_index()
+    )
+
+
+def _attach(specs):
+    segments, arrays = [], {}
+    for name, (segment_name, shape, dtype) in specs.items():
+        # Workers share the parent's resource tracker, which unlinks the segment once
+        segment = shared_memory.SharedMemory(name=segment_name)
+        segments.append(segment)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+    return segments, arrays
+
+
+def _evaluate_fold(specs, params, fold, top_n, relevance_threshold):
+    segments, arrays = _attach(specs)
+    try:
+        test_mask = arrays["folds"] == fold
+        train = pd.DataFrame({
+            "CustomerID": arrays["users"][~test_mask],
+            "ProductID": arrays["items"][~test_mask],
+            "PurchaseAmount": arrays["ratings"][~test_mask],
+        })
+        test = pd.DataFrame({
+            "CustomerID": arrays["users"][test_mask],
+            "ProductID": arrays["items"][test_mask],
+            "PurchaseAmount": arrays["ratings"][test_mask],
+        })
+        if params.get("rating_scale", "fixed") == "data":
+            rating_scale = (float(arrays["ratings"].min()), float(arrays["ratings"].max()))
+        else:
+            rating_scale = FIXED_RATING_SCALE
+    finally:
+        del arrays
+        for segment in segments:
+            segment.close()
+
+    fit_start = time.perf_counter()
+    predict = _fit(params, train, rating_scale)
+    fit_seconds = time.perf_counter() - fit_start
+
+    test_start = time.perf_counter()
+    estimates = predict(test)
+    test_seconds = time.perf_counter() - test_start
+
+    actual = test["PurchaseAmount"].to_numpy()
+    precision, recall = _precision_recall_at_n(test["CustomerID"].to_numpy(), actual, estimates,
+                                               top_n, relevance_threshold)
+    return {
+        **params,
+        "fold": fold,
+        "rmse": float(np.sqrt(np.mean((estimates - actual) ** 2))) if len(actual) else np.nan,
+        "precision_at_n": precision,
+        "recall_at_n": recall,
+        "fit_seconds": fit_seconds,
+        "test_seconds": test_seconds,
+    }
+
+
+def _fit(params, train: pd.DataFrame, rating_scale):
+    # Returns a function mapping a test frame to estimated amounts
+    engine = params.get("engine", "surprise")
+    k = params.get("k", 40)
+    if engine == "sparse":
+        algo = ItemKNN(k=k, similarity=params.get("similarity", "cosine"), rating_scale=rating_scale).fit(train)
+        return lambda test: algo.estimate_pairs(test["CustomerID"], test["ProductID"])
+
+    from surprise import Dataset, Reader, KNNBasic
+    data = Dataset.load_from_df(train, Reader(rating_scale=rating_scale))
+    algo = KNNBasic(k=k, verbose=False, sim_options={
+        "name": params.get("similarity", "msd"),
+        "user_based": params.get("user_based", True),
+    })
+    algo.fit(data.build_full_trainset())
+    return lambda test: np.array([
+        algo.predict(uid, iid).est for uid, iid in zip(test["CustomerID"], test["ProductID"])
+    ])
+
+
+def _precision_recall_at_n(users, actual, estimates, top_n, threshold):
+    """
+    Mean per-customer precision@N and recall@N over held-out purchases.
+
+    A customer's recommendations are their N highest-estimated held-out
+    purchases whose estimate reaches the threshold; relevant purchases are
+    those whose actual amount reaches it.
+    """
+    if len(users) == 0:
+        return np.nan, np.nan
+    ranked = pd.DataFrame({"user": users, "actual": actual, "est": estimates})
+    ranked = ranked.sort_values(["user", "est"], ascending=[True, False], kind="stable")
+    ranked["recommended"] = (ranked.groupby("user").cumcount() < top_n) & (ranked["est"] >= threshold)
+    ranked["relevant"] = ranked["actual"] >= threshold
+    ranked["hit"] = ranked["recommended"] & ranked["relevant"]
+
+    per_user = ranked.groupby("user")[["recommended", "relevant", "hit"]].sum().to_numpy(dtype=float)
+    recommended, relevant, hits = per_user.T
+    precision = np.divide(hits, recommended, out=np.zeros(len(hits)), where=recommended > 0)
+    recall = np.divide(hits, relevant, out=np.zeros(len(hits)), where=relevant > 0)
+    return float(precision.mean()), float(recall.mean())
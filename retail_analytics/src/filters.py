@@ -3,7 +3,14 @@
 import pandas as pd
 import re
 
-def filter_by_category(df: pd.DataFrame, category: str) -> pd.DataFrame:
+def sanitize_category(category: str) -> str:
+    """
+    Strip everything but alphanumeric characters and spaces from a category
+    name, to prevent injection through filter inputs.
+    """
+    return re.sub(r"[^a-zA-Z0-9\s]+", "", category)
+
+def filter_by_category(df: pd.DataFrame, category: str, index=None) -> pd.DataFrame:
     """
     Filter the DataFrame by a specified category.
 
@@ -13,19 +20,25 @@ def filter_by_category(df: pd.DataFrame, category: str) -> pd.DataFrame:
         The DataFrame to filter.
     category : str
         The category to filter by.
+    index : PurchaseIndex, optional
+        Index built over ``df``. When given, the rows are looked up in the
+        index instead of scanning the Category column.
 
     Returns
     -------
     pd.DataFrame
         A DataFrame filtered by the specified category.
     """
+    if index is not None:
+        return index.category(category).frame()
+
     # Sanitize the category input to allow only alphanumeric characters and spaces
-    category_sanitized = re.sub(r"[^a-zA-Z0-9\s]+", "", category)
+    category_sanitized = sanitize_category(category)
     
     # Filter the DataFrame based on the sanitized category
     return df[df["Category"] == category_sanitized]
 
-def filter_by_date_range(df: pd.DataFrame, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+def filter_by_date_range(df: pd.DataFrame, start_date: str = None, end_date: str = None, index=None) -> pd.DataFrame:
     """
     Filter the DataFrame to only include rows where the PurchaseDate is within the
     specified range.
@@ -38,12 +51,18 @@ def filter_by_date_range(df: pd.DataFrame, start_date: str = None, end_date: str
         The earliest date to include in the filter (inclusive).
     end_date : str
         The latest date to include in the filter (inclusive).
+    index : PurchaseIndex, optional
+        Index built over ``df``. When given, the range is found by binary
+        search over the sorted dates instead of comparing every row.
 
     Returns
     -------
     pd.DataFrame
         A DataFrame filtered by the specified date range.
     """
+    if index is not None:
+        return index.date_range(start_date or None, end_date or None).frame()
+
     # If a start date is provided, filter the DataFrame to include only rows
     # with a PurchaseDate greater than or equal to the start date.
     if start_date:
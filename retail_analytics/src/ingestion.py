@@ -0,0 +1,320 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import asyncio
+import csv
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from src.data_loading import REQUIRED_COLUMNS, validate_purchases
+from src.logging_utils import get_logger, log_structured
+from src.server import AnalyticsService, next_batch
+
+logger = get_logger(__name__)
+
+# ID columns arrive as strings from the purchases CSV; events are coerced to match
+ID_COLUMNS = ["CustomerID", "ProductID", "Category"]
+
+
+class FileTailSource:
+    """
+    Purchases appended to a CSV file (with a header line), read as they are written.
+
+    Only complete lines are parsed, so a row being written is picked up on
+    a later poll. A file that shrinks (truncated or replaced) is read again
+    from its header.
+
+    Parameters
+    ----------
+    path : str
+        CSV file with the purchases columns.
+    from_start : bool
+        Also emit the rows already in the file; by default only rows
+        appended after the source starts are.
+    follow : bool
+        Keep waiting for new rows at the end of the file; with False the
+        source ends there.
+    poll_interval : float
+        Seconds between checks for new rows.
+    """
+
+    def __init__(self, path: str, from_start=False, follow=True, poll_interval=0.2):
+        self.path = path
+        self.from_start = from_start
+        self.follow = follow
+        self.poll_interval = poll_interval
+
+    async def run(self, emit):
+        """
+        Call ``await emit(event)`` for every row, as a dict of column -> string.
+        ``emit`` blocking (a full queue) pauses reading.
+        """
+        while not os.path.exists(self.path):
+            if not self.follow:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+        f = open(self.path, newline="")
+        # Rows written after the source started are new, even in a file created since
+        skip_existing = not self.from_start and os.fstat(f.fileno()).st_size > 0
+        try:
+            header, pending = None, ""
+            while True:
+                line = f.readline()
+                if line.endswith("\n"):
+                    line, pending = pending + line, ""
+                    if header is None:
+                        header = next(csv.reader([line]))
+                        if skip_existing:
+                            f.seek(0, os.SEEK_END)
+                            skip_existing = False
+                    elif line.strip():
+                        await emit(dict(zip(header, next(csv.reader([line])))))
+                    continue
+
+                pending += line
+                if not self.follow:
+                    return
+                await asyncio.sleep(self.poll_interval)
+                if os.path.getsize(self.path) < f.tell():
+                    log_structured(logger, "info", "Tailed file truncated, reading it again", path=self.path)
+                    f.close()
+                    f = open(self.path, newline="")
+                    header, pending = None, ""
+        finally:
+            f.close()
+
+
+class SocketSource:
+    """
+    Purchase events sent to a local TCP port as JSON lines, one object per
+    line with the purchases columns; a local stand-in for a Kafka topic.
+
+    Each connection is read only as fast as events are taken, so when the
+    ingestion queue is full, senders block on TCP flow control.
+
+    Parameters
+    ----------
+    host : str
+    port : int
+        0 picks a free port; see ``port`` once ``started`` is set.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.started = asyncio.Event()
+
+    async def run(self, emit):
+        """
+        Call ``await emit(event)`` for every line received; lines that are
+        not JSON are passed on as None, to be counted as rejected.
+        """
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                async for line in reader:
+                    if not line.strip():
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        event = None
+                    await emit(event)
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.started.set()
+        log_structured(logger, "info", "Ingestion socket listening", host=self.host, port=self.port)
+        async with server:
+            await server.serve_forever()
+
+
+class ThroughputMeter:
+    """
+    Events per second over the last ``window`` seconds.
+    """
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.total = 0
+        self._started = time.monotonic()
+        self._counts = deque()
+
+    def add(self, count: int):
+        now = time.monotonic()
+        self._counts.append((now, count))
+        self.total += count
+        self._trim(now)
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        self._trim(now)
+        span = min(self.window, now - self._started)
+        return sum(count for _, count in self._counts) / span if span > 0 else 0.0
+
+    def _trim(self, now):
+        while self._counts and self._counts[0][0] < now - self.window:
+            self._counts.popleft()
+
+
+def validate_events(events: list) -> pd.DataFrame:
+    """
+    Turn raw purchase events into a validated frame, with the same rules as
+    ``load_and_validate_purchases``: the five purchases columns, a parseable
+    PurchaseDate (rows without one are dropped) and a numeric
+    PurchaseAmount. Events that are not objects are dropped; if a bad
+    amount fails the whole batch, events are validated one by one so only
+    the bad ones are dropped.
+    """
+    records = [event for event in events if isinstance(event, dict)]
+    frame = pd.DataFrame.from_records(records, columns=REQUIRED_COLUMNS)
+    for column in ID_COLUMNS:
+        frame[column] = frame[column].astype("str")
+    try:
+        return validate_purchases(frame)
+    except (ValueError, TypeError):
+        valid = []
+        for i in range(len(frame)):
+            try:
+                valid.append(validate_purchases(frame.iloc[[i]].copy()))
+            except (ValueError, TypeError):
+                pass
+        if not valid:
+            return frame.iloc[:0]
+        return pd.concat(valid, ignore_index=True)
+
+
+class PurchaseIngestor:
+    """
+    Feeds purchase events from a source into an ``AnalyticsService`` as they arrive.
+
+    The source puts events on a bounded queue, so a slow consumer pushes
+    back on the source instead of buffering without limit. A worker takes
+    events in batches of up to ``batch_size`` (waiting at most
+    ``max_wait_ms`` to fill one), validates them and applies them with
+    ``AnalyticsService.record_purchases`` on a worker thread, which updates
+    customer totals and co-purchase counts incrementally and invalidates
+    only the affected customers' cached recommendations. Events per second
+    are logged every ``stats_interval`` seconds and reported by ``stats``.
+
+    Sources are objects with an ``async run(emit)`` method that awaits
+    ``emit(event)`` for each event; see ``FileTailSource`` and ``SocketSource``.
+
+    Parameters
+    ----------
+    service : AnalyticsService
+    source : FileTailSource or SocketSource
+    queue_size : int
+        Events waiting to be applied before the source is paused.
+    batch_size : int
+        Most events validated and applied together.
+    max_wait_ms : float
+        Longest the first event of a batch waits for others.
+    stats_interval : float
+        Seconds between throughput log messages.
+    """
+
+    def __init__(self, service: AnalyticsService, source, queue_size=10_000, batch_size=1_000, max_wait_ms=50.0,
+                 stats_interval=10.0):
+        self.service = service
+        self.source = source
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats_interval = stats_interval
+        self.meter = ThroughputMeter()
+        self.accepted = 0
+        self.rejected = 0
+        self.invalidated = 0
+        self._queue = None
+        self._producer = None
+        self._consumer = None
+        self._executor = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        # One thread: batches are applied in arrival order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._producer = asyncio.create_task(self._produce())
+        self._consumer = asyncio.create_task(self._consume())
+        return self
+
+    async def wait_drained(self):
+        """
+        Wait until the source has ended and every event it emitted is applied.
+        """
+        await self._producer
+        await self._queue.join()
+
+    async def run(self):
+        """
+        Ingest until a finite source (e.g. ``FileTailSource(follow=False)``) ends.
+        """
+        await self.start()
+        try:
+            await self.wait_drained()
+        finally:
+            await self.close()
+
+    async def close(self):
+        for task in (self._producer, self._consumer):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._producer = self._consumer = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._log_stats()
+
+    def stats(self) -> dict:
+        return {
+            "events_per_second": round(self.meter.rate(), 3),
+            "events": self.meter.total,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "invalidated_customers": self.invalidated,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    async def _produce(self):
+        try:
+            await self.source.run(self._queue.put)
+        except Exception as e:
+            log_structured(logger, "error", "Ingestion source failed", source=type(self.source).__name__, error=str(e))
+            raise
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        last_log = loop.time()
+        while True:
+            events = await next_batch(self._queue, self.batch_size, self.max_wait)
+            try:
+                valid = validate_events(events)
+                if len(valid):
+                    result = await loop.run_in_executor(self._executor, self.service.record_purchases, valid)
+                    self.invalidated += result["invalidated"]
+                self.accepted += len(valid)
+                self.rejected += len(events) - len(valid)
+            except Exception as e:
+                self.rejected += len(events)
+                log_structured(logger, "error", "Failed to apply purchase events", events=len(events), error=str(e))
+            finally:
+                self.meter.add(len(events))
+                for _ in events:
+                    self._queue.task_done()
+            if loop.time() - last_log >= self.stats_interval:
+                self._log_stats()
+                last_log = loop.time()
+
+    def _log_stats(self):
+        log_structured(logger, "info", "Ingestion throughput", **self.stats())
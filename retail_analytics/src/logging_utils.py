@@ -1,34 +1,217 @@
+import atexit
+import copy
 import logging
+import logging.handlers
 import json
+import os
+import queue
+import random
+import threading
 import time
 import uuid
 
+LOG_FORMAT = '%(asctime)s %(name)s [%(levelname)s] %(message)s\n\n'
+
+LEVELS = {
+    "info": logging.INFO,
+    "error": logging.ERROR,
+    "warn": logging.WARNING,
+}
+
+# One correlation id per pipeline run; see new_correlation_id
+_correlation_id = str(uuid.uuid4())
+
+# Optional payload controls, off by default; see configure_structured_logging
+_max_context_chars = None
+_sample_rates = {}
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class StructuredMessage:
+    """
+    A log message whose JSON is only built when a handler formats it.
+
+    ``log_structured`` puts these on the logging queue, so ``json.dumps`` of
+    the context, and the ``max_context_chars`` cap, run on the listener
+    thread instead of the caller's. The caller only pays for a shallow copy
+    of each value (see ``snapshot_context``).
+    """
+
+    def __init__(self, timestamp, correlation_id, msg, context):
+        self.timestamp = timestamp
+        self.correlation_id = correlation_id
+        self.msg = msg
+        self.context = context
+
+    def __str__(self):
+        fields = []
+        for key, value in self.context.items():
+            fields.append(f"{json.dumps(str(key))}: {_dumps(value, _max_context_chars)}")
+        head = json.dumps({
+            "timestamp": self.timestamp,
+            "correlation_id": self.correlation_id,
+            "message": self.msg,
+        })
+        return f'{head[:-1]}, "context": {{{", ".join(fields)}}}}}'
+
+
+# Immutable values that are safe to serialize later, on the listener thread
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def snapshot_context(context: dict) -> dict:
+    """
+    Copy of ``context`` for a deferred ``StructuredMessage``.
+
+    Scalars are kept as they are and other values are copied shallowly, so
+    a dict, list or Series the caller changes after the call is logged as
+    it was at the call. Nested containers are shared with the caller, who
+    must not mutate them afterwards.
+    """
+    return {key: value if isinstance(value, _SCALARS) else _copy(value)
+            for key, value in context.items()}
+
+
+def _copy(value):
+    try:
+        return copy.copy(value)
+    except Exception:
+        # Not copyable: fall back to serializing it now
+        return _Serialized(_dumps(value))
+
+
+class _Serialized(str):
+    # JSON text of a context value that could not be copied for later
+    pass
+
+
+def _dumps(value, limit=None) -> str:
+    # Never lose the message over one value: unknown types (numpy scalars,
+    # timestamps) are written with str(), and values that still cannot be
+    # serialized are replaced by a note saying why
+    if isinstance(value, _Serialized):
+        text = str(value)
+    else:
+        try:
+            text = json.dumps(value, default=str) if limit is None else _encode_prefix(value, limit)
+        except (TypeError, ValueError) as e:
+            text = json.dumps(f"<unserializable {type(value).__name__}: {e}>")
+    if limit is not None and len(text) > limit:
+        text = json.dumps(text[:limit] + "...")
+    return text
+
+
+def _encode_prefix(value, limit: int) -> str:
+    # Encode piece by piece and stop once past the cap, so capped payloads
+    # cost about the cap rather than their full size
+    pieces, size = [], 0
+    for piece in json.JSONEncoder(default=str).iterencode(value):
+        pieces.append(piece)
+        size += len(piece)
+        if size > limit:
+            break
+    return "".join(pieces)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # Enqueue records unformatted, so formatting happens on the listener thread.
+    # In a forked child the listener thread does not exist, so emit directly.
+
+    def __init__(self, log_queue, target: logging.Handler):
+        super().__init__(log_queue)
+        self.target = target
+        self.pid = os.getpid()
+
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            self.target.handle(record)
+        else:
+            super().emit(record)
+
+
+def _stream_handler():
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return stream_handler
+
+
+def _queue_handler():
+    # Shared by every logger: one queue and one listener thread for the process
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            log_queue = queue.SimpleQueue()
+            stream_handler = _stream_handler()
+            _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+            _listener.handler = _DeferredQueueHandler(log_queue, stream_handler)
+            _listener.start()
+            atexit.register(flush_logs)
+        return _listener.handler
+
 
 def get_logger(name: str, log_level=logging.INFO):
     logger = logging.getLogger(name)
     logger.setLevel(log_level)
 
     if not logger.handlers:
-        stream_handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s %(name)s [%(levelname)s] %(message)s\n\n')
-        stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        logger.addHandler(_queue_handler())
 
     return logger
 
+
+def flush_logs():
+    """
+    Write out every queued log record and stop the listener thread. Logging
+    afterwards starts a new listener.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+
+def new_correlation_id(correlation_id=None) -> str:
+    """
+    Start a new run: every structured message logged from now on carries
+    ``correlation_id`` (a fresh uuid4 by default).
+    """
+    global _correlation_id
+    _correlation_id = correlation_id or str(uuid.uuid4())
+    return _correlation_id
+
+
+def configure_structured_logging(max_context_chars=None, sample_rates=None):
+    """
+    Limit the cost of large or frequent structured messages.
+
+    Parameters
+    ----------
+    max_context_chars : int, optional
+        Context values whose JSON is longer than this are replaced by a
+        truncated string ending in "...". Encoding stops at the cap, so
+        large values cost about this much. None keeps payloads intact.
+    sample_rates : dict, optional
+        Message -> fraction of calls to log (e.g. ``{"Data filtered": 0.1}``).
+        Messages not listed are always logged.
+    """
+    global _max_context_chars, _sample_rates
+    _max_context_chars = max_context_chars
+    _sample_rates = dict(sample_rates or {})
+
+
 def log_structured(logger, level, msg, **kwargs):
-    # Enrich with correlation id, timestamp
-    log_record = {
-        "timestamp": time.time(),
-        "correlation_id": str(uuid.uuid4()),
-        "message": msg,
-        "context": kwargs
-    }
-    if level == "info":
-        logger.info(json.dumps(log_record))
-    elif level == "error":
-        logger.error(json.dumps(log_record))
-    elif level == "warn":
-        logger.warning(json.dumps(log_record))
-    else:
-        logger.debug(json.dumps(log_record))
+    # Cheap checks first: nothing is built for disabled levels or sampled-out messages
+    levelno = LEVELS.get(level, logging.DEBUG)
+    if not logger.isEnabledFor(levelno):
+        return
+    rate = _sample_rates.get(msg)
+    if rate is not None and random.random() >= rate:
+        return
+    # Enrich with correlation id, timestamp; the context is serialized when the record is written
+    logger.log(levelno, StructuredMessage(time.time(), _correlation_id, msg, snapshot_context(kwargs)))
@@ -1,60 +1,412 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import argparse
+import contextlib
 from html import escape
-from data_generation import main as generate_data
-from data_loading import load_and_validate_purchases, filter_data
-from data_analysis import analyze_data
-from clustering import create_customer_clusters
-from recommendations import build_collaborative_filtering_model, recommend_for_customer, explain_recommendation
-from src.logging_utils import get_logger, log_structured
-from src.reporting import generate_pdf_report
+# Only lightweight modules are imported here; pandas, scikit-learn, Surprise, matplotlib
+# and pdfkit are imported by the stages that use them, so each subcommand pays only for its own
+from src.logging_utils import get_logger, log_structured, new_correlation_id
+from src.pipeline_dag import PipelineDAG
+from src.tracing import PipelineTracer
 logger = get_logger(__name__)
 
-def run_pipeline():
-    
-    # 1. Generate or Load Data
-    if not os.path.exists("data/purchases.csv"):
-        generate_data()  # only if needed
+INTERACTION_COLUMNS = ["CustomerID", "ProductID", "PurchaseAmount"]
 
-    # 2. Load & Validate
-    df = load_and_validate_purchases("data/purchases.csv")
+DEFAULT_PURCHASES_FILE = "data/purchases.csv"
 
-    # Example filter: last 6 months
-    df = filter_data(df, start_date="2024-07-01", end_date="2025-01-01")
+def resolve_purchases_file(purchases_file=DEFAULT_PURCHASES_FILE):
+    """
+    The purchases file to read: ``purchases_file``, or its encrypted-at-rest
+    copy (``purchases_file`` + ".enc") when only that exists. The loaders
+    decrypt it as they read. None when neither exists.
+    """
+    from src.encrypted_files import ENCRYPTED_SUFFIX
+
+    for path in (purchases_file, purchases_file + ENCRYPTED_SUFFIX):
+        if os.path.exists(path):
+            return path
+    return None
+
+def stream_filtered_purchases(purchases_file, chunksize, max_interactions=None, **filters):
+    """
+    Stream the purchases file chunk by chunk, filtering and aggregating as it goes.
+
+    Only the mergeable aggregates and the (CustomerID, ProductID, PurchaseAmount)
+    interactions the recommender trains on are kept; the remaining columns of
+    each chunk are dropped once it has been aggregated.
+
+    The aggregates are exact and bounded by the number of customers and
+    products. The interactions grow with the filtered rows unless
+    ``max_interactions`` is set: then a uniform sample of that many rows is
+    kept (bottom-k on seeded random keys, so runs are repeatable), and
+    memory stays at about twice that many rows whatever the file size.
+
+    Returns
+    -------
+    interactions : pd.DataFrame
+        Filtered purchases (or a sample of them) restricted to the recommender's columns.
+    aggregates : PurchaseAggregates
+        Totals over all filtered purchases.
+    """
+    from data_loading import filter_data, iter_purchase_chunks
+    from src.aggregates import PurchaseAggregates
+
+    aggregates = PurchaseAggregates()
+
+    def filtered_interactions():
+        nonlocal aggregates
+        for chunk in iter_purchase_chunks(purchases_file, chunksize=chunksize):
+            chunk = filter_data(chunk, **filters)
+            aggregates = aggregates.merge(PurchaseAggregates.from_frame(chunk))
+            yield chunk[INTERACTION_COLUMNS]
+
+    interactions = collect_interactions(filtered_interactions(), max_interactions)
+    return interactions, aggregates
+
+def collect_interactions(frames, max_interactions=None):
+    """
+    Concatenate interaction frames read one at a time, or, with
+    ``max_interactions``, keep a uniform sample of that many rows (bottom-k
+    on seeded random keys) while holding at most about twice that many.
+    An empty input gives an empty frame with the interaction columns.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    interactions, keys = [], []
+    for frame in frames:
+        interactions.append(frame)
+        if max_interactions is not None:
+            keys.append(rng.random(len(frame)))
+            if sum(len(frame) for frame in interactions) > 2 * max_interactions:
+                interactions, keys = _smallest_keys(interactions, keys, max_interactions)
+    if max_interactions is not None and interactions:
+        interactions, keys = _smallest_keys(interactions, keys, max_interactions)
+    if not interactions:
+        return pd.DataFrame(columns=INTERACTION_COLUMNS)
+    return pd.concat(interactions, ignore_index=True)
+
+def _smallest_keys(frames, keys, k):
+    # Keep the k rows with the smallest keys, in file order
+    import numpy as np
+    import pandas as pd
+
+    frame, keys = pd.concat(frames, ignore_index=True), np.concatenate(keys)
+    if len(frame) > k:
+        keep = np.sort(np.argpartition(keys, k - 1)[:k]) if k > 0 else np.array([], dtype=np.intp)
+        frame, keys = frame.iloc[keep].reset_index(drop=True), keys[keep]
+    return [frame], [keys]
+
+def absorb_purchase_files(state_dir="data/state", incoming_dir="data/incoming", max_interactions=None,
+                          purchases_file=DEFAULT_PURCHASES_FILE, chunksize=500_000):
+    """
+    Bring the persisted analytics state up to date with ``purchases_file``
+    and any daily drops in ``incoming_dir`` (.csv, or .csv.enc when encrypted
+    at rest), reading only rows not yet absorbed.
+
+    Only the totals are updated incrementally. The recommender has no
+    partial fit, so when new rows arrive it is retrained on the interactions
+    of the whole absorbed history (or a ``max_interactions`` sample of
+    them), read back from the state's Parquet parts one part at a time.
+
+    Returns
+    -------
+    interactions : pd.DataFrame
+        (CustomerID, ProductID, PurchaseAmount) of all absorbed purchases, or a sample of them.
+    aggregates : PurchaseAggregates
+        Totals over all absorbed purchases.
+    """
+    from src.analytics_state import AnalyticsState
+
+    state = AnalyticsState.load(state_dir)
+    purchase_files = [purchases_file]
+    if os.path.isdir(incoming_dir):
+        purchase_files += sorted(os.path.join(incoming_dir, name)
+                                 for name in os.listdir(incoming_dir) if name.endswith((".csv", ".csv.enc")))
+    # New rows are parsed chunksize rows at a time
+    new_rows = sum(state.absorb(path, chunksize=chunksize) for path in purchase_files)
+    if new_rows:
+        state.save()
+    return collect_interactions(state.interaction_parts(), max_interactions), state.aggregates
+
+def load_purchases(streaming, chunksize, incremental, filters, max_interactions=None,
+                   purchases_file=DEFAULT_PURCHASES_FILE):
+    """
+    Load stage: the filtered purchases plus the totals and cube built from them.
+
+    Returns
+    -------
+    dict
+        "df" (purchases, or only the recommender's columns when streaming or
+        incremental), "aggregates" and "cube" (None unless loaded in memory).
+    """
+    from data_loading import load_and_validate_purchases, filter_data
+    from src.aggregates import PurchaseAggregates
+    from src.revenue_cube import load_or_build_cube
+
+    cube = None
+    if incremental:
+        # Totals over the full history, updated with only the newly arrived rows
+        df, aggregates = absorb_purchase_files(max_interactions=max_interactions, purchases_file=purchases_file,
+                                               chunksize=chunksize)
+    elif streaming:
+        df, aggregates = stream_filtered_purchases(purchases_file, chunksize,
+                                                   max_interactions=max_interactions, **filters)
+    else:
+        df = load_and_validate_purchases(purchases_file, cache_dir="data/cache")
+        # Daily revenue cube over all purchases, rebuilt only when the file changes
+        cube = load_or_build_cube(purchases_file, df, cache_dir="data/cache")
+        df = filter_data(df, **filters)
+        # Single scan of the purchases shared by analysis and clustering
+        aggregates = PurchaseAggregates.from_frame(df)
+    return {"df": df, "aggregates": aggregates, "cube": cube}
+
+def analyze_stage(loaded, filters):
+    from data_analysis import analyze_data
+
+    # Slices come from the cube when there is one; the average spend always from the exact totals
+    return analyze_data(loaded["df"], aggregates=loaded["aggregates"], cube=loaded["cube"], **filters)
+
+def cluster_stage(loaded, models_dir):
+    from clustering import create_customer_clusters
+    from src.model_store import ModelStore
 
-    # 3. Analyze Data
-    analysis_results = analyze_data(df)
-    print(analysis_results)
+    # Trained models are reused while the filtered data is unchanged
+    return create_customer_clusters(loaded["df"], aggregates=loaded["aggregates"], model_store=ModelStore(models_dir))
 
-    # 4. Clustering
-    cluster_df = create_customer_clusters(df)
+def recommend_stage(loaded, models_dir, customer_id=None):
+    from recommendations import build_collaborative_filtering_model, recommend_for_customer, explain_recommendation
+    from src.model_store import ModelStore
 
-    # 5. Recommendation
-    algo = build_collaborative_filtering_model(df)
-    sample_customer_id = df["CustomerID"].iloc[0]
-    recs = recommend_for_customer(algo, sample_customer_id, df)
-    explanation = explain_recommendation(sample_customer_id, recs)
+    df = loaded["df"]
+    algo = build_collaborative_filtering_model(df, model_store=ModelStore(models_dir))
+    if customer_id is None:
+        customer_id = df["CustomerID"].iloc[0]
+    recs = recommend_for_customer(algo, customer_id, df)
+    explanation = explain_recommendation(customer_id, recs)
+    return customer_id, recs, explanation
 
-    # 6. Report
-    def format_recommendations(sample_customer_id, recs, explanation):
+def format_recommendations(sample_customer_id, recs, explanation):
     # Convert the recommendations to an HTML table
-        recommendations_html = f"<h3>Recommendations for Customer {escape(sample_customer_id)}</h3>"
-        recommendations_html += "<table border='1' cellpadding='10'><thead><tr><th>Product ID</th><th>Predicted Purchase Amount</th></tr></thead><tbody>"
-        
-        for product_id, predicted_amount in recs:
-            recommendations_html += f"<tr><td>{escape(product_id)}</td><td>${predicted_amount:,.2f}</td></tr>"
-        
-        recommendations_html += "</tbody></table>"
-        recommendations_html += f"<p><strong>Explanation:</strong> {escape(explanation)}</p>"
-        
-        return recommendations_html
+    recommendations_html = f"<h3>Recommendations for Customer {escape(sample_customer_id)}</h3>"
+    recommendations_html += "<table border='1' cellpadding='10'><thead><tr><th>Product ID</th><th>Predicted Purchase Amount</th></tr></thead><tbody>"
+    
+    for product_id, predicted_amount in recs:
+        recommendations_html += f"<tr><td>{escape(product_id)}</td><td>${predicted_amount:,.2f}</td></tr>"
+    
+    recommendations_html += "</tbody></table>"
+    recommendations_html += f"<p><strong>Explanation:</strong> {escape(explanation)}</p>"
+    
+    return recommendations_html
+
+def report_stage(cluster_df, analysis_results, recommendation, charts, loaded=None,
+                 customer_tables=False, pdf=False, pdf_timeout=120, max_workers=None):
+    """
+    Report stage: the summary report, plus one report per category when the
+    loaded purchases are passed, all written concurrently. With ``pdf``, each
+    report is converted by wkhtmltopdf in a bounded pool of subprocesses.
 
+    ``charts`` are the chart stage's futures; the report waits for them, so
+    it (and its PDF) only links images that are fully written.
+    """
+    from src.charts import wait_for_charts
+    from src.reporting import PdfConverter, category_report_jobs, render_reports
 
-    recommendations_text = format_recommendations(sample_customer_id, recs, explanation)
+    chart_files = wait_for_charts(charts)
+    recommendations_text = format_recommendations(*recommendation)
 
     #recommendations_text = f"Customer {sample_customer_id} => Recommendations: {recs}\n, Explanation: {explanation}"
-    generate_pdf_report(analysis_results, cluster_df, recommendations_text)
+    jobs = {"summary": {"analysis_results": analysis_results, "cluster_df": cluster_df,
+                        "recommendations": recommendations_text, "chart_files": chart_files,
+                        "customer_tables": customer_tables}}
+    if loaded is not None:
+        jobs.update(category_report_jobs(loaded["df"], cluster_df, output_dir="reports/categories",
+                                         customer_tables=customer_tables))
+    with PdfConverter(timeout=pdf_timeout) if pdf else contextlib.nullcontext() as converter:
+        return render_reports(jobs, max_workers=max_workers, converter=converter)
+
+def source_fingerprints(incremental=False, incoming_dir="data/incoming", purchases_file=DEFAULT_PURCHASES_FILE):
+    """
+    Size and mtime of every purchases file the load stage reads; the identity
+    of the pipeline's input for memoizing stage outputs.
+    """
+    from src.columnar_cache import file_fingerprint
+
+    paths = [purchases_file]
+    if incremental and os.path.isdir(incoming_dir):
+        paths += sorted(os.path.join(incoming_dir, name) for name in os.listdir(incoming_dir) if name.endswith((".csv", ".csv.enc")))
+    return {path: file_fingerprint(path) for path in paths}
+
+# Stages each subcommand needs; "all" runs everything and prints the analysis
+COMMAND_TARGETS = {
+    "load": ["load"],
+    "analyze": ["analyze"],
+    "cluster": ["cluster"],
+    "recommend": ["recommend"],
+    "report": ["report"],
+    "all": None,
+}
+
+def run_pipeline(streaming=False, chunksize=500_000, incremental=False, profile_dir=None, max_workers=None,
+                 command="all", customer_id=None, report_options=None, max_interactions=None,
+                 purchases_file=DEFAULT_PURCHASES_FILE):
+    """
+    Run the stages ``command`` needs (see ``COMMAND_TARGETS``) and print its result.
+
+    Purchases are read from ``purchases_file``, or from its encrypted copy
+    when only that exists (see ``resolve_purchases_file``). Synthetic data
+    is generated only when neither exists at the default location.
+
+    ``report_options`` are passed to ``report_stage``; with ``by_category``
+    the report stage also takes the loaded purchases.
+
+    Returns
+    -------
+    tracer : PipelineTracer
+        Spans of the stages that ran.
+    outputs : dict
+        Stage name -> output, for every stage that was run or loaded.
+    """
+    # Every stage runs in a span that logs its timings; with profile_dir it is also profiled
+    tracer = PipelineTracer(profile_dir)
+    # All messages of this run share one correlation id
+    new_correlation_id()
+    
+    # 1. Generate or Load Data
+    source = resolve_purchases_file(purchases_file)
+    if source is None:
+        if purchases_file != DEFAULT_PURCHASES_FILE:
+            raise FileNotFoundError(f"No purchases file at {purchases_file} or {purchases_file}.enc.")
+        from data_generation import main as generate_data
+        with tracer.span("generate"):
+            generate_data()  # only if needed
+        source = purchases_file
+
+    # Example filter: last 6 months
+    filters = {"start_date": "2024-07-01", "end_date": "2025-01-01"}
+
+    # 2.-6. Load, then analysis, clustering and recommendation side by side, then the report.
+    # Stage outputs are memoized by their inputs, so unchanged data skips straight to the report.
+    # Profiles and RSS figures are per stage only when stages do not overlap.
+    from src.model_store import ModelStore
+    dag = PipelineDAG(store=ModelStore("data/cache/stages"), tracer=tracer,
+                      max_workers=1 if profile_dir else max_workers)
+    # Charts render in the background while the recommender trains; images of unchanged data are reused
+    pending_charts = contextlib.ExitStack()
+
+    def chart_stage(analysis_results, cluster_df):
+        # Returns {kind: future of the image path}; the report stage waits for them
+        from data_analysis import analysis_charts
+        from src.charts import ChartRenderer
+        renderer = pending_charts.enter_context(ChartRenderer(max_workers=max_workers))
+        return renderer.render_all(analysis_charts(analysis_results, cluster_df))
+
+    dag.add_stage("load", load_purchases, params={"streaming": streaming, "chunksize": chunksize,
+                                                  "incremental": incremental, "filters": filters,
+                                                  "max_interactions": max_interactions, "purchases_file": source},
+                  inputs=source_fingerprints(incremental, purchases_file=source), memoize=False, executor="inline",
+                  count=lambda loaded: len(loaded["df"]))
+    dag.add_stage("analyze", analyze_stage, deps=["load"], params={"filters": filters},
+                  count=lambda results: len(results["top_products"]))
+    dag.add_stage("cluster", cluster_stage, deps=["load"], params={"models_dir": "models"}, count=len)
+    dag.add_stage("recommend", recommend_stage, deps=["load"],
+                  params={"models_dir": "models", "customer_id": customer_id},
+                  count=lambda recommendation: len(recommendation[1]))
+    dag.add_stage("charts", chart_stage, deps=["analyze", "cluster"], memoize=False, executor="inline", count=len)
+    report_options = dict(report_options or {})
+    report_deps = ["cluster", "analyze", "recommend", "charts"] + (["load"] if report_options.pop("by_category", False) else [])
+    dag.add_stage("report", report_stage, deps=report_deps, memoize=False, count=len,
+                  params=dict(report_options, max_workers=max_workers))
+    with pending_charts:
+        outputs = dag.run(COMMAND_TARGETS[command])
+        print_result(command, outputs)
+
+    if profile_dir:
+        summary = tracer.summary_table()
+        with open(os.path.join(profile_dir, "summary.txt"), "w") as f:
+            f.write(summary + "\n")
+        print(summary)
+    return tracer, outputs
+
+def print_result(command, outputs):
+    if command == "load":
+        print(f"{len(outputs['load']['df'])} purchases loaded")
+    elif command == "cluster":
+        print(outputs["cluster"]["ClusterLabel"].value_counts().sort_index())
+    elif command == "recommend":
+        customer_id, recs, explanation = outputs["recommend"]
+        print(f"Recommendations for customer {customer_id}:")
+        for product_id, predicted_amount in recs:
+            print(f"  {product_id}: {predicted_amount:,.2f}")
+        print(explanation)
+    elif command == "report":
+        for name, path in outputs["report"].items():
+            print(f"{name}: {path}")
+    else:
+        print(outputs["analyze"])
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the retail analytics pipeline, or part of it.")
+    parser.add_argument("--purchases", default=DEFAULT_PURCHASES_FILE, metavar="PATH",
+                        help="Purchases file (CSV or Parquet). When only PATH.enc exists, that encrypted copy is "
+                             "read and decrypted as it is loaded. Synthetic purchases are generated only when "
+                             "neither exists at the default path.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Read purchases in bounded-size chunks instead of all at once. Totals are kept "
+                             "per customer and product, but the recommender's training rows still grow with "
+                             "the filtered file unless --max-interactions caps them.")
+    parser.add_argument("--chunksize", type=int, default=500_000,
+                        help="Rows per chunk in streaming mode, and when absorbing new rows with --incremental.")
+    parser.add_argument("--max-interactions", type=int, default=None, metavar="N",
+                        help="In streaming or incremental mode, train the recommender on a uniform sample of "
+                             "N purchases.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Update the persisted analytics state with new purchases (the purchases file and "
+                             "data/incoming/*.csv or *.csv.enc) and analyze the full history instead of the last 6 months. "
+                             "Only the totals are incremental: when there are new rows, the recommender is "
+                             "retrained on the whole history unless --max-interactions caps it.")
+    parser.add_argument("--profile", nargs="?", const="profiles", default=None, metavar="DIR",
+                        help="Profile every stage with cProfile, writing one .prof file per stage and a "
+                             "summary table to DIR (default: profiles).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Threads for running independent stages side by side.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND",
+                                     help="Stage to run, with whatever it depends on (default: all).")
+    commands.add_parser("load", help="Load and filter the purchases.")
+    commands.add_parser("analyze", help="Top products, category sales and average spend.")
+    commands.add_parser("cluster", help="Customer segments.")
+    recommend = commands.add_parser("recommend", help="Recommendations for one customer.")
+    recommend.add_argument("--customer", default=None, help="CustomerID (default: the first customer).")
+    report = commands.add_parser("report", help="Charts and the HTML report.")
+    report.add_argument("--by-category", action="store_true",
+                        help="Also write one report per category, to reports/categories/<category>/. "
+                             "Not available with --streaming or --incremental.")
+    report.add_argument("--customer-tables", action="store_true",
+                        help="List every customer of each segment in the reports.")
+    report.add_argument("--pdf", action="store_true", help="Convert the reports to PDF with wkhtmltopdf.")
+    report.add_argument("--pdf-timeout", type=float, default=120, help="Seconds allowed per PDF conversion.")
+    commands.add_parser("all", help="Everything; prints the analysis.")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "by_category", False) and (args.streaming or args.incremental):
+        # Those modes keep only CustomerID, ProductID and PurchaseAmount of each purchase
+        parser.error("report --by-category needs every purchase's Category, which --streaming and "
+                     "--incremental do not keep; run it without them.")
+    if args.purchases != DEFAULT_PURCHASES_FILE and resolve_purchases_file(args.purchases) is None:
+        parser.error(f"no purchases file at {args.purchases} or {args.purchases}.enc")
+    run_pipeline(streaming=args.streaming, chunksize=args.chunksize, incremental=args.incremental,
+                 max_interactions=args.max_interactions, purchases_file=args.purchases,
+                 profile_dir=args.profile, max_workers=args.workers, command=args.command or "all",
+                 customer_id=getattr(args, "customer", None),
+                 report_options={"by_category": getattr(args, "by_category", False),
+                                 "customer_tables": getattr(args, "customer_tables", False),
+                                 "pdf": getattr(args, "pdf", False),
+                                 "pdf_timeout": getattr(args, "pdf_timeout", 120)})
 
 if __name__ == "__main__":
-    run_pipeline()
+    main()
@@ -0,0 +1,172 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import hashlib
+import json
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+# Arrays smaller than this stay inside the pickle; larger ones are memory-mapped
+INLINE_BUFFER_BYTES = 1 << 16
+BUFFER_ALIGNMENT = 64
+
+
+def content_key(df: pd.DataFrame, params: dict) -> str:
+    """
+    Content address of a model: a hash of its training data and hyperparameters.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The exact frame the model is trained on. Row order matters, as it
+        does for the models themselves.
+    params : dict
+        JSON-serializable hyperparameters (and anything else that changes the
+        fitted result, such as library versions).
+
+    Returns
+    -------
+    str
+        Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(map(str, df.columns))).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """
+    Local, content-addressed store for trained artifacts.
+
+    Each artifact lives in ``<root>/<kind>/<key>/`` as a pickle plus one
+    ``buffers.bin`` file holding every large NumPy buffer out-of-band (pickle
+    protocol 5). Loading memory-maps ``buffers.bin``, so large arrays such as
+    similarity matrices are paged in lazily and shared between processes that
+    load the same model.
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the store.
+    """
+
+    def __init__(self, root="models"):
+        self.root = root
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.root, kind, key)
+
+    def contains(self, kind: str, key: str) -> bool:
+        return os.path.exists(os.path.join(self._path(kind, key), "meta.json"))
+
+    def save(self, kind: str, key: str, obj, meta=None):
+        """
+        Store ``obj`` under ``kind``/``key``.
+
+        The artifact is written to a temporary directory and renamed into
+        place, so readers never see a partially written model. Keys are
+        content addresses, so an artifact already stored under ``key`` is
+        kept as it is (and marked as the latest); that includes one a
+        concurrent writer renamed into place first.
+        """
+        if self.contains(kind, key):
+            os.utime(os.path.join(self._path(kind, key), "meta.json"))
+            return
+        buffers = []
+        payload = pickle.dumps(obj, protocol=5, buffer_callback=lambda b: _keep_inline(b, buffers))
+
+        os.makedirs(os.path.join(self.root, kind), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.join(self.root, kind))
+        try:
+            offsets = []
+            with open(os.path.join(tmp_dir, "buffers.bin"), "wb") as f:
+                for buffer in buffers:
+                    padding = -f.tell() % BUFFER_ALIGNMENT
+                    f.write(b"\0" * padding)
+                    offsets.append([f.tell(), buffer.nbytes])
+                    f.write(buffer)
+            with open(os.path.join(tmp_dir, "model.pkl"), "wb") as f:
+                f.write(payload)
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump({"kind": kind, "key": key, "buffers": offsets, "meta": meta or {}}, f)
+
+            try:
+                os.replace(tmp_dir, self._path(kind, key))
+            except OSError:
+                # The rename fails when the target exists; the artifact another writer stored is kept
+                if not self.contains(kind, key):
+                    raise
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        log_structured(logger, "info", "Saved model to store", kind=kind, key=key,
+                       mapped_bytes=sum(size for _, size in offsets))
+
+    def load(self, kind: str, key: str):
+        """
+        Load the artifact stored under ``kind``/``key``.
+
+        Returns
+        -------
+        obj : object
+            The stored object; its large arrays are read-only memory maps.
+        meta : dict
+            Metadata passed to ``save``.
+        """
+        path = self._path(kind, key)
+        with open(os.path.join(path, "meta.json")) as f:
+            record = json.load(f)
+
+        buffers = []
+        if record["buffers"]:
+            mapped = np.memmap(os.path.join(path, "buffers.bin"), dtype=np.uint8, mode="r")
+            buffers = [mapped[offset:offset + size] for offset, size in record["buffers"]]
+        with open(os.path.join(path, "model.pkl"), "rb") as f:
+            obj = pickle.loads(f.read(), buffers=buffers)
+
+        log_structured(logger, "info", "Loaded model from store", kind=kind, key=key)
+        return obj, record["meta"]
+
+    def latest(self, kind: str, **meta_filter):
+        """
+        Load the most recently saved artifact of ``kind`` whose metadata
+        matches ``meta_filter``, e.g. to warm-start from the previous run.
+
+        Returns
+        -------
+        tuple or None
+            ``(obj, meta)`` as from ``load``, or None if nothing matches.
+        """
+        kind_dir = os.path.join(self.root, kind)
+        if not os.path.isdir(kind_dir):
+            return None
+        candidates = []
+        for key in os.listdir(kind_dir):
+            meta_path = os.path.join(kind_dir, key, "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            with open(meta_path) as f:
+                meta = json.load(f)["meta"]
+            if all(meta.get(name) == value for name, value in meta_filter.items()):
+                candidates.append((os.path.getmtime(meta_path), key))
+        if not candidates:
+            return None
+        return self.load(kind, max(candidates)[1])
+
+
+def _keep_inline(buffer: pickle.PickleBuffer, out_of_band: list) -> bool:
+    raw = buffer.raw()
+    if raw.nbytes < INLINE_BUFFER_BYTES:
+        return True
+    out_of_band.append(raw)
+    return False
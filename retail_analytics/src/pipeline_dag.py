@@ -0,0 +1,377 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import ast
+import functools
+import hashlib
+import inspect
+import json
+import textwrap
+import types
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+EXECUTORS = ("thread", "process", "inline")
+
+
+class Stage:
+    """
+    One node of a ``PipelineDAG``; see ``PipelineDAG.add_stage``.
+    """
+
+    def __init__(self, name, fn, deps=(), params=None, inputs=None, memoize=True, executor="thread", count=None,
+                 version=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{executor}', expected one of {EXECUTORS}.")
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.params = dict(params or {})
+        self.inputs = inputs
+        self.memoize = memoize
+        self.executor = executor
+        self.count = count
+        self.version = version
+
+
+class PipelineDAG:
+    """
+    Runs pipeline stages as a dependency graph, concurrently and memoized.
+
+    Each stage is called as ``fn(*outputs_of_deps, **params)``. Stages whose
+    dependencies are available run at the same time, in a thread pool (or a
+    process pool for ``executor="process"``; then ``fn`` and its inputs must
+    be picklable).
+
+    Every stage has a key: a hash of its name, function (by name and by
+    ``code_digest``: its code and the project code it calls or imports),
+    params, declared ``inputs`` (e.g. file fingerprints), ``version`` and its
+    dependencies' keys, so keys can be computed without running anything.
+    Editing a stage function or a project module it depends on invalidates
+    its stored output; for changes outside the project, such as a library
+    upgrade, bump the stage's ``version``. Outputs of memoized stages
+    are saved in ``store`` under their key. Before running anything, the
+    executor works out which stages have to run: a stage whose output is
+    stored is loaded instead, and a stage whose output is not needed by any
+    stage that has to run (for example, the loader when every analysis
+    result is stored) is skipped altogether.
+
+    Parameters
+    ----------
+    store : ModelStore, optional
+        Where memoized outputs are kept (kind = stage name). Without a store
+        nothing is memoized.
+    max_workers : int, optional
+        Size of each pool.
+    tracer : PipelineTracer, optional
+        When given, each thread or inline stage that runs is wrapped in a
+        tracer span. Overlapping stages share the process, so their CPU time
+        and peak RSS include each other's; use ``max_workers=1`` for exact
+        per-stage figures.
+    """
+
+    def __init__(self, store=None, max_workers=None, tracer=None):
+        self.store = store
+        self.max_workers = max_workers
+        self.tracer = tracer
+        self.stages = {}
+
+    def add_stage(self, name, fn, deps=(), params=None, inputs=None, memoize=True, executor="thread", count=None,
+                  version=None):
+        """
+        Add a stage.
+
+        Parameters
+        ----------
+        name : str
+            Unique stage name.
+        fn : callable
+            Called with the outputs of ``deps`` (in order) and ``params``.
+        deps : list of str
+            Names of stages whose outputs ``fn`` takes; they must be added first.
+        params : dict, optional
+            JSON-serializable keyword arguments; part of the stage's key.
+        inputs : optional
+            JSON-serializable identity of external inputs the stage reads,
+            such as file fingerprints; part of the key but not passed to ``fn``.
+        memoize : bool
+            Store the output and reuse it while the key is unchanged. Turn off
+            for stages run for their side effects, such as writing a report.
+        executor : str
+            "thread", "process", or "inline" (run on the scheduler thread).
+        count : callable, optional
+            Maps the output to a row count for the tracer span.
+        version : optional
+            JSON-serializable marker that is part of the key; change it when
+            something ``code_digest`` does not see, such as a library the
+            stage uses, changes its output.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' already exists.")
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages {missing}.")
+        self.stages[name] = Stage(name, fn, deps, params, inputs, memoize, executor, count, version)
+        return self
+
+    def keys(self) -> dict:
+        """
+        Stage name -> key; stages are added in dependency order, so one pass suffices.
+        """
+        keys = {}
+        for name, stage in self.stages.items():
+            digest = hashlib.sha256()
+            digest.update(json.dumps({
+                "stage": name,
+                "function": f"{stage.fn.__module__}.{stage.fn.__qualname__}",
+                "code": code_digest(stage.fn),
+                "version": stage.version,
+                "params": stage.params,
+                "inputs": stage.inputs,
+                "deps": [keys[dep] for dep in stage.deps],
+            }, sort_keys=True, default=str).encode("utf-8"))
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def _plan(self, keys, targets):
+        # Walk back from the targets: a stage is loaded if stored, run otherwise,
+        # and only then are its dependencies needed
+        run, load = set(), set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in run or name in load:
+                continue
+            stage = self.stages[name]
+            if stage.memoize and self.store is not None and self.store.contains(name, keys[name]):
+                load.add(name)
+            else:
+                run.add(name)
+                pending.extend(stage.deps)
+        return run, load
+
+    def run(self, targets=None) -> dict:
+        """
+        Produce the outputs of ``targets``: by default, every stage that no
+        other stage depends on.
+
+        Returns
+        -------
+        dict
+            Stage name -> output, for every stage that was run or loaded.
+        """
+        if targets is None:
+            needed = {dep for stage in self.stages.values() for dep in stage.deps}
+            targets = [name for name in self.stages if name not in needed]
+        keys = self.keys()
+        to_run, to_load = self._plan(keys, targets)
+        outputs = {name: self.store.load(name, keys[name])[0] for name in to_load}
+        log_structured(logger, "info", "Pipeline plan", run=sorted(to_run), memoized=sorted(to_load),
+                       skipped=sorted(set(self.stages) - to_run - to_load))
+
+        waiting = [name for name in self.stages if name in to_run]
+        uses_processes = any(self.stages[name].executor == "process" for name in waiting)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as threads, \
+                (ProcessPoolExecutor(max_workers=self.max_workers) if uses_processes else nullcontext()) as processes:
+            running = {}
+            while waiting or running:
+                ready = [name for name in waiting if all(dep in outputs for dep in self.stages[name].deps)]
+                for name in ready:
+                    waiting.remove(name)
+                    stage = self.stages[name]
+                    args = [outputs[dep] for dep in stage.deps]
+                    if stage.executor == "inline":
+                        outputs[name] = self._execute(stage, args)
+                        self._save(stage, keys[name], outputs[name])
+                    elif stage.executor == "process":
+                        running[processes.submit(stage.fn, *args, **stage.params)] = name
+                    else:
+                        running[threads.submit(self._execute, stage, args)] = name
+                if not running:
+                    if waiting and not ready:
+                        raise RuntimeError(f"Stages {waiting} can never run.")
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs[name] = future.result()
+                    self._save(self.stages[name], keys[name], outputs[name])
+        return outputs
+
+    def _execute(self, stage: Stage, args):
+        # Rows in are counted on the first dependency's output, when it has a count
+        rows_in = None
+        if stage.deps and self.stages[stage.deps[0]].count is not None:
+            rows_in = self.stages[stage.deps[0]].count(args[0])
+        span = self.tracer.span(stage.name, rows_in=rows_in) if self.tracer is not None else nullcontext()
+        with span as active:
+            output = stage.fn(*args, **stage.params)
+            if active is not None and stage.count is not None:
+                active.rows_out = stage.count(output)
+        return output
+
+    def _save(self, stage: Stage, key, output):
+        if stage.memoize and self.store is not None:
+            self.store.save(stage.name, key, output, meta={"stage": stage.name})
+
+
+def function_digest(fn) -> str:
+    """
+    Hash of what ``fn`` runs: the bytecode, names and constants of its code
+    (including nested functions and lambdas) and its default arguments.
+    None for callables without Python code, such as builtins.
+    """
+    code = getattr(fn, "__code__", None)
+    if code is None:
+        return None
+    digest = hashlib.sha256()
+    _update_with_code(digest, code)
+    digest.update(_stable_repr(fn.__defaults__).encode("utf-8"))
+    digest.update(_stable_repr(fn.__kwdefaults__).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def code_digest(fn) -> str:
+    """
+    Hash of ``fn`` and of the project code it depends on.
+
+    Besides ``function_digest(fn)``, this covers the functions and plain
+    data constants of ``fn``'s own module that it refers to by name, and
+    the source of every project module (a ``.py`` file in the directory of
+    ``fn``'s module) that any of them imports or refers to, following those
+    modules' own imports, including imports inside functions. Code outside
+    that directory, such as installed libraries, is not covered.
+    """
+    path = _source_file(fn)
+    if path is None:
+        return function_digest(fn)
+    root = os.path.dirname(path)
+    digest = hashlib.sha256()
+    functions, files = [fn], set()
+    seen = set()
+    while functions:
+        current = functions.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        digest.update(f"{current.__qualname__}:{function_digest(current)}".encode("utf-8"))
+        try:
+            tree = ast.parse(textwrap.dedent(inspect.getsource(current)))
+        except (OSError, TypeError, SyntaxError):
+            tree = None
+        files.update(_imported_files(tree, root))
+        for name in sorted(_code_names(current.__code__)):
+            value = current.__globals__.get(name)
+            if _is_plain(value):
+                digest.update(f"{name}={_stable_repr(value)}".encode("utf-8"))
+                continue
+            value_path = _source_file(value)
+            if value_path is None or os.path.dirname(value_path) != root:
+                continue
+            if isinstance(value, types.FunctionType) and value.__module__ == current.__module__:
+                functions.append(value)
+            else:
+                files.add(value_path)
+
+    # Project modules, followed through their own imports
+    pending, covered = sorted(files), set()
+    while pending:
+        module_path = pending.pop()
+        if module_path in covered:
+            continue
+        covered.add(module_path)
+        source, imported = _module_source(module_path, root)
+        digest.update(f"{os.path.basename(module_path)}:".encode("utf-8") + source)
+        pending.extend(imported)
+    digest.update(repr(sorted(os.path.basename(p) for p in covered)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _is_plain(value) -> bool:
+    # Module-level data a stage refers to, hashed by value (functions and
+    # other objects print with their address, which changes between runs)
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return True
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return all(map(_is_plain, value))
+    if isinstance(value, dict):
+        return all(_is_plain(k) and _is_plain(v) for k, v in value.items())
+    return False
+
+
+def _source_file(value):
+    if not isinstance(value, (types.FunctionType, types.ModuleType, type)):
+        return None
+    try:
+        path = inspect.getsourcefile(value)
+    except TypeError:
+        return None
+    return os.path.abspath(path) if path else None
+
+
+def _code_names(code: types.CodeType):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _imported_files(tree, root: str) -> set:
+    # Project modules named by the import statements of ``tree``, e.g. both
+    # "from src.clustering import ..." and "from clustering import ..."
+    if tree is None:
+        return set()
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.append(node.module)
+            names += [f"{node.module}.{alias.name}" for alias in node.names]
+    files = set()
+    for name in names:
+        path = os.path.join(root, name.split(".")[-1] + ".py")
+        if (name.startswith("src.") or "." not in name) and os.path.exists(path):
+            files.add(path)
+    return files
+
+
+def _module_source(path: str, root: str):
+    with open(path, "rb") as f:
+        source = f.read()
+    return source, _module_imports(source, root)
+
+
+@functools.lru_cache(maxsize=256)
+def _module_imports(source: bytes, root: str):
+    # Parsed once per version of a file
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        tree = None
+    return sorted(_imported_files(tree, root))
+
+
+def _update_with_code(digest, code: types.CodeType):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode("utf-8"))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_with_code(digest, const)
+        else:
+            digest.update(_stable_repr(const).encode("utf-8"))
+
+
+def _stable_repr(value) -> str:
+    # Sets print in hash order, which changes between runs for strings
+    if isinstance(value, (set, frozenset)):
+        return "{" + ", ".join(sorted(map(_stable_repr, value))) + "}"
+    if isinstance(value, tuple):
+        return "(" + ", ".join(map(_stable_repr, value)) + ")"
+    if isinstance(value, dict):
+        return "{" + ", ".join(sorted(f"{_stable_repr(k)}: {_stable_repr(v)}" for k, v in value.items())) + "}"
+    return repr(value)
@@ -0,0 +1,151 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import numpy as np
+import pandas as pd
+from src.filters import sanitize_category
+
+
+class Selection:
+    """
+    A set of row positions in an indexed purchases frame.
+
+    Selections compose with ``&`` (both predicates) and ``|`` (either
+    predicate). Positions are kept sorted, so ``frame()`` returns rows in the
+    same order as boolean-mask filtering would.
+    """
+
+    def __init__(self, index: "PurchaseIndex", positions=None, row_slice=None):
+        self._index = index
+        self._positions = positions
+        self._slice = row_slice
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Sorted integer row positions into the base frame."""
+        if self._positions is None:
+            self._positions = np.arange(self._slice.start, self._slice.stop)
+        return self._positions
+
+    def __len__(self):
+        if self._slice is not None:
+            return self._slice.stop - self._slice.start
+        return len(self._positions)
+
+    def __and__(self, other: "Selection") -> "Selection":
+        self._check_same_index(other)
+        if self._slice is not None and other._slice is not None:
+            start = max(self._slice.start, other._slice.start)
+            stop = max(start, min(self._slice.stop, other._slice.stop))
+            return Selection(self._index, row_slice=slice(start, stop))
+        if self._slice is not None or other._slice is not None:
+            bounded, listed = (self, other) if self._slice is not None else (other, self)
+            positions = listed.positions
+            in_range = (positions >= bounded._slice.start) & (positions < bounded._slice.stop)
+            return Selection(self._index, positions[in_range])
+        return Selection(self._index, np.intersect1d(self.positions, other.positions, assume_unique=True))
+
+    def __or__(self, other: "Selection") -> "Selection":
+        self._check_same_index(other)
+        return Selection(self._index, np.union1d(self.positions, other.positions))
+
+    def frame(self, copy=False) -> pd.DataFrame:
+        """
+        Materialize the selected rows.
+
+        Contiguous selections on a date-sorted frame are returned as a slice
+        of the base frame (copied when ``copy`` is True); otherwise only the
+        selected rows are gathered.
+        """
+        if self._slice is not None:
+            rows = self._index.df.iloc[self._slice]
+            return rows.copy() if copy else rows
+        return self._index.df.take(self.positions)
+
+    def _check_same_index(self, other):
+        if other._index is not self._index:
+            raise ValueError("Cannot combine selections from different indexes.")
+
+
+class PurchaseIndex:
+    """
+    Reusable index over a loaded purchases frame for date-range and category queries.
+
+    Building the index sorts the purchase dates once and groups row positions
+    by category. A date-range query is then two binary searches, a category
+    query is a dictionary lookup, and neither scans or copies the base frame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Validated purchases with 'PurchaseDate' and 'Category' columns. The
+        frame must not be modified while the index is in use.
+
+    Examples
+    --------
+    >>> index = PurchaseIndex(df)
+    >>> books_h2 = index.date_range("2024-07-01", "2025-01-01") & index.category("Books")
+    >>> books_h2.frame()
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+        dates = df["PurchaseDate"].to_numpy()
+        self._date_dtype = dates.dtype
+        if df["PurchaseDate"].is_monotonic_increasing:
+            self._date_order = None
+            self._sorted_dates = dates
+        else:
+            self._date_order = np.argsort(dates, kind="stable")
+            self._sorted_dates = dates[self._date_order]
+        # NaT sorts last; keep it out of every date range
+        self._valid_dates = len(dates) - int(np.isnat(self._sorted_dates).sum())
+
+        codes, categories = pd.factorize(df["Category"])
+        category_order = np.argsort(codes, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(categories)))])
+        offset = int((codes < 0).sum())
+        self._category_positions = {
+            category: category_order[offset + bounds[i]:offset + bounds[i + 1]]
+            for i, category in enumerate(categories)
+        }
+
+    def all(self) -> Selection:
+        """Select every row."""
+        return Selection(self, row_slice=slice(0, len(self.df)))
+
+    def date_range(self, start_date=None, end_date=None) -> Selection:
+        """
+        Select rows with start_date <= PurchaseDate <= end_date (either bound optional).
+        """
+        sorted_dates = self._sorted_dates[:self._valid_dates]
+        lo = 0 if start_date is None else int(np.searchsorted(sorted_dates, self._to_date(start_date), side="left"))
+        hi = len(sorted_dates) if end_date is None else int(np.searchsorted(sorted_dates, self._to_date(end_date), side="right"))
+        hi = max(lo, hi)
+        if self._date_order is None:
+            return Selection(self, row_slice=slice(lo, hi))
+        return Selection(self, np.sort(self._date_order[lo:hi]))
+
+    def category(self, category: str) -> Selection:
+        """
+        Select rows of one category, sanitized the same way as ``filter_data``.
+        """
+        positions = self._category_positions.get(sanitize_category(category))
+        if positions is None:
+            positions = np.empty(0, dtype=np.intp)
+        return Selection(self, positions)
+
+    def select(self, start_date=None, end_date=None, category=None) -> Selection:
+        """
+        Combine the optional date-range and category predicates of ``filter_data``.
+        """
+        selection = self.all()
+        if start_date or end_date:
+            selection = selection & self.date_range(start_date or None, end_date or None)
+        if category:
+            selection = selection & self.category(category)
+        return selection
+
+    def _to_date(self, value):
+        return pd.Timestamp(value).to_datetime64().astype(self._date_dtype)
@@ -1,15 +1,22 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import time
+import numpy as np
 import pandas as pd
+import scipy
+import surprise
+from scipy import sparse
 from surprise import Dataset, Reader, KNNBasic
 from surprise import accuracy
 from surprise.model_selection import train_test_split
+from src.item_knn import ItemKNN
 from src.logging_utils import get_logger, log_structured
+from src.model_store import content_key
 
 logger = get_logger(__name__)
 
-def build_collaborative_filtering_model(df: pd.DataFrame):
+def build_collaborative_filtering_model(df: pd.DataFrame, engine="surprise", model_store=None):
     """
     Builds a collaborative filtering model using the Surprise library.
 
@@ -17,12 +24,44 @@ def build_collaborative_filtering_model(df: pd.DataFrame):
     ----------
     df : pd.DataFrame
         DataFrame with at least 'CustomerID', 'ProductID', 'PurchaseAmount' columns.
+    engine : str
+        "surprise" for Surprise's user-based ``KNNBasic``, or "sparse" for the
+        item-item ``ItemKNN`` engine, whose memory does not grow with the
+        square of the number of customers.
+    model_store : ModelStore, optional
+        Store for trained models, keyed by the training data and engine
+        settings. When it already holds a model for this input, that model is
+        loaded instead of retrained.
 
     Returns
     -------
-    algo : Surprise Algorithm
+    algo : Surprise Algorithm or ItemKNN
         Trained algorithm instance.
     """
+    if engine not in ("surprise", "sparse"):
+        raise ValueError(f"Unknown recommender engine '{engine}'.")
+
+    model_key = None
+    if model_store is not None:
+        model_key = content_key(df[["CustomerID", "ProductID", "PurchaseAmount"]], {
+            "engine": engine, "rating_scale": [0, 5000], "test_size": 0.2, "random_state": 42,
+            "surprise": surprise.__version__, "scipy": scipy.__version__, "numpy": np.__version__,
+        })
+        if model_store.contains("recommender", model_key):
+            algo, meta = model_store.load("recommender", model_key)
+            log_structured(logger, "info", f"Collaborative Filtering Model loaded, RMSE={meta['rmse']:.4f}", engine=engine)
+            return algo
+
+    if engine == "sparse":
+        algo, rmse = _build_item_knn_model(df)
+    else:
+        algo, rmse = _build_knn_basic_model(df)
+
+    if model_store is not None:
+        model_store.save("recommender", model_key, algo, meta={"engine": engine, "rmse": rmse})
+    return algo
+
+def _build_knn_basic_model(df: pd.DataFrame):
     # Surprise expects 'user', 'item', 'rating' columns
     # We'll treat 'PurchaseAmount' as the rating
     reader = Reader(rating_scale=(0, 5000))  # or min/max range of your amounts
@@ -40,7 +79,22 @@ def build_collaborative_filtering_model(df: pd.DataFrame):
     rmse = accuracy.rmse(predictions, verbose=False)
     log_structured(logger, "info", f"Collaborative Filtering Model trained, RMSE={rmse:.4f}")
     
-    return algo
+    return algo, rmse
+
+def _build_item_knn_model(df: pd.DataFrame):
+    # Same 80/20 hold-out as the Surprise path, evaluated in one vectorized call
+    rng = np.random.default_rng(42)
+    shuffled = rng.permutation(len(df))
+    n_test = int(round(0.2 * len(df)))
+    test, train = df.iloc[shuffled[:n_test]], df.iloc[shuffled[n_test:]]
+
+    algo = ItemKNN(rating_scale=(0, 5000)).fit(train)
+
+    estimates = algo.estimate_pairs(test["CustomerID"], test["ProductID"])
+    rmse = float(np.sqrt(np.mean((estimates - test["PurchaseAmount"].to_numpy(dtype=float)) ** 2)))
+    log_structured(logger, "info", f"Collaborative Filtering Model trained, RMSE={rmse:.4f}", engine="sparse")
+
+    return algo, rmse
 
 def recommend_for_customer(algo, customer_id, df: pd.DataFrame, top_n=5):
     """
@@ -77,6 +131,204 @@ def recommend_for_customer(algo, customer_id, df: pd.DataFrame, top_n=5):
     predictions.sort(key=lambda x: x[1], reverse=True)
     return predictions[:top_n]
 
+def build_purchase_matrix(df: pd.DataFrame, customer_ids=None, item_ids=None):
+    """
+    Build a sparse customer x product matrix marking which products each customer bought.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with 'CustomerID' and 'ProductID' columns.
+    customer_ids, item_ids : array-like, optional
+        Row and column order. Default to the unique IDs in order of appearance.
+        Purchases of IDs outside these lists are ignored.
+
+    Returns
+    -------
+    purchased : scipy.sparse.csr_matrix
+        Boolean matrix, True where the customer bought the product.
+    customer_ids : pd.Index
+    item_ids : pd.Index
+    """
+    customer_ids = pd.Index(df["CustomerID"].unique() if customer_ids is None else customer_ids)
+    item_ids = pd.Index(df["ProductID"].unique() if item_ids is None else item_ids)
+    rows = customer_ids.get_indexer(df["CustomerID"])
+    cols = item_ids.get_indexer(df["ProductID"])
+    known = (rows >= 0) & (cols >= 0)
+    purchased = sparse.csr_matrix(
+        (np.ones(int(known.sum()), dtype=bool), (rows[known], cols[known])),
+        shape=(len(customer_ids), len(item_ids)),
+    )
+    return purchased, customer_ids, item_ids
+
+def _knn_estimates(algo, x_rows, y_cols):
+    """
+    Vectorized ``KNNBasic.estimate`` for every (x, y) pair of inner ids.
+
+    For each y, the neighbours are the x's that rated it (``algo.yr[y]``); the
+    k most similar to each target x are kept with a stable descending sort,
+    which picks the same neighbours as the ``heapq.nlargest`` call in Surprise.
+    Impossible estimates are NaN.
+    """
+    estimates = np.full((len(x_rows), len(y_cols)), np.nan)
+    sim_rows = algo.sim[x_rows]
+    for col, y in enumerate(y_cols):
+        if not algo.yr[y]:
+            continue
+        neighbours, ratings = (np.asarray(v) for v in zip(*algo.yr[y]))
+        sims = sim_rows[:, neighbours]
+        if sims.shape[1] > algo.k:
+            top = np.argsort(-sims, axis=1, kind="stable")[:, :algo.k]
+            sims = np.take_along_axis(sims, top, axis=1)
+            ratings = ratings[top]
+        positive = sims > 0
+        sum_sim = np.where(positive, sims, 0.0).sum(axis=1)
+        sum_ratings = np.where(positive, sims * ratings, 0.0).sum(axis=1)
+        possible = positive.sum(axis=1) >= algo.min_k
+        estimates[possible, col] = sum_ratings[possible] / sum_sim[possible]
+    return estimates
+
+def score_customers(algo, customer_ids, item_ids) -> np.ndarray:
+    """
+    Predicted purchase amounts for every (customer, item) pair as a dense matrix.
+
+    For a fitted Surprise ``KNNBasic`` this computes the same estimates as
+    ``algo.predict(uid, iid).est`` (falling back to the global mean and
+    clipping to the rating scale) with array operations over the whole batch.
+    Algorithms exposing ``estimate_batch(customer_ids, item_ids)`` are asked
+    directly; any other algorithm is scored pair by pair through ``predict``.
+
+    Parameters
+    ----------
+    algo : Surprise Algorithm
+        Trained algorithm instance.
+    customer_ids, item_ids : sequence
+        Raw customer and product IDs.
+
+    Returns
+    -------
+    np.ndarray
+        Matrix of shape (len(customer_ids), len(item_ids)).
+    """
+    if hasattr(algo, "estimate_batch"):
+        return algo.estimate_batch(customer_ids, item_ids)
+
+    if not isinstance(algo, KNNBasic):
+        return np.array([[algo.predict(uid=c, iid=i).est for i in item_ids] for c in customer_ids])
+
+    trainset = algo.trainset
+    users = np.array([_inner_id(trainset.to_inner_uid, c) for c in customer_ids], dtype=np.intp)
+    items = np.array([_inner_id(trainset.to_inner_iid, i) for i in item_ids], dtype=np.intp)
+    known_users, known_items = users >= 0, items >= 0
+
+    scores = np.full((len(users), len(items)), np.nan)
+    if known_users.any() and known_items.any():
+        if algo.sim_options["user_based"]:
+            known = _knn_estimates(algo, users[known_users], items[known_items])
+        else:
+            known = _knn_estimates(algo, items[known_items], users[known_users]).T
+        scores[np.ix_(known_users, known_items)] = known
+
+    scores[np.isnan(scores)] = algo.default_prediction()
+    lower_bound, higher_bound = trainset.rating_scale
+    return np.clip(scores, lower_bound, higher_bound)
+
+def _inner_id(to_inner, raw_id):
+    try:
+        return to_inner(raw_id)
+    except ValueError:
+        return -1
+
+def recommend_for_all_customers(algo, df: pd.DataFrame, top_n=5, customer_ids=None, batch_size=1024):
+    """
+    Recommend items for many customers at once.
+
+    Customers are scored in batches against every product with
+    ``score_customers``; products a customer already bought are masked out
+    using a sparse purchase matrix, and the top ``top_n`` are picked with a
+    partial sort. Throughput is logged in customers per second.
+
+    Parameters
+    ----------
+    algo : Surprise Algorithm
+        Trained algorithm instance.
+    df : pd.DataFrame
+        DataFrame with 'CustomerID', 'ProductID', 'PurchaseAmount' columns.
+    top_n : int
+        Number of recommendations per customer.
+    customer_ids : sequence, optional
+        Customers to recommend for. Defaults to every customer in df.
+    batch_size : int
+        Customers scored per batch; bounds the size of the score matrix.
+
+    Returns
+    -------
+    recommendations : dict
+        Maps each customer ID to a list of (item ID, estimated purchase amount)
+        tuples, best first, as returned by ``recommend_for_customer``.
+    """
+    start = time.perf_counter()
+    purchased, customer_ids, item_ids = build_purchase_matrix(df, customer_ids=customer_ids)
+    item_values = item_ids.to_numpy()
+
+    recommendations = {}
+    for batch_start in range(0, len(customer_ids), batch_size):
+        batch = slice(batch_start, batch_start + batch_size)
+        batch_customers = customer_ids[batch]
+        scores = score_customers(algo, batch_customers, item_values)
+
+        # Mask products each customer already bought
+        bought = purchased[batch].tocoo()
+        scores[bought.row, bought.col] = -np.inf
+
+        recommendations.update(zip(batch_customers, top_recommendations(scores, item_values, top_n)))
+
+    elapsed = time.perf_counter() - start
+    log_structured(logger, "info", "Batch recommendations generated",
+                   customer_count=len(customer_ids), top_n=top_n, elapsed_seconds=round(elapsed, 4),
+                   customers_per_second=round(len(customer_ids) / elapsed, 2) if elapsed > 0 else None)
+    return recommendations
+
+def top_recommendations(scores: np.ndarray, item_values, top_n=5) -> list:
+    """
+    The ``top_n`` best items of each row of a score matrix.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        (customers, items) estimates, with -inf for items not to recommend
+        (e.g. already bought).
+    item_values : np.ndarray
+        Item IDs of the columns.
+    top_n : int
+        Number of recommendations per row.
+
+    Returns
+    -------
+    list of list of tuples
+        Per row, (item ID, estimated purchase amount) tuples, best first.
+    """
+    n = min(top_n, scores.shape[1])
+    if n == 0:
+        return [[] for _ in range(scores.shape[0])]
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    # argpartition keeps an arbitrary subset of the items tied at the nth
+    # score; in rows with such ties, a stable sort keeps the first products
+    # instead, like the per-customer sort does
+    tied = (scores >= top_scores.min(axis=1, keepdims=True)).sum(axis=1) > n
+    if tied.any():
+        top[tied] = np.argsort(-scores[tied], axis=1, kind="stable")[:, :n]
+        top_scores[tied] = np.take_along_axis(scores[tied], top[tied], axis=1)
+    # Best first; equal scores in product order
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return [
+        [(item_values[item], float(est)) for item, est in zip(items, estimates) if est != -np.inf]
+        for items, estimates in zip(top, top_scores)
+    ]
+
 def explain_recommendation(customer_id, recommendations):
     """
     Generate a string explaining the recommendations for a given customer.
@@ -1,52 +1,71 @@
 import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import hashlib
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 import pdfkit
 from html import escape
-from logging_utils import get_logger, log_structured
+from src.logging_utils import get_logger, log_structured
 
 logger = get_logger(__name__)
 
-def generate_pdf_report(analysis_results, cluster_df, recommendations, output_dir="reports"):
-    """
-    Generate a PDF report based on the analysis results.
+# Customer rows formatted and written per chunk in the segment tables
+REPORT_CHUNK_ROWS = 10_000
 
-    :param analysis_results: Results of the analysis (top products, category sales, customer segments)
-    :type analysis_results: dict
-    :param cluster_df: DataFrame with customer segments
-    :type cluster_df: pd.DataFrame
-    :param recommendations: HTML content of the recommendations
-    :type recommendations: str
-    :param output_dir: Directory to store the report files (default: "reports")
-    :type output_dir: str
-    """
-    REPORT_TEMPLATE = """
+# PDFKit options
+PDF_OPTIONS = {
+    'page-size': 'Letter',
+    'margin-top': '0.75in',
+    'margin-right': '0.75in',
+    'margin-bottom': '0.75in',
+    'margin-left': '0.75in',
+    'encoding': "UTF-8",
+    'enable-local-file-access': None,  # Allow local resources like images
+}
+
+# The report, split where streamed sections go
+REPORT_HEAD = """
     <html>
     <head>
         <title>Retail Analytics Report</title>
-        <link rel = "stylesheet" type = "text/css" href = "RetailAnalyticsReportStyle.css" />
+        <link rel = "stylesheet" type = "text/css" href = "{stylesheet}" />
     </head>
     <body>
-        <h1>Retail Analytics Summary</h1>
+        <h1>{title}</h1>
         <div class="dashboardBody">
-        <img src="../data/top_products.png" alt="Top Products Chart" width="500"/>
+        {top_products_chart}
         <div>
-        
+
             <p>Top Products:</p>
-            <ul>{top_products}</ul>
+            <ul>"""
+
+REPORT_INSIGHTS = """</ul>
         </div>
         </div>
 
         <h1>Data Analysis Insights</h1>
-        
+        {charts}
+
         <p class="number">Average Spending per Customer: ${avg_spend_per_customer:.2f}</p>
         <div class="insightSection">
-       
+
          <div  class="insights">
-         <h2>Category Sales: {category_sales}</h2>
+         <h2>Category Sales: """
+
+REPORT_SEGMENTS = """</h2>
         </div>
         <div class="insightsBox">
         <h2>Customer Segments</h2>
         <ul>
-        {customer_segments}
+        """
+
+REPORT_RECOMMENDATIONS = """
         </ul>
         </div>
         </div>
@@ -54,74 +73,319 @@ def generate_pdf_report(analysis_results, cluster_df, recommendations, output_di
         <h2>Example Recommendations</h2>
         <p>{recommendations}</p>
         </div>
-        
-        
-     
+        """
+
+REPORT_TAIL = """
+
+
     </body>
     </html>
     """
 
+
+def write_html_report(html_file_path, analysis_results, cluster_df, recommendations, chart_files=None,
+                      customer_tables=False, chunk_rows=REPORT_CHUNK_ROWS, title="Retail Analytics Summary",
+                      stylesheet="RetailAnalyticsReportStyle.css"):
+    """
+    Stream the HTML report to a file, section by section.
+
+    The document is never held in memory as a whole: each table is written as
+    it is formatted, and the per-segment customer tables are written
+    ``chunk_rows`` rows at a time. The report is written under a temporary
+    name and renamed into place when complete.
+
+    :param html_file_path: Path of the HTML file to write
+    :type html_file_path: str
+    :param analysis_results: Results of analyze_data
+    :type analysis_results: dict
+    :param cluster_df: DataFrame with customer segments
+    :type cluster_df: pd.DataFrame
+    :param recommendations: HTML content of the recommendations
+    :type recommendations: str
+    :param chart_files: Chart kind -> image path (e.g. from ChartRenderer); charts not listed
+        are left out. Defaults to the top products chart at data/top_products.png
+    :type chart_files: dict
+    :param customer_tables: Also list every customer of each segment, with their spending
+    :type customer_tables: bool
+    :param chunk_rows: Customer rows written per chunk
+    :type chunk_rows: int
+    :return: html_file_path
+    :rtype: str
+    """
+    output_dir = os.path.dirname(html_file_path) or "."
+    # Charts, relative to the report
+    chart_files = {"top_products": "data/top_products.png"} if chart_files is None else dict(chart_files)
+    top_products_chart = ""
+    if "top_products" in chart_files:
+        top_products_chart = (f'<img src="{escape(os.path.relpath(chart_files.pop("top_products"), output_dir))}" '
+                              f'alt="Top Products Chart" width="500"/>')
+    charts = "\n".join(
+        f'<img src="{escape(os.path.relpath(path, output_dir))}" alt="{escape(kind)} chart" width="500"/>'
+        for kind, path in chart_files.items()
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix=".html")
     try:
-        # Prepare data for the report
-        top_products = "<table border='1' cellpadding='10'><thead><tr><th>Product ID</th><th>Purchase Amount</th></tr></thead><tbody>"
-        for product_id, sales in analysis_results["top_products"].items():
-            top_products += f"<tr><td>{escape(product_id)}</td><td>${sales:,.2f}</td></tr>"
-        top_products += "</tbody></table>"
-        #top_products = escape(str(analysis_results["top_products"]))
-        #print(top_products)
-        
-        category_sales = "<table border='1' cellpadding='10'><thead><tr><th>Category</th><th>Purchase Amount</th></tr></thead><tbody>"
-        for category, sales in analysis_results["category_sales"].items():
-            category_sales += f"<tr><td>{escape(category)}</td><td>${sales:,.2f}</td></tr>"
-        category_sales += "</tbody></table>"
-        #category_sales = escape(str(analysis_results["category_sales"]))
-        avg_spend_per_customer = analysis_results["avg_spend_per_customer"]
-
-        # Summarize clusters
-        segment_info = []
-        for cluster_label, group in cluster_df.groupby("ClusterLabel"):
-            segment_info.append(f"<li><strong>{cluster_label}</strong>: {len(group)} customers</li>")
-        segment_html = "\n".join(segment_info)
+        with os.fdopen(fd, "w") as f:
+            f.write(REPORT_HEAD.format(title=escape(title), stylesheet=escape(stylesheet),
+                                      top_products_chart=top_products_chart))
+
+            f.write("<table border='1' cellpadding='10'><thead><tr><th>Product ID</th><th>Purchase Amount</th></tr></thead><tbody>")
+            f.writelines(f"<tr><td>{escape(str(product_id))}</td><td>${sales:,.2f}</td></tr>"
+                         for product_id, sales in analysis_results["top_products"].items())
+            f.write("</tbody></table>")
+
+            f.write(REPORT_INSIGHTS.format(charts=charts,
+                                           avg_spend_per_customer=analysis_results["avg_spend_per_customer"]))
+
+            f.write("<table border='1' cellpadding='10'><thead><tr><th>Category</th><th>Purchase Amount</th></tr></thead><tbody>")
+            f.writelines(f"<tr><td>{escape(str(category))}</td><td>${sales:,.2f}</td></tr>"
+                         for category, sales in analysis_results["category_sales"].items())
+            f.write("</tbody></table>")
+
+            f.write(REPORT_SEGMENTS)
+            # Summarize clusters (one row per customer, so counting labels is enough)
+            segment_sizes = cluster_df["ClusterLabel"].value_counts(sort=False).sort_index()
+            f.write("\n".join(f"<li><strong>{escape(str(cluster_label))}</strong>: {size} customers</li>"
+                              for cluster_label, size in segment_sizes.items()))
+            f.write(REPORT_RECOMMENDATIONS.format(recommendations=recommendations))
+
+            if customer_tables:
+                _write_customer_tables(f, cluster_df, chunk_rows)
+            f.write(REPORT_TAIL)
+        os.replace(tmp_path, html_file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return html_file_path
+
+
+def _write_customer_tables(f, cluster_df, chunk_rows):
+    # One table per segment, biggest spenders first, written a chunk of rows at a time.
+    # A single sort orders the rows; each chunk is gathered from the columns as it is written.
+    codes, labels = pd.factorize(cluster_df["ClusterLabel"], sort=True)
+    customer_ids = cluster_df["CustomerID"].to_numpy()
+    spending = cluster_df["TotalSpending"].to_numpy(dtype=float)
+    counts = cluster_df["PurchaseCount"].to_numpy()
+    order = np.lexsort((-spending, codes))
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+
+    f.write('<div class="segmentCustomers">')
+    for code, cluster_label in enumerate(labels):
+        f.write(f"<h2>{escape(str(cluster_label))}: {bounds[code + 1] - bounds[code]} customers</h2>")
+        f.write("<table border='1' cellpadding='10'><thead><tr><th>Customer ID</th><th>Total Spending</th>"
+                "<th>Purchases</th></tr></thead><tbody>")
+        for start in range(bounds[code], bounds[code + 1], chunk_rows):
+            rows = order[start:min(start + chunk_rows, bounds[code + 1])]
+            f.write("".join(
+                f"<tr><td>{escape(str(customer_id))}</td><td>${total:,.2f}</td><td>{count}</td></tr>"
+                for customer_id, total, count in zip(customer_ids[rows], spending[rows], counts[rows])
+            ))
+        f.write("</tbody></table>")
+    f.write("</div>")
+
+
+def generate_pdf_report(analysis_results, cluster_df, recommendations, output_dir="reports", chart_files=None,
+                        customer_tables=False, converter=None, title="Retail Analytics Summary"):
+    """
+    Generate a PDF report based on the analysis results.
 
+    :param analysis_results: Results of the analysis (top products, category sales, customer segments)
+    :type analysis_results: dict
+    :param cluster_df: DataFrame with customer segments
+    :type cluster_df: pd.DataFrame
+    :param recommendations: HTML content of the recommendations
+    :type recommendations: str
+    :param output_dir: Directory to store the report files (default: "reports")
+    :type output_dir: str
+    :param chart_files: Chart kind -> image path (e.g. from ChartRenderer); charts not listed
+        are left out. Defaults to the top products chart at data/top_products.png
+    :type chart_files: dict
+    :param customer_tables: Also list every customer of each segment
+    :type customer_tables: bool
+    :param converter: When given, the HTML report is queued on it for conversion to
+        RetailAnalyticsReport.pdf; otherwise only the HTML report is written
+    :type converter: PdfConverter
+    :param title: Report heading
+    :type title: str
+    :return: Path of the HTML report, or None if it could not be written
+    :rtype: str
+    """
+    try:
         # Paths for output files
-        os.makedirs(output_dir, exist_ok=True)
         html_file_path = os.path.join(output_dir, "RetailAnalyticsReport.html")
         pdf_file_path = os.path.join(output_dir, "RetailAnalyticsReport.pdf")
-        img_path = os.path.abspath("../data/top_products.png")
-
-        # Render the HTML content
-        rendered_html = REPORT_TEMPLATE.format(
-            top_products=top_products,
-            category_sales=category_sales,
-            avg_spend_per_customer=avg_spend_per_customer,
-            customer_segments=segment_html,
-            recommendations=recommendations,
-            img_path=img_path
-        )
-
-        # Save the HTML content to a file (optional for debugging)
-        with open(html_file_path, "w") as html_file:
-            html_file.write(rendered_html)
-
-        # PDFKit options
-        options = {
-            'page-size': 'Letter',
-            'margin-top': '0.75in',
-            'margin-right': '0.75in',
-            'margin-bottom': '0.75in',
-            'margin-left': '0.75in',
-            'encoding': "UTF-8",
-            'enable-local-file-access': None,  # Allow local resources like images
-        }
 
-        # Convert HTML to PDF
-        #pdfkit.from_file(html_file_path, pdf_file_path, options=options)
+        write_html_report(html_file_path, analysis_results, cluster_df, recommendations, chart_files=chart_files,
+                          customer_tables=customer_tables, title=title,
+                          stylesheet=os.path.relpath("reports/RetailAnalyticsReportStyle.css", output_dir))
 
-        #log_structured(logger, "info", "PDF report generated successfully", report_file=pdf_file_path)
+        # Convert HTML to PDF in the background
+        if converter is not None:
+            converter.submit(html_file_path, pdf_file_path)
+        return html_file_path
 
     except KeyError as e:
         log_structured(logger, "error", "Missing key in analysis results", missing_key=str(e))
     except OSError as e:
-        log_structured(logger, "error", "wkhtmltopdf binary not found", error=str(e))
+        log_structured(logger, "error", "Failed to write HTML report", error=str(e))
     except Exception as e:
         log_structured(logger, "error", "Failed to generate PDF report", error=str(e))
+
+
+class PdfConverter:
+    """
+    Converts HTML reports to PDF with wkhtmltopdf, a bounded number at a time.
+
+    pdfkit builds each command line; the commands run as subprocesses, at
+    most ``max_workers`` at once, and a conversion still running after
+    ``timeout`` seconds is killed. Failures are logged and resolve to None,
+    so one bad report does not stop the others.
+
+    Use as a context manager, or call ``close``, to wait for pending conversions.
+
+    Parameters
+    ----------
+    max_workers : int
+        Conversions running at the same time.
+    timeout : float
+        Seconds allowed per conversion.
+    wkhtmltopdf : str, optional
+        Path of the binary; looked up on PATH by default.
+    options : dict, optional
+        wkhtmltopdf options (default: ``PDF_OPTIONS``).
+    """
+
+    def __init__(self, max_workers=2, timeout=120, wkhtmltopdf="", options=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.wkhtmltopdf = wkhtmltopdf
+        self.options = dict(PDF_OPTIONS if options is None else options)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._configuration = None
+        self._lock = threading.Lock()
+
+    def command(self, html_file_path, pdf_file_path) -> list:
+        with self._lock:
+            if self._configuration is None:
+                # Raises OSError when wkhtmltopdf cannot be found
+                self._configuration = pdfkit.configuration(wkhtmltopdf=self.wkhtmltopdf)
+        return pdfkit.PDFKit(html_file_path, "file", options=dict(self.options),
+                             configuration=self._configuration).command(pdf_file_path)
+
+    def submit(self, html_file_path, pdf_file_path):
+        """
+        Queue one conversion; returns a Future of the PDF path (None if it failed).
+        """
+        return self._executor.submit(self._convert, html_file_path, pdf_file_path)
+
+    def _convert(self, html_file_path, pdf_file_path):
+        try:
+            subprocess.run(self.command(html_file_path, pdf_file_path), capture_output=True,
+                           timeout=self.timeout, check=True)
+        except subprocess.TimeoutExpired:
+            log_structured(logger, "error", "PDF conversion timed out", report_file=html_file_path,
+                           timeout_seconds=self.timeout)
+            return None
+        except subprocess.CalledProcessError as e:
+            log_structured(logger, "error", "Failed to generate PDF report", report_file=html_file_path,
+                           error=e.stderr.decode(errors="replace")[-500:])
+            return None
+        except OSError as e:
+            log_structured(logger, "error", "wkhtmltopdf binary not found", error=str(e))
+            return None
+        log_structured(logger, "info", "PDF report generated successfully", report_file=pdf_file_path)
+        return pdf_file_path
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def render_reports(jobs: dict, max_workers=None, converter=None) -> dict:
+    """
+    Render several reports at once from data already in memory.
+
+    :param jobs: Report name -> keyword arguments of generate_pdf_report
+        (each with its own output_dir). A job may give the purchases to analyze as
+        "purchases" instead of "analysis_results"; they are analyzed in the pool too
+    :type jobs: dict
+    :param max_workers: Reports written at the same time
+    :type max_workers: int
+    :param converter: Optional PdfConverter every report is queued on
+    :type converter: PdfConverter
+    :return: Report name -> path of its HTML report (None if it failed)
+    :rtype: dict
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_render_job, converter=converter, **job) for name, job in jobs.items()}
+    results = {name: future.result() for name, future in futures.items()}
+    log_structured(logger, "info", "Rendered reports", reports=len(results),
+                   failed=sorted(name for name, path in results.items() if path is None))
+    return results
+
+
+def _render_job(purchases=None, **job):
+    if purchases is not None:
+        from src.data_analysis import analyze_data
+
+        try:
+            job["analysis_results"] = analyze_data(purchases)
+        except Exception as e:
+            log_structured(logger, "error", "Failed to analyze report data", output_dir=job.get("output_dir"),
+                           error=str(e))
+            return None
+    return generate_pdf_report(**job)
+
+
+def category_report_jobs(df, cluster_df, recommendations="", output_dir="reports", categories=None,
+                         customer_tables=False) -> dict:
+    """
+    One report job per category, for ``render_reports``.
+
+    Each category's report analyzes only its purchases and lists the segments
+    of the customers who bought in it. The analysis is left to
+    ``render_reports``, so categories are analyzed concurrently. Reports go to
+    ``<output_dir>/<category>-<hash>/``: the category name with unsafe
+    characters replaced, plus a short hash of the name, so categories that
+    differ only in those characters get their own directories.
+
+    :param df: Purchases the reports are drawn from
+    :type df: pd.DataFrame
+    :param cluster_df: Customer segments over all of df
+    :type cluster_df: pd.DataFrame
+    :param categories: Categories to report on (default: every category in df)
+    :type categories: list
+    :return: Category -> render_reports job
+    :rtype: dict
+    """
+    if categories is None:
+        categories = sorted(df["Category"].dropna().unique())
+    jobs = {}
+    for category, purchases in df.groupby("Category", sort=False):
+        if category not in categories:
+            continue
+        customers = cluster_df["CustomerID"].isin(purchases["CustomerID"].unique())
+        jobs[category] = {
+            "purchases": purchases,
+            "cluster_df": cluster_df[customers],
+            "recommendations": recommendations,
+            # The rendered charts cover all categories
+            "chart_files": {},
+            "output_dir": os.path.join(output_dir, _category_directory(category)),
+            "customer_tables": customer_tables,
+            "title": f"Retail Analytics Summary: {category}",
+        }
+    return jobs
+
+
+def _category_directory(category) -> str:
+    name = str(category)
+    return f"{re.sub(r'[^a-zA-Z0-9_-]+', '_', name)}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
@@ -0,0 +1,85 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import resource
+import time
+
+STATUS_FILE = "/proc/self/status"
+CLEAR_REFS_FILE = "/proc/self/clear_refs"
+
+
+def _status_kb(field: str):
+    try:
+        with open(STATUS_FILE) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb() -> float:
+    """
+    Resident set size of this process in MiB.
+    """
+    rss = _status_kb("VmRSS")
+    if rss is None:
+        # No /proc: fall back to the (never reset) peak
+        return peak_rss_mb()
+    return rss / 1024
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MiB since the last
+    ``reset_peak_rss``, or since start if it cannot be reset.
+    """
+    peak = _status_kb("VmHWM")
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak //= 1024  # bytes on macOS, kB elsewhere
+    return peak / 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the kernel's peak-RSS counter to the current RSS (Linux only).
+
+    Returns
+    -------
+    bool
+        False if the counter cannot be reset; peaks then cover the whole
+        process lifetime and deltas measured with them are lower bounds.
+    """
+    try:
+        with open(CLEAR_REFS_FILE, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class ResourceMeter:
+    """
+    Wall time, CPU time and peak RSS growth of a block of code.
+
+    Use as a context manager; after the block, ``wall_seconds``,
+    ``cpu_seconds`` and ``peak_rss_delta_mb`` (peak RSS during the block
+    minus RSS at its start) are set. Meters should not be nested, since
+    entering one resets the peak the outer one would read.
+    """
+
+    def __enter__(self):
+        self.peak_resettable = reset_peak_rss()
+        self.start_rss_mb = current_rss_mb()
+        self._cpu_start = time.process_time()
+        self._wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        self.peak_rss_delta_mb = max(0.0, peak_rss_mb() - self.start_rss_mb)
+        return False
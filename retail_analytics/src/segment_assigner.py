@@ -0,0 +1,121 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import numpy as np
+import pandas as pd
+
+FEATURES = ["TotalSpending", "PurchaseCount"]
+
+
+class SegmentAssigner:
+    """
+    Assigns customers to the segments of a fitted clustering without refitting.
+
+    Holds only the StandardScaler parameters, the K-Means centroids (in scaled
+    units) and the cluster-to-label map, so it pickles to a few hundred bytes
+    and can be shipped to other services.
+
+    The scaling is folded into the centroids once: the nearest scaled centroid
+    to x is the one maximising ``x @ W[c] - b[c]``, where W and b depend only
+    on the centroids and scaler. Assignment is therefore one matrix product
+    per chunk of customers.
+
+    Parameters
+    ----------
+    mean : array-like
+        ``StandardScaler.mean_``.
+    scale : array-like
+        ``StandardScaler.scale_``.
+    centroids : array-like
+        ``KMeans.cluster_centers_`` of shape (n_clusters, n_features), in
+        scaled units.
+    labels : dict
+        Cluster ID -> segment label, as built by ``create_customer_clusters``.
+    chunk_size : int
+        Customers scored per matrix product; bounds temporary memory to
+        ``chunk_size * n_clusters`` floats.
+    """
+
+    def __init__(self, mean, scale, centroids, labels: dict, chunk_size=1 << 18):
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.centroids = np.asarray(centroids, dtype=float)
+        self.labels = {int(cluster): label for cluster, label in labels.items()}
+        self.chunk_size = chunk_size
+        self._prepare()
+
+    @classmethod
+    def from_model(cls, scaler, kmeans, labels: dict, **kwargs) -> "SegmentAssigner":
+        """
+        Build an assigner from a fitted scaler, K-Means model and label map.
+        """
+        return cls(scaler.mean_, scaler.scale_, kmeans.cluster_centers_, labels, **kwargs)
+
+    @classmethod
+    def from_store(cls, model_store, **meta_filter):
+        """
+        Build an assigner from the latest clustering model in ``model_store``
+        whose metadata matches ``meta_filter`` (e.g. ``n_clusters=4``).
+
+        Returns None if the store holds no such model.
+        """
+        latest = model_store.latest("clustering", **meta_filter)
+        if latest is None:
+            return None
+        model, _ = latest
+        return cls.from_model(model["scaler"], model["kmeans"], model["labels"])
+
+    def _prepare(self):
+        # ||(x - m)/s - c||^2 = ||x/s||^2 - 2 x . (c/s + m/s^2) + const(c)
+        inv_var = 1.0 / self.scale ** 2
+        raw_centroids = self.centroids * self.scale + self.mean
+        self._weights = (2.0 * raw_centroids * inv_var).T
+        self._bias = (raw_centroids ** 2 * inv_var).sum(axis=1)
+        n_clusters = len(self.centroids)
+        self._label_array = np.array([self.labels.get(i, f"Cluster {i}") for i in range(n_clusters)], dtype=object)
+
+    def __getstate__(self):
+        return {"mean": self.mean, "scale": self.scale, "centroids": self.centroids,
+                "labels": self.labels, "chunk_size": self.chunk_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._prepare()
+
+    def predict(self, features) -> np.ndarray:
+        """
+        Nearest-centroid cluster IDs.
+
+        Parameters
+        ----------
+        features : pd.DataFrame or array-like
+            A DataFrame with 'TotalSpending' and 'PurchaseCount' columns, an
+            array of shape (n_customers, 2) in that column order, or a single
+            customer's pair.
+
+        Returns
+        -------
+        np.ndarray
+            Cluster ID per customer.
+        """
+        if isinstance(features, pd.DataFrame):
+            features = features[FEATURES]
+        X = np.atleast_2d(np.asarray(features, dtype=float))
+        clusters = np.empty(len(X), dtype=np.int64)
+        for start in range(0, len(X), self.chunk_size):
+            chunk = X[start:start + self.chunk_size]
+            clusters[start:start + len(chunk)] = np.argmax(chunk @ self._weights - self._bias, axis=1)
+        return clusters
+
+    def assign(self, features) -> np.ndarray:
+        """
+        Segment labels for one or many customers; see ``predict`` for inputs.
+        """
+        return self._label_array[self.predict(features)]
+
+    def assign_customer(self, total_spending, purchase_count) -> str:
+        """
+        Segment label of a single customer.
+        """
+        scores = np.array([total_spending, purchase_count], dtype=float) @ self._weights - self._bias
+        return self._label_array[int(np.argmax(scores))]
@@ -0,0 +1,565 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+from src.aggregates import PurchaseAggregates
+from src.cooccurrence import ItemCooccurrence
+from src.logging_utils import get_logger, log_structured
+
+logger = get_logger(__name__)
+
+# The pipeline's example filter: last 6 months
+DEFAULT_FILTERS = {"start_date": "2024-07-01", "end_date": "2025-01-01"}
+MAX_TOP_N = 100
+MAX_REQUEST_LINE = 8192
+
+
+class ServiceError(Exception):
+    """
+    A request the service cannot answer; ``status`` is the HTTP status to reply with.
+    """
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class AnalyticsService:
+    """
+    Answers recommendation, segment and top-product queries from models loaded once.
+
+    Recommendations are scored in batches with ``score_customers`` against
+    every product, products the customer already bought are masked with a
+    sparse purchase matrix, and the results are cached per customer, so a
+    repeated query is a dictionary lookup.
+
+    New purchases (e.g. from a ``PurchaseIngestor``) are added with
+    ``record_purchases``: totals and co-purchase counts are updated in
+    place, and only the customers who bought something new lose their
+    cached recommendations. The recommender itself is not retrained, so
+    products first seen online appear in top products and co-purchase
+    counts but are not recommended until the next training run, and
+    customers first seen online get no recommendations (``has_customer``
+    is False for them) rather than the recommender's fallback scores.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Filtered purchases with 'CustomerID', 'ProductID', 'Category' and
+        'PurchaseAmount' columns; the data the models were trained on.
+    algo : Surprise Algorithm or ItemKNN
+        Trained recommender.
+    assigner : SegmentAssigner
+        Cluster model for labelling customers.
+    aggregates : PurchaseAggregates, optional
+        Totals over ``df``; built from it when not given.
+    cache_size : int
+        Customers whose recommendations are kept.
+    """
+
+    def __init__(self, df: pd.DataFrame, algo, assigner, aggregates: PurchaseAggregates = None, cache_size=100_000):
+        self.algo = algo
+        self.assigner = assigner
+        self.aggregates = aggregates if aggregates is not None else PurchaseAggregates.from_frame(df)
+        # Doubles as the purchase matrix that masks products customers already bought
+        self.cooccurrence = ItemCooccurrence.from_frame(df)
+        # Products the recommender scores; products first seen online get later columns
+        self.item_values = self.cooccurrence.item_ids.to_numpy()
+        # Customers the recommender was trained on; customer_ids above grows with ingested purchases
+        self.trained_customers = self.cooccurrence.customer_ids
+        self.category_product_sales = df.groupby(["Category", "ProductID"])["PurchaseAmount"].sum()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    @classmethod
+    def from_purchases(cls, purchases_file="data/purchases.csv", filters=None, models_dir="models",
+                       cache_dir="data/cache", engine="surprise", **kwargs) -> "AnalyticsService":
+        """
+        Load and filter the purchases, then train or load the recommender and
+        the cluster model from ``models_dir`` the way the pipeline does.
+        """
+        from src.clustering import create_customer_clusters
+        from src.data_loading import filter_data, load_and_validate_purchases
+        from src.model_store import ModelStore
+        from src.recommendations import build_collaborative_filtering_model
+
+        start = time.perf_counter()
+        df = filter_data(load_and_validate_purchases(purchases_file, cache_dir=cache_dir),
+                         **(DEFAULT_FILTERS if filters is None else filters))
+        aggregates = PurchaseAggregates.from_frame(df)
+        model_store = ModelStore(models_dir)
+        _, assigner = create_customer_clusters(df, aggregates=aggregates, model_store=model_store, return_assigner=True)
+        algo = build_collaborative_filtering_model(df, engine=engine, model_store=model_store)
+        service = cls(df, algo, assigner, aggregates=aggregates, **kwargs)
+        log_structured(logger, "info", "Analytics service loaded", purchases=len(df),
+                       customers=len(service.cooccurrence.customer_ids), products=len(service.item_values),
+                       elapsed_seconds=round(time.perf_counter() - start, 4))
+        return service
+
+    def has_customer(self, customer_id) -> bool:
+        """
+        Whether the recommender was trained on ``customer_id``'s purchases.
+        """
+        return customer_id in self.trained_customers
+
+    def record_purchases(self, df: pd.DataFrame) -> dict:
+        """
+        Add validated purchases: update the totals, the per-category sales
+        and the co-purchase counts, and drop the cached recommendations of
+        customers who bought a product they had not bought before.
+
+        Returns
+        -------
+        dict
+            "purchases" added and "invalidated" customers.
+        """
+        # Totals are merged outside the query lock; updates still apply one at a time
+        with self._update_lock:
+            aggregates = self.aggregates.merge(PurchaseAggregates.from_frame(df))
+            category_product_sales = self.category_product_sales.add(
+                df.groupby(["Category", "ProductID"])["PurchaseAmount"].sum(), fill_value=0)
+            with self._lock:
+                changed = self.cooccurrence.update(df)
+                self.aggregates = aggregates
+                self.category_product_sales = category_product_sales
+                self._generation += 1
+                for customer_id in changed:
+                    self._cache.pop(customer_id, None)
+        return {"purchases": len(df), "invalidated": len(changed)}
+
+    def recommend_batch(self, customer_ids, top_n=5) -> list:
+        """
+        Recommendations for several customers, scored together.
+
+        Returns
+        -------
+        list of list of tuples
+            Per customer, (item ID, estimated purchase amount) tuples, best
+            first, as ``recommend_for_customer`` returns them.
+        """
+        from src.recommendations import score_customers, top_recommendations
+
+        results, missing = {}, []
+        with self._lock:
+            for customer_id in dict.fromkeys(customer_ids):
+                cached = self._cache.get(customer_id)
+                if cached is not None and cached[0] >= top_n:
+                    self._cache.move_to_end(customer_id)
+                    results[customer_id] = cached[1]
+                else:
+                    missing.append(customer_id)
+
+            # Purchases recorded from here on are not in the mask below
+            generation = self._generation
+            rows = self.cooccurrence.customer_rows(missing)
+            known = np.flatnonzero(rows >= 0)
+            bought = self.cooccurrence.purchased_rows(rows[known], len(self.item_values))
+
+        if missing:
+            scores = score_customers(self.algo, missing, self.item_values)
+            # Mask products each customer already bought
+            scores[known[bought.row], bought.col] = -np.inf
+            scored = top_recommendations(scores, self.item_values, top_n)
+            results.update(zip(missing, scored))
+            with self._lock:
+                # Results scored against an older mask are returned but not cached
+                if generation == self._generation:
+                    for customer_id, recommendations in zip(missing, scored):
+                        self._cache[customer_id] = (top_n, recommendations)
+                        self._cache.move_to_end(customer_id)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+
+        return [results[customer_id][:top_n] for customer_id in customer_ids]
+
+    def segment(self, customer_id=None, total_spending=None, purchase_count=None) -> dict:
+        """
+        Segment of a known customer, or of the given spending and purchase count.
+        """
+        if customer_id is not None:
+            if customer_id not in self.aggregates.customer_spending.index:
+                raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown customer '{customer_id}'.")
+            total_spending = float(self.aggregates.customer_spending[customer_id])
+            purchase_count = int(self.aggregates.customer_counts.get(customer_id, 0))
+        return {"customer_id": customer_id, "total_spending": total_spending, "purchase_count": purchase_count,
+                "segment": str(self.assigner.assign_customer(total_spending, purchase_count))}
+
+    def also_bought(self, product_id, n=10) -> list:
+        """
+        Products most often bought by the customers who bought ``product_id``.
+        """
+        # Pending co-purchase updates are read in place, so not while one is applied
+        with self._lock:
+            if self.cooccurrence.customer_count(product_id) == 0:
+                raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown product '{product_id}'.")
+            also_bought = self.cooccurrence.also_bought(product_id, n)
+        return [{"product_id": str(item), "customers": count, "share": share} for item, count, share in also_bought]
+
+    def top_products(self, n=10, category=None) -> list:
+        """
+        Best-selling products by revenue, overall or within ``category``.
+        """
+        if category is None:
+            sales = self.aggregates.product_sales
+        elif category in self.category_product_sales.index.get_level_values(0):
+            sales = self.category_product_sales.xs(category, level="Category")
+        else:
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown category '{category}'.")
+        top = sales.nlargest(n)
+        return [{"product_id": str(product_id), "total_sales": float(total)} for product_id, total in top.items()]
+
+
+class LatencyMetrics:
+    """
+    Latency percentiles per endpoint over the last ``window`` requests,
+    plus the sizes of the recommendation batches.
+    """
+
+    def __init__(self, window=10_000):
+        self.window = window
+        self._latencies = {}
+        self._counts = {}
+        self._batch_sizes = deque(maxlen=window)
+        self.batches = 0
+
+    def record(self, endpoint: str, seconds: float):
+        self._latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+        self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def record_batch(self, size: int):
+        self._batch_sizes.append(size)
+        self.batches += 1
+
+    def snapshot(self) -> dict:
+        endpoints = {}
+        for endpoint, latencies in self._latencies.items():
+            p50, p99 = np.percentile(np.fromiter(latencies, dtype=float), [50, 99]) * 1000
+            endpoints[endpoint] = {"requests": self._counts[endpoint],
+                                   "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3)}
+        return {
+            "endpoints": endpoints,
+            "recommendation_batches": self.batches,
+            "mean_batch_size": round(float(np.mean(self._batch_sizes)), 3) if self._batch_sizes else None,
+        }
+
+
+class RecommendationBatcher:
+    """
+    Coalesces concurrent recommendation requests into micro-batches.
+
+    Requests wait on a queue; a worker takes the first one, then gathers
+    more until it has ``max_batch_size`` of them or ``max_wait_ms`` has
+    passed, and scores the batch with one vectorized call in a worker
+    thread, so the event loop keeps accepting requests meanwhile. Under
+    light load a request waits at most ``max_wait_ms``; under heavy load
+    batches fill up and throughput grows with the batch size.
+    """
+
+    def __init__(self, service: AnalyticsService, metrics: LatencyMetrics = None, max_batch_size=64, max_wait_ms=2.0):
+        self.service = service
+        self.metrics = metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        self._executor = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        # One scoring thread: batches are scored in turn, never interleaved
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recommend")
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def recommend(self, customer_id, top_n=5) -> list:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((customer_id, top_n, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await next_batch(self._queue, self.max_batch_size, self.max_wait)
+            customer_ids = [customer_id for customer_id, _, _ in batch]
+            top_n = max(n for _, n, _ in batch)
+            try:
+                results = await loop.run_in_executor(self._executor, self.service.recommend_batch, customer_ids, top_n)
+            except Exception as e:
+                log_structured(logger, "error", "Failed to score recommendation batch", batch_size=len(batch), error=str(e))
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            if self.metrics is not None:
+                self.metrics.record_batch(len(batch))
+            for (_, n, future), recommendations in zip(batch, results):
+                if not future.done():
+                    future.set_result(recommendations[:n])
+
+
+async def next_batch(queue: asyncio.Queue, max_size: int, max_wait: float) -> list:
+    """
+    Wait for one item of ``queue``, then take more until there are
+    ``max_size`` or ``max_wait`` seconds have passed since the first.
+    """
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + max_wait
+    while len(batch) < max_size:
+        if not queue.empty():
+            batch.append(queue.get_nowait())
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+class AnalyticsServer:
+    """
+    Minimal HTTP/1.1 JSON server over an ``AnalyticsService``, on asyncio only.
+
+    Endpoints (all GET):
+
+    - ``/recommend?customer_id=C0001&top_n=5``
+    - ``/segment?customer_id=C0001``, or ``?total_spending=950&purchase_count=4``
+    - ``/top-products?n=10&category=Books``
+    - ``/also-bought?product_id=P001&n=10``: co-purchased products
+    - ``/metrics``: p50/p99 latency per endpoint, the batching figures and,
+      with an ingestor, its events per second
+    - ``/health``
+
+    Connections are kept alive between requests unless the client asks to close.
+
+    Parameters
+    ----------
+    service : AnalyticsService
+    host : str
+    port : int
+        0 picks a free port; see ``port`` after ``start``.
+    max_batch_size, max_wait_ms :
+        Micro-batching limits; see ``RecommendationBatcher``.
+    ingestor : PurchaseIngestor, optional
+        Feeds new purchases into ``service`` while the server runs.
+    """
+
+    def __init__(self, service: AnalyticsService, host="127.0.0.1", port=8000, max_batch_size=64, max_wait_ms=2.0,
+                 ingestor=None):
+        self.service = service
+        self.ingestor = ingestor
+        self.host = host
+        self.port = port
+        self.metrics = LatencyMetrics()
+        self.batcher = RecommendationBatcher(service, self.metrics, max_batch_size=max_batch_size,
+                                             max_wait_ms=max_wait_ms)
+        self.routes = {
+            "/recommend": self._recommend,
+            "/segment": self._segment,
+            "/top-products": self._top_products,
+            "/also-bought": self._also_bought,
+            "/metrics": self._metrics,
+            "/health": self._health,
+        }
+        self._server = None
+
+    async def start(self):
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_REQUEST_LINE)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.ingestor is not None:
+            await self.ingestor.start()
+        log_structured(logger, "info", "Analytics server listening", host=self.host, port=self.port)
+        return self
+
+    async def close(self):
+        if self.ingestor is not None:
+            await self.ingestor.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.batcher.close()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0) or 0):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                start = time.perf_counter()
+                method, target, version = (request_line.decode("latin-1").split() + ["", "", ""])[:3]
+                url = urlsplit(target)
+                status, body = await self._dispatch(method, url.path, parse_qs(url.query))
+                keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+                payload = json.dumps(body).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload)
+                await writer.drain()
+                if url.path in self.routes:
+                    self.metrics.record(url.path, time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, query):
+        handler = self.routes.get(path)
+        if handler is None:
+            return HTTPStatus.NOT_FOUND, {"error": f"No endpoint {path}."}
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{path} only accepts GET."}
+        try:
+            return HTTPStatus.OK, await handler({name: values[-1] for name, values in query.items()})
+        except ServiceError as e:
+            return e.status, {"error": str(e)}
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            log_structured(logger, "error", "Request failed", path=path, error=str(e))
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error."}
+
+    async def _recommend(self, params):
+        customer_id = _required(params, "customer_id")
+        top_n = _int_param(params, "top_n", 5, 1, MAX_TOP_N)
+        if not self.service.has_customer(customer_id):
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown customer '{customer_id}'.")
+        recommendations = await self.batcher.recommend(customer_id, top_n)
+        return {"customer_id": customer_id,
+                "recommendations": [{"product_id": str(item), "predicted_amount": est}
+                                    for item, est in recommendations]}
+
+    async def _segment(self, params):
+        if "customer_id" in params:
+            return self.service.segment(customer_id=params["customer_id"])
+        total_spending = float(_required(params, "total_spending"))
+        purchase_count = _int_param(params, "purchase_count", None, 0, None)
+        if purchase_count is None:
+            raise ValueError("Pass customer_id, or total_spending and purchase_count.")
+        return self.service.segment(total_spending=total_spending, purchase_count=purchase_count)
+
+    async def _top_products(self, params):
+        return {"category": params.get("category"),
+                "products": self.service.top_products(_int_param(params, "n", 10, 1, MAX_TOP_N), params.get("category"))}
+
+    async def _also_bought(self, params):
+        product_id = _required(params, "product_id")
+        return {"product_id": product_id,
+                "products": self.service.also_bought(product_id, _int_param(params, "n", 10, 1, MAX_TOP_N))}
+
+    async def _metrics(self, params):
+        metrics = self.metrics.snapshot()
+        if self.ingestor is not None:
+            metrics["ingestion"] = self.ingestor.stats()
+        return metrics
+
+    async def _health(self, params):
+        return {"status": "ok"}
+
+
+def _required(params, name):
+    if not params.get(name):
+        raise ValueError(f"Missing query parameter '{name}'.")
+    return params[name]
+
+
+def _int_param(params, name, default, low, high):
+    if name not in params:
+        return default
+    value = int(params[name])
+    if value < low or (high is not None and value > high):
+        raise ValueError(f"'{name}' must be between {low} and {high}." if high is not None
+                         else f"'{name}' must be at least {low}.")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recommendations, segments and top products over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (0.0.0.0 in a container).")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--purchases", default="data/purchases.csv", help="Purchases file to load.")
+    parser.add_argument("--engine", choices=["surprise", "sparse"], default="surprise", help="Recommender engine.")
+    parser.add_argument("--max-batch-size", type=int, default=64,
+                        help="Most recommendation requests scored together.")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                        help="Longest a recommendation request waits for others to batch with.")
+    ingest = parser.add_mutually_exclusive_group()
+    ingest.add_argument("--ingest-file", default=None, metavar="PATH",
+                        help="Ingest purchases appended to this CSV file while serving.")
+    ingest.add_argument("--ingest-port", type=int, default=None, metavar="PORT",
+                        help="Ingest JSON-lines purchase events sent to this local TCP port while serving.")
+    args = parser.parse_args(argv)
+
+    service = AnalyticsService.from_purchases(args.purchases, engine=args.engine)
+    ingestor = None
+    if args.ingest_file or args.ingest_port is not None:
+        from src.ingestion import FileTailSource, PurchaseIngestor, SocketSource
+        source = FileTailSource(args.ingest_file) if args.ingest_file else SocketSource(args.host, args.ingest_port)
+        ingestor = PurchaseIngestor(service, source)
+    server = AnalyticsServer(service, host=args.host, port=args.port,
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, ingestor=ingestor)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import cProfile
+import pstats
+from contextlib import contextmanager
+from src.logging_utils import get_logger, log_structured
+from src.resource_usage import ResourceMeter
+
+logger = get_logger(__name__)
+
+
+class Span:
+    """
+    Measurements of one pipeline stage; set ``rows_out`` inside the span.
+    """
+
+    def __init__(self, stage: str, rows_in=None):
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.status = "ok"
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_delta_mb = None
+        self.profile_file = None
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "status": self.status,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "peak_rss_delta_mb": round(self.peak_rss_delta_mb, 2),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "profile_file": self.profile_file,
+        }
+
+
+class PipelineTracer:
+    """
+    Per-stage spans for ``run_pipeline``.
+
+    Each span records wall time, CPU time, peak RSS growth and the rows going
+    in and out of the stage, and is logged through ``log_structured`` as
+    "Pipeline stage completed" (or "Pipeline stage failed").
+
+    With ``profile_dir``, every stage also runs under cProfile and its stats
+    are dumped to ``<profile_dir>/<NN>-<stage>.prof``. The dumps are regular
+    pstats files: ``python -m pstats``, snakeviz, or flameprof (for a flame
+    graph) can read them.
+
+    Parameters
+    ----------
+    profile_dir : str, optional
+        Directory for the per-stage profiles; profiling is off when omitted.
+    """
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage: str, rows_in=None):
+        span = Span(stage, rows_in)
+        profiler = cProfile.Profile() if self.profile_dir else None
+        meter = ResourceMeter()
+        try:
+            with meter:
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield span
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        except BaseException:
+            span.status = "error"
+            raise
+        finally:
+            self._finish(span, meter, profiler)
+
+    def _finish(self, span: Span, meter: ResourceMeter, profiler):
+        span.wall_seconds = meter.wall_seconds
+        span.cpu_seconds = meter.cpu_seconds
+        span.peak_rss_delta_mb = meter.peak_rss_delta_mb
+        if profiler is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            span.profile_file = os.path.join(self.profile_dir, f"{len(self.spans) + 1:02d}-{span.stage}.prof")
+            profiler.dump_stats(span.profile_file)
+        self.spans.append(span)
+        if span.status == "ok":
+            log_structured(logger, "info", "Pipeline stage completed", **span.to_dict())
+        else:
+            log_structured(logger, "error", "Pipeline stage failed", **span.to_dict())
+
+    def summary_table(self, top_functions=3) -> str:
+        """
+        Plain-text table of every span, followed (when profiling) by each
+        stage's most expensive functions by cumulative time.
+        """
+        lines = [f"{'stage':<12}{'status':<8}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}{'rows in':>12}{'rows out':>12}"]
+        for span in self.spans:
+            lines.append(f"{span.stage:<12}{span.status:<8}{span.wall_seconds:>10.3f}{span.cpu_seconds:>10.3f}"
+                         f"{span.peak_rss_delta_mb:>10.1f}{_count(span.rows_in):>12}{_count(span.rows_out):>12}")
+        total_wall = sum(span.wall_seconds for span in self.spans)
+        lines.append(f"{'total':<20}{total_wall:>10.3f}")
+
+        for span in self.spans:
+            if span.profile_file is None:
+                continue
+            lines.append("")
+            lines.append(f"{span.stage} ({span.profile_file}):")
+            stats = pstats.Stats(span.profile_file)
+            # stats.stats maps (file, line, function) -> (calls, primitive calls, tottime, cumtime, callers)
+            ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            for (filename, line, function), (_, _, _, cumtime, _) in ranked[:top_functions]:
+                lines.append(f"  {cumtime:>9.3f}s  {function} ({os.path.basename(filename)}:{line})")
+        return "\n".join(lines)
+
+
+def _count(value):
+    return "-" if value is None else str(value)
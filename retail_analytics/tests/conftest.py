@@ -0,0 +1,54 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import numpy as np
+import pandas as pd
+
+PURCHASE_COLUMNS = ["CustomerID", "ProductID", "Category", "PurchaseAmount", "PurchaseDate"]
+
+def purchases_frame(n=200, seed=0, customers=20, products=10, categories=("Books", "Electronics", "Toys"),
+                    start="2024-01-01", days=365, amounts="uniform", product_format="P{}", date_format=None,
+                    rows=None):
+    """
+    Purchases frame for tests, with the columns of the purchases file.
+
+    Args:
+        n: Number of purchases.
+        seed: Seed of the random draws; the same arguments give the same frame.
+        customers, products: Number of distinct IDs (C0.., P0..) drawn from.
+        categories: Categories drawn from.
+        start, days: PurchaseDate is drawn from the ``days`` days from ``start``.
+        amounts: "uniform" (5 to 500) or "lognormal" (skewed, as in real spend).
+        product_format: Format of product IDs, e.g. "P{:02d}" for sortable IDs.
+        date_format: Write PurchaseDate as strings in this format (as read
+            from a CSV) instead of timestamps.
+        rows: Explicit (CustomerID, ProductID, Category, PurchaseAmount,
+            PurchaseDate) tuples; replaces the random draws.
+
+    Returns:
+        pd.DataFrame: The purchases.
+    """
+    if rows is not None:
+        df = pd.DataFrame(rows, columns=PURCHASE_COLUMNS)
+        df["PurchaseAmount"] = df["PurchaseAmount"].astype(float)
+    else:
+        rng = np.random.default_rng(seed)
+        df = pd.DataFrame({
+            "CustomerID": [f"C{i}" for i in rng.integers(0, customers, n)],
+            "ProductID": [product_format.format(i) for i in rng.integers(0, products, n)],
+            "Category": rng.choice(list(categories), n),
+            "PurchaseAmount": (rng.lognormal(4, 1, n) if amounts == "lognormal" else rng.uniform(5, 500, n)).round(2),
+            "PurchaseDate": pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit="D"),
+        })
+    df["PurchaseDate"] = pd.to_datetime(df["PurchaseDate"])
+    if date_format is not None:
+        df["PurchaseDate"] = df["PurchaseDate"].dt.strftime(date_format)
+    return df
+
+@pytest.fixture
+def make_purchases():
+    """
+    The ``purchases_frame`` factory, e.g. ``make_purchases(n=300, seed=1, customers=40)``.
+    """
+    return purchases_frame
@@ -0,0 +1,81 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import pandas as pd
+from src.aggregates import PurchaseAggregates
+from src.clustering import create_customer_clusters
+from src.data_loading import iter_purchase_chunks, load_and_validate_purchases, filter_data
+
+def _purchases():
+    data = {
+        "CustomerID": ["C1", "C2", "C3", "C1", "C4", "C2", "C5", "C3"],
+        "ProductID": ["P1", "P2", "P3", "P4", "P1", "P3", "P2", "P2"],
+        "Category": ["Books", "Electronics", "Toys", "Books", "Books", "Toys", "Electronics", "Electronics"],
+        "PurchaseAmount": [10.5, 99.99, 5.0, 20.0, 42.0, 7.25, 300.0, 12.0],
+        "PurchaseDate": pd.to_datetime(["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04",
+                                        "2025-01-05", "2025-01-06", "2025-01-07", "2025-01-08"])
+    }
+    return pd.DataFrame(data)
+
+def test_from_frame_matches_groupby():
+    df = _purchases()
+    df.loc[1, "CustomerID"] = None
+    aggregates = PurchaseAggregates.from_frame(df)
+
+    pd.testing.assert_series_equal(aggregates.product_sales, df.groupby("ProductID")["PurchaseAmount"].sum())
+    pd.testing.assert_series_equal(aggregates.category_sales, df.groupby("Category")["PurchaseAmount"].sum())
+    assert aggregates.customer_spending.to_dict() == df.groupby("CustomerID")["PurchaseAmount"].sum().to_dict()
+    assert aggregates.customer_counts.to_dict() == df.groupby("CustomerID")["ProductID"].count().to_dict()
+
+def test_merged_chunks_match_full_frame():
+    df = _purchases()
+    full = PurchaseAggregates.from_frame(df)
+
+    merged = PurchaseAggregates()
+    for start in range(0, len(df), 3):
+        merged = merged.merge(PurchaseAggregates.from_frame(df.iloc[start:start + 3]))
+
+    assert merged.row_count == full.row_count
+    pd.testing.assert_series_equal(merged.product_sales, full.product_sales)
+    pd.testing.assert_series_equal(merged.category_sales, full.category_sales)
+    pd.testing.assert_frame_equal(merged.customer_features(), full.customer_features())
+
+def test_merges_sort_each_total_once_when_read(monkeypatch):
+    df = _purchases()
+    full = PurchaseAggregates.from_frame(df)
+    expected = full.customer_spending, full.customer_last_purchase
+    sorts = []
+    sort_index = pd.Series.sort_index
+    monkeypatch.setattr(pd.Series, "sort_index", lambda series, **kwargs: sorts.append(series.name) or
+                        sort_index(series, **kwargs))
+
+    merged = PurchaseAggregates()
+    for start in reversed(range(len(df))):
+        merged = merged.merge(PurchaseAggregates.from_frame(df.iloc[start:start + 1]))
+    assert sorts == []
+
+    pd.testing.assert_series_equal(merged.customer_spending, expected[0])
+    pd.testing.assert_series_equal(merged.customer_last_purchase, expected[1])
+    merged.customer_spending
+    assert sorts == ["PurchaseAmount", "PurchaseDate"]
+
+def test_clusters_from_streamed_chunks(tmp_path):
+    csv_path = tmp_path / "purchases.csv"
+    _purchases().to_csv(csv_path, index=False)
+
+    df = filter_data(load_and_validate_purchases(str(csv_path)), start_date="2025-01-02")
+    aggregates = PurchaseAggregates()
+    for chunk in iter_purchase_chunks(str(csv_path), chunksize=3):
+        aggregates = aggregates.merge(PurchaseAggregates.from_frame(filter_data(chunk, start_date="2025-01-02")))
+
+    in_memory = create_customer_clusters(df, n_clusters=2)
+    streamed = create_customer_clusters(n_clusters=2, aggregates=aggregates)
+    pd.testing.assert_frame_equal(in_memory, streamed)
+
+    print(streamed)
+
+if __name__ == "__main__":
+    test_from_frame_matches_groupby()
+    test_merged_chunks_match_full_frame()
+    test_merges_sort_each_total_once_when_read(pytest.MonkeyPatch())
@@ -0,0 +1,111 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import pandas as pd
+from src import security
+from src.aggregates import PurchaseAggregates
+from src.analytics_state import AnalyticsState
+from src.data_loading import load_and_validate_purchases
+from src.encrypted_files import encrypt_file
+
+# Daily drops as read from CSV files
+DAILY = dict(customers=50, products=12, days=30, date_format="%Y-%m-%d")
+
+def test_absorbing_daily_files_matches_full_scan(tmp_path, make_purchases):
+    history, appended, drop = (make_purchases(200, 1, **DAILY), make_purchases(40, 2, start="2024-02-01", **DAILY),
+                               make_purchases(30, 3, start="2024-03-01", **DAILY))
+    history.to_csv(tmp_path / "purchases.csv", index=False)
+    drop.to_csv(tmp_path / "day2.csv", index=False)
+
+    state = AnalyticsState(str(tmp_path / "state"))
+    assert state.absorb(str(tmp_path / "purchases.csv")) == 200
+    state.save()
+
+    # Rows appended to a known file are read from the previous offset only
+    with open(tmp_path / "purchases.csv", "a") as f:
+        appended.to_csv(f, index=False, header=False)
+    state = AnalyticsState.load(str(tmp_path / "state"))
+    assert state.absorb(str(tmp_path / "purchases.csv")) == 40
+    assert state.absorb(str(tmp_path / "day2.csv")) == 30
+    assert state.absorb(str(tmp_path / "day2.csv")) == 0
+    state.save()
+
+    state = AnalyticsState.load(str(tmp_path / "state"))
+    full = pd.concat([load_and_validate_purchases(str(tmp_path / "purchases.csv")),
+                      load_and_validate_purchases(str(tmp_path / "day2.csv"))], ignore_index=True)
+    expected = PurchaseAggregates.from_frame(full)
+
+    assert state.aggregates.row_count == 270
+    pd.testing.assert_series_equal(state.aggregates.product_sales, expected.product_sales, check_exact=False)
+    pd.testing.assert_series_equal(state.aggregates.category_counts, expected.category_counts)
+    pd.testing.assert_frame_equal(state.aggregates.customer_features(), expected.customer_features(),
+                                  check_exact=False)
+    pd.testing.assert_series_equal(state.aggregates.customer_last_purchase, expected.customer_last_purchase)
+    assert len(state.interactions()) == 270
+    assert [len(part) for part in state.interaction_parts()] == [200, 40, 30]
+
+def test_appended_rows_are_absorbed_in_chunks(tmp_path, monkeypatch, make_purchases):
+    path = tmp_path / "purchases.csv"
+    make_purchases(30, 1, **DAILY).to_csv(path, index=False)
+    state = AnalyticsState(str(tmp_path / "state"))
+    assert state.absorb(str(path), chunksize=16) == 30
+
+    appended = make_purchases(100, 2, start="2024-02-01", **DAILY).to_csv(index=False, header=False)
+    # The last line is still being written
+    with open(path, "a") as f:
+        f.write(appended + "C1,P1,Bo")
+    reads = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, "read_csv", lambda *args, **kwargs: reads.append(kwargs.get("chunksize"))
+                        or read_csv(*args, **kwargs))
+    assert state.absorb(str(path), chunksize=16) == 100
+    assert reads == [16]
+    assert [len(part) for part in state.interaction_parts()] == [16, 14] + [16] * 6 + [4]
+    full = load_and_validate_purchases(str(path)).iloc[:130]
+    pd.testing.assert_series_equal(state.aggregates.customer_spending.sort_index(),
+                                   PurchaseAggregates.from_frame(full).customer_spending.sort_index(),
+                                   check_exact=False)
+
+    with open(path, "a") as f:
+        f.write("oks,10.0,2024-02-03\n")
+    assert state.absorb(str(path), chunksize=16) == 1
+
+def test_rewritten_file_is_rejected(tmp_path, make_purchases):
+    path = tmp_path / "purchases.csv"
+    make_purchases(50, 1, **DAILY).to_csv(path, index=False)
+    state = AnalyticsState(str(tmp_path / "state"))
+    state.absorb(str(path))
+
+    make_purchases(60, 2, **DAILY).to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        state.absorb(str(path))
+
+def test_encrypted_files_are_absorbed_as_plaintext(tmp_path, monkeypatch, make_purchases):
+    # The default SECRET_KEY is not a valid AES key length
+    monkeypatch.setattr(security, "SECRET_KEY", "k" * 32)
+    plain, encrypted = tmp_path / "day.csv", str(tmp_path / "day.csv.enc")
+    history = make_purchases(80, 1, **DAILY)
+    history.to_csv(plain, index=False)
+    encrypt_file(str(plain), encrypted, chunk_size=256)
+    state = AnalyticsState(str(tmp_path / "state"))
+    assert state.absorb(encrypted) == 80
+
+    # Re-encrypted with rows appended: only the new rows are read
+    make_purchases(20, 2, **DAILY).to_csv(plain, mode="a", header=False, index=False)
+    encrypt_file(str(plain), encrypted, chunk_size=256)
+    assert state.absorb(encrypted) == 20
+    assert state.absorb(encrypted) == 0
+    expected = PurchaseAggregates.from_frame(load_and_validate_purchases(str(plain)))
+    assert state.aggregates.row_count == 100
+    pd.testing.assert_series_equal(state.aggregates.customer_spending.sort_index(),
+                                   expected.customer_spending.sort_index(), check_exact=False)
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    import pathlib
+    import tempfile
+    test_absorbing_daily_files_matches_full_scan(pathlib.Path(tempfile.mkdtemp()), purchases_frame)
+    test_encrypted_files_are_absorbed_as_plaintext(pathlib.Path(tempfile.mkdtemp()), pytest.MonkeyPatch(),
+                                                   purchases_frame)
+    test_appended_rows_are_absorbed_in_chunks(pathlib.Path(tempfile.mkdtemp()), pytest.MonkeyPatch(), purchases_frame)
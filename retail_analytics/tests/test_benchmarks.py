@@ -0,0 +1,70 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import copy
+import pytest
+from src.benchmarks import find_regressions, load_history, main, parse_import_times, run_benchmarks
+
+STAGES = [
+    "load_and_validate_purchases",
+    "filter_data",
+    "analyze_data",
+    "create_customer_clusters",
+    "build_collaborative_filtering_model[surprise]",
+    "recommend_for_customer",
+    "generate_pdf_report",
+]
+
+def test_run_benchmarks_records_every_stage():
+    run = run_benchmarks(sizes=[2_000], seed=1)
+    assert [record["stage"] for record in run["results"]] == STAGES
+    for record in run["results"]:
+        assert record["size"] == 2_000
+        assert record["wall_seconds"] > 0
+        assert record["peak_memory_mb"] >= 0
+    assert run["results"][0]["rows"] == 2_000
+    # Small enough for KNNBasic: the item-item engine is compared with it
+    [comparison] = run["knn_comparison"]
+    assert comparison["size"] == 2_000 and comparison["customers"] <= 200
+    assert comparison["ItemKNN"]["fit_seconds"] >= 0 and comparison["KNNBasic"]["peak_memory_mb"] > 0
+
+    print(run["results"])
+
+def test_regression_gate():
+    baseline = {"results": [
+        {"stage": "filter_data", "size": 1000, "wall_seconds": 1.0, "peak_memory_mb": 100.0},
+        {"stage": "analyze_data", "size": 1000, "wall_seconds": 0.01, "peak_memory_mb": 1.0},
+    ]}
+    run = copy.deepcopy(baseline)
+    run["results"][0]["wall_seconds"] = 1.2
+    run["results"][1]["wall_seconds"] = 0.04  # 4x slower, but within the noise floor
+    assert find_regressions(run, baseline, threshold=0.25) == []
+
+    run["results"][0]["peak_memory_mb"] = 200.0
+    regressions = find_regressions(run, baseline, threshold=0.25)
+    assert [(r["stage"], r["metric"]) for r in regressions] == [("filter_data", "peak_memory_mb")]
+    assert find_regressions(run, None) == []
+
+def test_main_appends_history(tmp_path):
+    history_path = str(tmp_path / "history.json")
+    assert main(["--sizes", "1000", "--history", history_path]) == 0
+    main(["--sizes", "1000", "--history", history_path])
+
+    history = load_history(history_path)
+    assert len(history["runs"]) == 2
+    assert history["baseline"]["timestamp"] == history["runs"][0]["timestamp"]
+
+def test_parse_import_times_keeps_top_level_modules():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       500 |        500 |     numpy.core",
+        "import time:      1000 |       1500 |   numpy",
+        "import time:      2000 |       3500 | pandas",
+        "import time:       250 |        250 | json",
+    ])
+    assert parse_import_times(output) == {"pandas": 0.0035, "json": 0.00025}
+
+if __name__ == "__main__":
+    test_parse_import_times_keeps_top_level_modules()
+    test_run_benchmarks_records_every_stage()
+    test_regression_gate()
@@ -0,0 +1,60 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import pandas as pd
+from src.charts import ChartRenderer, chart_key, prune_chart_cache, wait_for_charts
+from src.data_analysis import analyze_data, analysis_charts
+
+ROWS = [
+    ("C1", "P1", "Electronics", 10.0, "2024-07-01"), ("C2", "P2", "Books", 20.0, "2024-07-01"),
+    ("C1", "P2", "Books", 5.0, "2024-07-02"), ("C3", "P3", "Toys", 7.5, "2024-07-03"),
+]
+
+def test_charts_render_in_parallel_and_are_cached(tmp_path, make_purchases):
+    results = analyze_data(make_purchases(rows=ROWS))
+    clusters = pd.DataFrame({"CustomerID": ["C1", "C2", "C3"], "ClusterLabel": ["Low", "High", "Low"]})
+    charts = analysis_charts(results, clusters)
+    assert results["daily_revenue"].tolist() == [30.0, 5.0, 7.5]
+
+    options = {"cache_dir": str(tmp_path / "cache"), "output_dir": str(tmp_path / "out")}
+    with ChartRenderer(**options) as renderer:
+        futures = renderer.render_all(charts)
+    assert sorted(futures) == ["category_sales", "revenue_trend", "segment_sizes", "top_products"]
+    assert all(os.path.getsize(future.result()) > 0 for future in futures.values())
+    assert len(os.listdir(tmp_path / "cache")) == 4
+
+    # Same data: served from the cache without starting a worker
+    renderer = ChartRenderer(use_processes=False, **options)
+    assert renderer.submit("top_products", charts["top_products"]).done()
+    assert renderer._executor is None
+
+def test_cache_keeps_the_most_recently_used_images(tmp_path):
+    options = {"cache_dir": str(tmp_path / "cache"), "output_dir": str(tmp_path / "out"), "use_processes": False}
+    with ChartRenderer(max_cached=2, **options) as renderer:
+        for i in range(4):
+            sales = pd.Series([1.0, float(i)], index=pd.Index(["P1", "P2"], name="ProductID"))
+            renderer.submit("top_products", sales).result()
+        futures = renderer.render_all({"category_sales": sales, "segment_sizes": None})
+    assert wait_for_charts(futures) == {"category_sales": str(tmp_path / "out" / "category_sales.png")}
+    cached = sorted(os.listdir(tmp_path / "cache"))
+    assert len([name for name in cached if name.startswith("top_products-")]) == 2
+    assert len([name for name in cached if name.startswith("category_sales-")]) == 1
+
+    # Images of other kinds are never pruned
+    assert prune_chart_cache(str(tmp_path / "cache"), "top_products", keep=0) != []
+    assert os.listdir(tmp_path / "cache") == [name for name in cached if name.startswith("category_sales-")]
+
+def test_key_follows_the_plotted_data():
+    sales = pd.Series([1.0, 2.0], index=pd.Index(["P1", "P2"], name="ProductID"))
+    assert chart_key("top_products", sales) == chart_key("top_products", sales.copy())
+    assert chart_key("top_products", sales) != chart_key("top_products", sales * 2)
+    assert chart_key("top_products", sales) != chart_key("category_sales", sales)
+    with pytest.raises(ValueError):
+        ChartRenderer().submit("pie", sales)
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    test_key_follows_the_plotted_data()
+    test_cache_keeps_the_most_recently_used_images(pathlib.Path(tempfile.mkdtemp()))
@@ -2,8 +2,12 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
 import pytest
+import multiprocessing
+import time
+import numpy as np
 import pandas as pd
-from src.clustering import create_customer_clusters
+from src.clustering import auto_cluster_customers, create_customer_clusters, select_cluster_count
+from src.model_store import ModelStore
 
 def test_create_customer_clusters():
     
@@ -21,5 +25,77 @@ def test_create_customer_clusters():
 
     print(result)
 
+def _many_customers(n=6000, seed=4):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "CustomerID": [f"C{i}" for i in rng.integers(0, 1500, n)],
+        "ProductID": [f"P{i}" for i in rng.integers(0, 20, n)],
+        "Category": "Books",
+        "PurchaseAmount": rng.lognormal(4, 1, n).round(2),
+    })
+
+def test_minibatch_clusters_keep_spend_labels(tmp_path):
+    df = _many_customers()
+    store = ModelStore(str(tmp_path))
+    result = create_customer_clusters(df, mode="minibatch", batch_size=256, model_store=store)
+
+    order = (result.groupby("ClusterLabel")["TotalSpending"].mean().sort_values().index.tolist())
+    assert order == ["Low Spenders", "Moderate Spenders", "High Spenders", "Very High Spenders"]
+
+    # A later run on changed data warm-starts from the stored centroids
+    warm = create_customer_clusters(df.iloc[:5500], mode="minibatch", batch_size=256, model_store=store)
+    assert set(warm["ClusterLabel"]) == set(result["ClusterLabel"])
+    assert len(os.listdir(tmp_path / "clustering")) == 2
+
+@pytest.mark.parametrize("n_clusters, expected", [
+    (2, ["Low Spenders", "Moderate Spenders"]),
+    (3, ["Low Spenders", "Moderate Spenders", "High Spenders"]),
+    (6, ["Low Spenders", "Moderate Spenders", "High Spenders", "Very High Spenders", "Cluster 4", "Cluster 5"]),
+])
+def test_segment_labels_follow_spending_order(n_clusters, expected):
+    result = create_customer_clusters(_many_customers(600), n_clusters=n_clusters)
+    order = result.groupby("ClusterLabel")["TotalSpending"].mean().sort_values().index.tolist()
+    assert order == expected
+
+def test_minibatch_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        create_customer_clusters(_many_customers(100), mode="online")
+
+def _separated_customers(n_groups=3, per_group=200, seed=7):
+    rng = np.random.default_rng(seed)
+    centres = [(100, 2), (1000, 8), (5000, 20)][:n_groups]
+    return pd.DataFrame({
+        "TotalSpending": np.concatenate([rng.normal(s, s * 0.05, per_group) for s, _ in centres]),
+        "PurchaseCount": np.concatenate([rng.normal(c, 0.5, per_group) for _, c in centres]),
+    })
+
+@pytest.mark.parametrize("criterion", ["silhouette", "elbow"])
+def test_select_cluster_count_finds_separated_groups(criterion):
+    n_clusters, diagnostics = select_cluster_count(_separated_customers(), k_values=range(2, 7),
+                                                   criterion=criterion, sample_size=300, max_workers=2)
+    assert n_clusters == 3
+    assert diagnostics["k"].tolist() == [2, 3, 4, 5, 6]
+    assert diagnostics["inertia"].is_monotonic_decreasing
+
+    print(diagnostics)
+
+def test_time_budget_terminates_running_fits():
+    features = _separated_customers(per_group=20_000)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        select_cluster_count(features, k_values=range(2, 9), sample_size=60_000, time_budget=0.2, max_workers=2)
+    assert time.monotonic() - start < 5
+    assert multiprocessing.active_children() == []
+
+def test_auto_cluster_customers_labels_every_cluster():
+    result, diagnostics = auto_cluster_customers(_many_customers(), k_values=range(2, 5), max_workers=2)
+    chosen = int(diagnostics.loc[diagnostics["silhouette"].idxmax(), "k"])
+    assert result["Cluster"].nunique() == chosen
+    assert not result["ClusterLabel"].str.startswith("Cluster").any()
+
 if __name__ == "__main__":
     test_create_customer_clusters()
+    test_segment_labels_follow_spending_order(2, ["Low Spenders", "Moderate Spenders"])
+    test_minibatch_rejects_unknown_mode()
+    test_select_cluster_count_finds_separated_groups("silhouette")
+    test_auto_cluster_customers_labels_every_cluster()
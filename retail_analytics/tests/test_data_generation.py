@@ -0,0 +1,44 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')))
+import pytest
+from datetime import date
+import pandas as pd
+from data_generation import main as generate_data
+from src.data_loading import load_and_validate_purchases
+
+def test_seeded_generation_is_reproducible(tmp_path):
+    for run in ("a", "b"):
+        generate_data(num_customers=300, num_products=40, num_purchases=20_000, seed=7, chunksize=6_000,
+                      output_dir=str(tmp_path / run), parquet=True, end_date=date(2024, 12, 31))
+
+    with open(tmp_path / "a" / "purchases.csv", "rb") as a, open(tmp_path / "b" / "purchases.csv", "rb") as b:
+        assert a.read() == b.read()
+
+    df = load_and_validate_purchases(str(tmp_path / "a" / "purchases.csv"))
+    columnar = load_and_validate_purchases(str(tmp_path / "a" / "purchases.parquet"))
+    assert len(df) == len(columnar) == 20_000
+    pd.testing.assert_series_equal(df["PurchaseAmount"], columnar["PurchaseAmount"])
+    assert df["PurchaseDate"].max() == pd.Timestamp("2024-12-31")
+    assert df["CustomerID"].nunique() <= 300 and df["ProductID"].nunique() <= 40
+
+def test_generated_data_is_skewed(tmp_path):
+    generate_data(num_customers=1000, num_products=100, num_purchases=50_000, seed=1,
+                  output_dir=str(tmp_path), end_date=date(2024, 12, 31))
+    df = load_and_validate_purchases(str(tmp_path / "purchases.csv"))
+
+    # Zipfian products: the most popular one sells far more than an average one
+    product_counts = df["ProductID"].value_counts()
+    assert product_counts.iloc[0] > 10 * product_counts.mean()
+    # Heavy-tailed spenders: the top 10% of customers bring in well over 10% of revenue
+    spending = df.groupby("CustomerID")["PurchaseAmount"].sum().sort_values(ascending=False)
+    assert spending.head(len(spending) // 10).sum() > 0.3 * spending.sum()
+    # Seasonality: December outsells June
+    monthly = df["PurchaseDate"].dt.month.value_counts()
+    assert monthly[12] > monthly[6]
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    test_generated_data_is_skewed(pathlib.Path(tempfile.mkdtemp()))
@@ -19,6 +19,38 @@ def test_load_and_validate_purchases():
 
     print(loaded_df)
 
+def test_load_and_validate_purchases_cache(tmp_path):
+    csv_path = tmp_path / "purchases.csv"
+    csv_path.write_text(
+        "CustomerID,ProductID,Category,PurchaseAmount,PurchaseDate\n"
+        "C1,P1,Books,10.5,2025-01-01\n"
+        "C2,P2,Electronics,99.99,not-a-date\n"
+        "C3,P3,Toys,5,2025-01-03\n"
+    )
+    cache_dir = str(tmp_path / "cache")
+
+    parsed = load_and_validate_purchases(str(csv_path), cache_dir=cache_dir)
+    cached = load_and_validate_purchases(str(csv_path), cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(parsed, cached)
+
+    subset = load_and_validate_purchases(str(csv_path), cache_dir=cache_dir,
+                                         columns=["CustomerID", "PurchaseAmount"])
+    assert list(subset.columns) == ["CustomerID", "PurchaseAmount"]
+
+    # Touching the file without changing it keeps the cache; editing it does not
+    os.utime(csv_path, ns=(0, 0))
+    assert load_and_validate_purchases(str(csv_path), cache_dir=cache_dir).shape[0] == 2
+    with open(csv_path, "a") as f:
+        f.write("C4,P4,Home,1.25,2025-01-04\n")
+    assert load_and_validate_purchases(str(csv_path), cache_dir=cache_dir).shape[0] == 3
+
+    # A same-named file elsewhere gets its own cache entry
+    other_path = tmp_path / "other" / "purchases.csv"
+    other_path.parent.mkdir()
+    other_path.write_text("CustomerID,ProductID,Category,PurchaseAmount,PurchaseDate\nC9,P9,Toys,1,2025-02-01\n")
+    assert list(load_and_validate_purchases(str(other_path), cache_dir=cache_dir)["CustomerID"]) == ["C9"]
+    assert load_and_validate_purchases(str(csv_path), cache_dir=cache_dir).shape[0] == 3
+
 def test_filter_data():
     data = {
         "CustomerID": ["C1", "C2", "C3"],
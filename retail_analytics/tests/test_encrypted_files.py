@@ -0,0 +1,75 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import io
+import pytest
+import pandas as pd
+import src.security as security
+from src.data_loading import iter_purchase_chunks, load_and_validate_purchases
+from src.encrypted_files import HEADER, encrypt_file, is_encrypted_file, open_encrypted
+
+@pytest.fixture(autouse=True)
+def aes_key(monkeypatch):
+    # The default SECRET_KEY is not a valid AES key length
+    monkeypatch.setattr(security, "SECRET_KEY", "k" * 32)
+
+def test_encrypted_csv_loads_like_the_plaintext(tmp_path, make_purchases):
+    plain = str(tmp_path / "purchases.csv")
+    make_purchases(300, 1).to_csv(plain, index=False)
+    encrypted = encrypt_file(plain, chunk_size=1000)
+    assert is_encrypted_file(encrypted) and not is_encrypted_file(plain)
+    assert b"Books" not in open(encrypted, "rb").read()
+
+    expected = load_and_validate_purchases(plain)
+    cache_dir = str(tmp_path / "cache")
+    pd.testing.assert_frame_equal(load_and_validate_purchases(encrypted, cache_dir=cache_dir), expected)
+    assert not os.path.exists(cache_dir)  # no plaintext copy at rest
+    chunks = list(iter_purchase_chunks(encrypted, chunksize=64))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+    # Writing onto the source would truncate it before it is read
+    with pytest.raises(ValueError):
+        encrypt_file(plain, plain)
+    pd.testing.assert_frame_equal(load_and_validate_purchases(plain), expected)
+
+def test_written_parquet_is_readable_with_random_access(tmp_path, make_purchases):
+    path = str(tmp_path / "purchases.parquet.enc")
+    with open_encrypted(path, "wb", chunk_size=512) as f:
+        make_purchases(300, 1).to_parquet(f)
+    assert len(load_and_validate_purchases(path)) == 300
+
+    plain = io.BytesIO()
+    make_purchases(300, 1).to_parquet(plain)
+    with open_encrypted(path) as f:
+        f.seek(-100, io.SEEK_END)
+        assert f.read() == plain.getvalue()[-100:]
+        f.seek(700)
+        assert f.read(1000) == plain.getvalue()[700:1700]
+
+def test_tampering_truncation_and_wrong_keys_are_detected(tmp_path, monkeypatch):
+    path = str(tmp_path / "purchases.csv.enc")
+    with open_encrypted(path, "wb", chunk_size=100) as f:
+        f.write(b"x" * 1000)
+    data = open(path, "rb").read()
+
+    tampered = tmp_path / "tampered.enc"
+    tampered.write_bytes(data[:HEADER.size + 10] + bytes([data[HEADER.size + 10] ^ 1]) + data[HEADER.size + 11:])
+    truncated = tmp_path / "truncated.enc"
+    truncated.write_bytes(data[:HEADER.size + 5 * (4 + 100 + 16)])  # drops whole chunks
+    for broken in (tampered, truncated):
+        with pytest.raises(ValueError), open_encrypted(str(broken)) as f:
+            f.read()
+
+    monkeypatch.setattr(security, "SECRET_KEY", "z" * 32)
+    with pytest.raises(ValueError), open_encrypted(path) as f:
+        f.read()
+    monkeypatch.setattr(security, "SECRET_KEY", "too short")
+    with pytest.raises(ValueError):
+        open_encrypted(path)
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    import tempfile, pathlib
+    security.SECRET_KEY = "k" * 32
+    test_encrypted_csv_loads_like_the_plaintext(pathlib.Path(tempfile.mkdtemp()), purchases_frame)
+    test_written_parquet_is_readable_with_random_access(pathlib.Path(tempfile.mkdtemp()), purchases_frame)
@@ -0,0 +1,32 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+from src.evaluation import evaluate_recommenders, parameter_grid, summarize_evaluation
+
+def test_parameter_grid_skips_unsupported_combinations():
+    grid = list(parameter_grid({"engine": ["surprise", "sparse"], "similarity": ["msd", "cosine"],
+                                "user_based": [False]}))
+    assert {"engine": "sparse", "similarity": "msd", "user_based": False} not in grid
+    assert len(grid) == 3
+
+def test_evaluate_recommenders_per_fold_table(make_purchases):
+    grid = {"engine": ["surprise", "sparse"], "k": [5], "similarity": ["cosine"], "user_based": [False]}
+    results = evaluate_recommenders(make_purchases(200, 3, customers=25), grid, n_splits=3, max_workers=2)
+
+    assert len(results) == 2 * 3
+    assert sorted(results["fold"].unique()) == [0, 1, 2]
+    for column in ["rmse", "precision_at_n", "recall_at_n", "fit_seconds", "test_seconds"]:
+        assert results[column].notna().all()
+    assert results["precision_at_n"].between(0, 1).all()
+
+    summary = summarize_evaluation(results)
+    assert len(summary) == 2
+    assert summary["rmse"].is_monotonic_increasing
+
+    print(summary)
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    test_parameter_grid_skips_unsupported_combinations()
+    test_evaluate_recommenders_per_fold_table(purchases_frame)
@@ -0,0 +1,168 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import asyncio
+import json
+import numpy as np
+import pandas as pd
+from src.clustering import create_customer_clusters
+from src.cooccurrence import ItemCooccurrence
+from src.ingestion import FileTailSource, PurchaseIngestor, SocketSource, validate_events
+from src.recommendations import build_collaborative_filtering_model
+from src.server import AnalyticsServer, AnalyticsService
+
+LIVE = dict(customers=40, products=15, start="2024-08-01", days=30, date_format="%Y-%m-%d")
+
+def _service(df):
+    df = validate_events(df.to_dict("records"))
+    algo = build_collaborative_filtering_model(df)
+    _, assigner = create_customer_clusters(df, return_assigner=True)
+    return AnalyticsService(df, algo, assigner)
+
+def test_record_purchases_matches_rebuild_and_invalidates_only_changed_customers(make_purchases):
+    history = make_purchases(300, 1, **LIVE)
+    service = _service(history)
+    customers = list(service.cooccurrence.customer_ids)
+    service.recommend_batch(customers, top_n=3)
+
+    # C0 buys a product that is new to them, C1 one they already had, C99 is a new customer
+    new_product = next(p for p in service.item_values if p not in set(history.loc[history["CustomerID"] == "C0", "ProductID"]))
+    repeat_product = history.loc[history["CustomerID"] == "C1", "ProductID"].iloc[0]
+    update = pd.DataFrame({"CustomerID": ["C0", "C1", "C99"], "ProductID": [new_product, repeat_product, "P_NEW"],
+                           "Category": ["Books", "Toys", "Toys"], "PurchaseAmount": [10.0, 20.0, 30.0],
+                           "PurchaseDate": ["2024-09-01"] * 3})
+    result = service.record_purchases(validate_events(update.to_dict("records")))
+    assert result == {"purchases": 3, "invalidated": 2}
+    # C99 has totals now, but no trained recommendations
+    assert service.has_customer("C0") and not service.has_customer("C99")
+    assert "C0" not in service._cache and "C99" not in service._cache
+    assert set(service._cache) == set(customers) - {"C0"}
+
+    rebuilt = ItemCooccurrence.from_frame(pd.concat([history, update]))
+    order = rebuilt.item_ids.get_indexer(service.cooccurrence.item_ids)
+    assert (service.cooccurrence.counts.toarray() == rebuilt.counts.toarray()[np.ix_(order, order)]).all()
+    assert service.aggregates.customer_spending["C99"] == 30.0
+    assert service.aggregates.customer_spending["C1"] == pytest.approx(
+        history.loc[history["CustomerID"] == "C1", "PurchaseAmount"].sum() + 20.0)
+    assert service.top_products(n=1, category="Toys")[0]["total_sales"] >= 30.0
+
+    # The product C0 just bought is no longer recommended to them
+    assert new_product not in [item for item, _ in service.recommend_batch(["C0"], top_n=20)[0]]
+
+def test_cooccurrence_updates_do_not_rebuild_the_matrices(make_purchases):
+    history = make_purchases(300, 1, **LIVE)
+    cooccurrence = ItemCooccurrence.from_frame(history, min_merge=200)
+    merged = cooccurrence._counts
+    events = make_purchases(120, 2, customers=60, products=20, start="2024-09-01", days=10)
+
+    seen = [history]
+    for start in range(0, len(events), 3):
+        batch = events.iloc[start:start + 3]
+        cooccurrence.update(batch)
+        seen.append(batch)
+        rebuilt = ItemCooccurrence.from_frame(pd.concat(seen))
+        # Lookups read the pending increments without merging them
+        for product in rebuilt.item_ids[:5]:
+            assert cooccurrence.customer_count(product) == rebuilt.customer_count(product)
+            assert cooccurrence.also_bought(product) == rebuilt.also_bought(product)
+        customers = ["C0", "C45", "C99"]
+        rows, expected_rows = cooccurrence.customer_rows(customers), rebuilt.customer_rows(customers)
+        order = rebuilt.item_ids.get_indexer(cooccurrence.item_ids)
+        bought = cooccurrence.purchased_rows(rows[rows >= 0]).toarray()
+        assert (bought == rebuilt.purchased_rows(expected_rows[expected_rows >= 0]).toarray()[:, order]).all()
+        if start == 0:
+            assert cooccurrence._counts is merged and cooccurrence._pending_size > 0
+
+    assert cooccurrence._counts is not merged  # merged once the pending entries passed the threshold
+    order = rebuilt.item_ids.get_indexer(cooccurrence.item_ids)
+    assert (cooccurrence.counts.toarray() == rebuilt.counts.toarray()[np.ix_(order, order)]).all()
+    assert cooccurrence._pending_size == 0
+
+def test_validate_events_drops_only_bad_events(make_purchases):
+    events = make_purchases(4, 2, **LIVE).to_dict("records")
+    events[1]["PurchaseAmount"] = "not a number"
+    events[2]["PurchaseDate"] = "not a date"
+    valid = validate_events(events + [None, "text"])
+    assert list(valid["CustomerID"]) == [events[0]["CustomerID"], events[3]["CustomerID"]]
+    assert valid["PurchaseAmount"].dtype == float
+
+def test_socket_events_update_the_running_server(make_purchases):
+    history = make_purchases(300, 3, **LIVE)
+    service = _service(history)
+    events = make_purchases(60, 4, **dict(LIVE, customers=60)).to_dict("records")
+    source = SocketSource(port=0)
+    ingestor = PurchaseIngestor(service, source, queue_size=8, batch_size=5, max_wait_ms=5)
+
+    async def scenario():
+        async with AnalyticsServer(service, port=0, ingestor=ingestor) as server:
+            await source.started.wait()
+            _, writer = await asyncio.open_connection("127.0.0.1", source.port)
+            writer.write("".join(json.dumps(event) + "\n" for event in events).encode() + b"{broken\n")
+            await writer.drain()
+            writer.close()
+            while ingestor.meter.total < len(events) + 1:
+                await asyncio.sleep(0.01)
+
+            responses = []
+            for path in ("/metrics", f"/recommend?customer_id={new_customer}"):
+                reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+                writer.write(f"GET {path} HTTP/1.1\r\nConnection: close\r\n\r\n".encode())
+                responses.append(await reader.read())
+                writer.close()
+            return responses
+
+    # A customer first seen in the events: totals, but no trained recommendations
+    new_customer = next(event["CustomerID"] for event in events if event["CustomerID"] not in set(history["CustomerID"]))
+    metrics_response, recommend_response = asyncio.run(scenario())
+    assert recommend_response.startswith(b"HTTP/1.1 404")
+    assert new_customer in service.aggregates.customer_spending.index
+    metrics = json.loads(metrics_response.partition(b"\r\n\r\n")[2])
+    stats = metrics["ingestion"]
+    assert (stats["accepted"], stats["rejected"]) == (len(events), 1)
+    assert stats["events_per_second"] > 0
+    assert stats["queue_depth"] == 0
+
+    expected = pd.concat([history, pd.DataFrame(events)]).groupby("CustomerID")["PurchaseAmount"].sum()
+    assert service.aggregates.customer_spending.sort_index().to_numpy() == pytest.approx(expected.sort_index().to_numpy())
+
+def test_file_tail_reads_appended_rows(tmp_path, make_purchases):
+    path = tmp_path / "live.csv"
+    existing, appended = make_purchases(5, 5, **LIVE), make_purchases(6, 6, **LIVE)
+    existing.to_csv(path, index=False)
+    received = []
+
+    async def emit(event):
+        received.append(event)
+
+    async def scenario():
+        task = asyncio.create_task(FileTailSource(str(path), poll_interval=0.01).run(emit))
+        await asyncio.sleep(0.05)
+        lines = appended.to_csv(index=False, header=False)
+        split = len(lines) - 10
+        with open(path, "a") as f:
+            # The last row is written in two parts; it is only read once complete
+            f.write(lines[:split])
+        await asyncio.sleep(0.05)
+        count_before = len(received)
+        with open(path, "a") as f:
+            f.write(lines[split:])
+        while len(received) < len(appended):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return count_before
+
+    assert asyncio.run(scenario()) == len(appended) - 1
+    # Rows already in the file are skipped
+    assert [event["CustomerID"] for event in received] == list(appended["CustomerID"])
+    assert received[-1]["PurchaseAmount"] == str(appended["PurchaseAmount"].iloc[-1])
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    import pathlib
+    import tempfile
+    test_record_purchases_matches_rebuild_and_invalidates_only_changed_customers(purchases_frame)
+    test_cooccurrence_updates_do_not_rebuild_the_matrices(purchases_frame)
+    test_validate_events_drops_only_bad_events(purchases_frame)
+    test_socket_events_update_the_running_server(purchases_frame)
+    test_file_tail_reads_appended_rows(pathlib.Path(tempfile.mkdtemp()), purchases_frame)
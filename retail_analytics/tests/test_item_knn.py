@@ -0,0 +1,50 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+from src.item_knn import ItemKNN, compare_with_knn_basic
+from src.recommendations import build_collaborative_filtering_model, recommend_for_customer
+
+@pytest.mark.parametrize("similarity", ["cosine", "pearson"])
+def test_blocked_fit_matches_single_block(similarity, make_purchases):
+    df = make_purchases(300, 1, customers=40, products=15)
+    blocked = ItemKNN(k=4, similarity=similarity, max_block_cells=30).fit(df)
+    single = ItemKNN(k=4, similarity=similarity).fit(df)
+
+    assert (blocked.neighbours != single.neighbours).nnz == 0
+    assert blocked.neighbours.getnnz(axis=1).max() <= 4
+
+def test_predict_contract_and_batch_agree(make_purchases):
+    df = make_purchases(300, 1, customers=40, products=15)
+    algo = ItemKNN(k=5, rating_scale=(0, 5000)).fit(df)
+    customers = ["C0", "C1", "unknown"]
+    items = ["P0", "P3", "P14", "unknown"]
+
+    batch = algo.estimate_batch(customers, items)
+    for row, customer_id in enumerate(customers):
+        for col, item_id in enumerate(items):
+            assert algo.predict(uid=customer_id, iid=item_id).est == pytest.approx(batch[row, col])
+    assert batch[2, 0] == pytest.approx(df["PurchaseAmount"].mean())
+
+def test_sparse_engine_in_pipeline(make_purchases):
+    df = make_purchases(300, 1, customers=40, products=15)
+    algo = build_collaborative_filtering_model(df, engine="sparse")
+    recommendations = recommend_for_customer(algo, "C0", df, top_n=3)
+    bought = set(df.loc[df["CustomerID"] == "C0", "ProductID"])
+    assert len(recommendations) == 3
+    assert not bought & {item for item, _ in recommendations}
+
+def test_compare_with_knn_basic(make_purchases):
+    comparison = compare_with_knn_basic(make_purchases(300, 1, customers=40, products=15), k=5)
+    for engine in ("ItemKNN", "KNNBasic"):
+        assert comparison[engine]["fit_seconds"] >= 0
+        assert comparison[engine]["peak_memory_mb"] > 0
+
+    print(comparison)
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    test_blocked_fit_matches_single_block("cosine", purchases_frame)
+    test_predict_contract_and_batch_agree(purchases_frame)
+    test_sparse_engine_in_pipeline(purchases_frame)
+    test_compare_with_knn_basic(purchases_frame)
@@ -0,0 +1,125 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import io
+import json
+import logging
+import re
+import threading
+import pytest
+import numpy as np
+from src import logging_utils
+from src.logging_utils import (configure_structured_logging, flush_logs, get_logger, log_structured,
+                               new_correlation_id)
+
+LINE = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} (\S+) \[(\w+)\] (\{.*\})$")
+
+def _capture(log_calls):
+    logger = get_logger("tests.logging")
+    stream = io.StringIO()
+    handler = logging_utils._listener.handlers[0]
+    previous = handler.setStream(stream)
+    try:
+        log_calls(logger)
+        flush_logs()
+    finally:
+        handler.setStream(previous)
+        configure_structured_logging()
+    return stream.getvalue()
+
+def test_output_format_and_correlation_id():
+    run_id = new_correlation_id()
+    output = _capture(lambda logger: [
+        log_structured(logger, "info", "Top products", top_products={"P1": 10.5}),
+        log_structured(logger, "warn", "Slow stage", seconds=3),
+    ])
+
+    # Same layout as before: formatted line, then a blank line
+    entries = output.split("\n\n\n")
+    assert output.endswith("\n\n\n") and len(entries) == 3
+    records = []
+    for entry in entries[:2]:
+        name, level, payload = LINE.match(entry).groups()
+        assert name == "tests.logging"
+        records.append((level, json.loads(payload)))
+    assert [level for level, _ in records] == ["INFO", "WARNING"]
+    assert list(records[0][1]) == ["timestamp", "correlation_id", "message", "context"]
+    assert records[0][1]["context"] == {"top_products": {"P1": 10.5}}
+    assert {record["correlation_id"] for _, record in records} == {run_id}
+
+def test_disabled_levels_and_sampling_skip_serialization():
+    class Unserializable:
+        pass
+
+    def calls(logger):
+        configure_structured_logging(sample_rates={"Noisy": 0.0})
+        log_structured(logger, "debug", "Hidden", value=Unserializable())
+        log_structured(logger, "info", "Noisy", value=Unserializable())
+        log_structured(logger, "info", "Kept")
+
+    output = _capture(calls)
+    assert "Hidden" not in output and "Noisy" not in output
+    assert '"message": "Kept"' in output
+
+def test_large_payloads_are_capped():
+    def calls(logger):
+        configure_structured_logging(max_context_chars=20)
+        log_structured(logger, "info", "Big", summary=list(range(100)), small=1)
+
+    payload = json.loads(LINE.match(_capture(calls).strip()).group(3))
+    assert payload["context"]["small"] == 1
+    assert payload["context"]["summary"].endswith("...") and len(payload["context"]["summary"]) == 23
+
+def test_context_is_captured_at_the_call():
+    class Unserializable:
+        pass
+
+    circular = []
+    circular.append(circular)
+
+    def calls(logger):
+        counts = {"P1": 1}
+        rows = [1, 2]
+        log_structured(logger, "info", "Snapshot", counts=counts, rows=rows, total=np.int64(3),
+                       circular=circular, other=Unserializable())
+        # Changed before the listener thread formats the record
+        counts["P1"] = 99
+        rows.append(3)
+
+    payload = json.loads(LINE.match(_capture(calls).strip()).group(3))
+    context = payload["context"]
+    assert context["counts"] == {"P1": 1} and context["rows"] == [1, 2]
+    assert context["total"] == "3"
+    assert context["circular"].startswith("<unserializable list")
+    assert "Unserializable object" in context["other"]
+
+def test_payloads_are_serialized_on_the_listener_thread():
+    threads = []
+
+    class Item:
+        def __str__(self):
+            threads.append(threading.current_thread())
+            return "item"
+
+    def calls(logger):
+        configure_structured_logging(max_context_chars=20)
+        # pytest's capture handler on the root logger would format on this thread
+        logger.propagate = False
+        try:
+            log_structured(logger, "info", "Items", items=[Item() for _ in range(1000)])
+        finally:
+            logger.propagate = True
+        assert threads == []
+
+    payload = json.loads(LINE.match(_capture(calls).strip()).group(3))
+    assert payload["context"]["items"].startswith('["item", "item"')
+    # Encoding stopped at the cap instead of converting every item
+    assert 0 < len(threads) < 10
+    assert threading.main_thread() not in threads
+
+if __name__ == "__main__":
+    test_output_format_and_correlation_id()
+    test_disabled_levels_and_sampling_skip_serialization()
+    test_large_payloads_are_capped()
+    test_context_is_captured_at_the_call()
+    test_payloads_are_serialized_on_the_listener_thread()
@@ -0,0 +1,126 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import subprocess
+import threading
+from concurrent.futures import Future
+from datetime import date
+import pytest
+import pandas as pd
+from src.data_generation import main as generate_data
+
+MAIN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src/main.py'))
+HEAVY_MODULES = ["matplotlib", "pdfkit", "seaborn", "sklearn", "surprise"]
+
+def _imported_heavy_modules(command, cwd):
+    # Run the CLI as a script in a fresh interpreter and list the heavy modules it ended up importing
+    snippet = (
+        "import runpy, sys\n"
+        f"sys.argv = [{MAIN_SCRIPT!r}] + {command.split()!r}\n"
+        f"sys.path.insert(0, {os.path.dirname(MAIN_SCRIPT)!r})\n"
+        f"runpy.run_path({MAIN_SCRIPT!r}, run_name='__main__')\n"
+        f"print(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    completed = subprocess.run([sys.executable, "-c", snippet], cwd=cwd, capture_output=True, text=True, check=True)
+    return completed.stdout.strip().splitlines()
+
+def test_subcommands_import_only_what_they_use(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Dated inside the pipeline's filter window
+    generate_data(num_customers=50, num_products=20, num_purchases=1000, seed=1, end_date=date(2024, 12, 31))
+
+    load_output = _imported_heavy_modules("load", tmp_path)
+    assert load_output[-1] == "[]"
+    assert load_output[0].endswith("purchases loaded")
+    assert _imported_heavy_modules("recommend", tmp_path)[-1] == "['surprise']"
+    assert "sklearn" in _imported_heavy_modules("cluster", tmp_path)[-1]
+
+def test_streaming_caps_training_interactions(tmp_path, monkeypatch):
+    # main.py imports its stage modules the way the script sees them
+    monkeypatch.syspath_prepend(os.path.dirname(MAIN_SCRIPT))
+    from src.main import stream_filtered_purchases
+    generate_data(num_customers=50, num_products=20, num_purchases=1000, seed=1,
+                  end_date=date(2024, 12, 31), output_dir=str(tmp_path))
+    purchases_file = str(tmp_path / "purchases.csv")
+
+    full, aggregates = stream_filtered_purchases(purchases_file, chunksize=100)
+    sample, sampled_aggregates = stream_filtered_purchases(purchases_file, chunksize=100, max_interactions=150)
+    assert len(full) == 1000 and len(sample) == 150
+    # The sample is drawn from the purchases; the totals still cover every purchase
+    assert len(sample.merge(full.drop_duplicates(), on=list(sample.columns))) == 150
+    assert sampled_aggregates.row_count == aggregates.row_count == 1000
+
+    # A file with no rows gives empty interactions instead of failing
+    pd.read_csv(purchases_file, nrows=0).to_csv(tmp_path / "empty.csv", index=False)
+    empty, empty_aggregates = stream_filtered_purchases(str(tmp_path / "empty.csv"), chunksize=100)
+    assert len(empty) == 0 and list(empty.columns) == ["CustomerID", "ProductID", "PurchaseAmount"]
+    assert empty_aggregates.row_count == 0
+
+def test_report_waits_for_charts_before_pdf_conversion(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(os.path.dirname(MAIN_SCRIPT))
+    monkeypatch.chdir(tmp_path)
+    import src.reporting
+    from src.main import main, report_stage
+    chart_path = str(tmp_path / "top_products.png")
+    seen = []
+
+    class RecordingConverter:
+        # Records whether the chart was written by the time each PDF is queued
+        def __init__(self, timeout):
+            pass
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            return False
+        def submit(self, html_file_path, pdf_file_path):
+            seen.append(os.path.exists(chart_path))
+
+    def write_chart():
+        open(chart_path, "wb").close()
+        chart.set_result(chart_path)
+
+    monkeypatch.setattr(src.reporting, "PdfConverter", RecordingConverter)
+    chart = Future()
+    threading.Timer(0.2, write_chart).start()
+    analysis = {"top_products": pd.Series({"P1": 10.0}), "category_sales": pd.Series({"Books": 10.0}),
+                "avg_spend_per_customer": 10.0}
+    clusters = pd.DataFrame({"CustomerID": ["C1"], "TotalSpending": [10.0], "PurchaseCount": [1],
+                             "ClusterLabel": ["Low Spenders"]})
+    paths = report_stage(clusters, analysis, ("C1", [("P2", 5.0)], "because"), {"top_products": chart}, pdf=True)
+    assert seen == [True]
+    assert "top_products.png" in open(paths["summary"]).read()
+
+    # Streamed and incremental runs do not keep the categories a per-category report needs
+    with pytest.raises(SystemExit) as exit_info:
+        main(["--streaming", "report", "--by-category"])
+    assert exit_info.value.code == 2
+
+def test_encrypted_purchases_are_read_instead_of_generated(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(os.path.dirname(MAIN_SCRIPT))
+    monkeypatch.chdir(tmp_path)
+    import src.security
+    from src.encrypted_files import encrypt_file
+    from src.main import main, run_pipeline
+    monkeypatch.setattr(src.security, "SECRET_KEY", "k" * 32)
+    generate_data(num_customers=50, num_products=20, num_purchases=300, seed=1, end_date=date(2024, 12, 31))
+    expected = run_pipeline(command="load")[1]["load"]["df"]
+    encrypt_file("data/purchases.csv")
+    os.remove("data/purchases.csv")
+
+    # Read from the encrypted copy; no synthetic purchases are generated in its place
+    loaded = run_pipeline(command="load")[1]["load"]["df"]
+    pd.testing.assert_frame_equal(loaded, expected)
+    assert not os.path.exists("data/purchases.csv")
+    os.rename("data/purchases.csv.enc", "data/archive.csv.enc")
+    pd.testing.assert_frame_equal(run_pipeline(command="load", purchases_file="data/archive.csv")[1]["load"]["df"],
+                                  expected)
+
+    with pytest.raises(SystemExit):
+        main(["--purchases", "data/missing.csv", "load"])
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_subcommands_import_only_what_they_use(pathlib.Path(tempfile.mkdtemp()), pytest.MonkeyPatch())
+    test_streaming_caps_training_interactions(pathlib.Path(tempfile.mkdtemp()), pytest.MonkeyPatch())
+    test_report_waits_for_charts_before_pdf_conversion(pathlib.Path(tempfile.mkdtemp()), pytest.MonkeyPatch())
+    test_encrypted_purchases_are_read_instead_of_generated(pathlib.Path(tempfile.mkdtemp()), pytest.MonkeyPatch())
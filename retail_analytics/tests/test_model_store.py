@@ -0,0 +1,81 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import threading
+import pytest
+import numpy as np
+import pandas as pd
+from src.clustering import create_customer_clusters
+from src.model_store import ModelStore, content_key
+from src.recommendations import build_collaborative_filtering_model
+
+def test_save_and_load_memory_maps_large_arrays(tmp_path):
+    store = ModelStore(str(tmp_path))
+    model = {"weights": np.arange(100_000, dtype=float), "bias": np.ones(3), "name": "toy"}
+    store.save("toy", "abc", model, meta={"rmse": 1.5})
+
+    loaded, meta = store.load("toy", "abc")
+    assert meta == {"rmse": 1.5}
+    np.testing.assert_array_equal(loaded["weights"], model["weights"])
+    np.testing.assert_array_equal(loaded["bias"], model["bias"])
+    base = loaded["weights"]
+    while not isinstance(base, np.memmap) and getattr(base, "base", None) is not None:
+        base = base.base
+    assert isinstance(base, np.memmap)
+
+def test_saving_a_stored_key_keeps_the_entry_readable(tmp_path):
+    store = ModelStore(str(tmp_path))
+    store.save("toy", "abc", {"weights": np.arange(100_000, dtype=float)})
+    errors = []
+
+    def save_again():
+        try:
+            store.save("toy", "abc", {"weights": np.arange(100_000, dtype=float)})
+        except Exception as e:
+            errors.append(e)
+
+    writers = [threading.Thread(target=save_again) for _ in range(8)]
+    for writer in writers:
+        writer.start()
+    # The entry never disappears while the writers run
+    while any(writer.is_alive() for writer in writers):
+        assert store.contains("toy", "abc")
+        assert store.load("toy", "abc")[0]["weights"][-1] == 99_999
+    assert errors == []
+    assert os.listdir(tmp_path / "toy") == ["abc"]
+
+    # Writers that race on a new key leave one complete entry and no temporary directories
+    racers = [threading.Thread(target=store.save, args=("toy", "new", {"n": i})) for i in range(8)]
+    for racer in racers:
+        racer.start()
+    for racer in racers:
+        racer.join()
+    assert sorted(os.listdir(tmp_path / "toy")) == ["abc", "new"]
+    assert store.load("toy", "new")[0]["n"] in range(8)
+
+def test_content_key_tracks_data_and_params(make_purchases):
+    df = make_purchases(120, 2, customers=30, products=12, categories=["Books", "Toys"])
+    key = content_key(df, {"k": 40})
+    assert key == content_key(df.copy(), {"k": 40})
+    assert key != content_key(df, {"k": 20})
+    changed = df.copy()
+    changed.loc[0, "PurchaseAmount"] += 1
+    assert key != content_key(changed, {"k": 40})
+
+def test_models_are_reused_from_store(tmp_path, make_purchases):
+    df = make_purchases(120, 2, customers=30, products=12, categories=["Books", "Toys"])
+    store = ModelStore(str(tmp_path))
+
+    fitted = create_customer_clusters(df, n_clusters=3, model_store=store)
+    reused = create_customer_clusters(df, n_clusters=3, model_store=store)
+    pd.testing.assert_frame_equal(fitted, reused)
+    assert len(os.listdir(tmp_path / "clustering")) == 1
+
+    algo = build_collaborative_filtering_model(df, model_store=store)
+    loaded = build_collaborative_filtering_model(df, model_store=store)
+    assert loaded is not algo
+    assert loaded.predict("C1", "P2").est == pytest.approx(algo.predict("C1", "P2").est)
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    test_content_key_tracks_data_and_params(purchases_frame)
@@ -0,0 +1,130 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import importlib
+import threading
+import pytest
+from src.model_store import ModelStore
+from src.pipeline_dag import PipelineDAG, code_digest, function_digest
+from src.tracing import PipelineTracer
+
+def build_dag(store, calls, template="v1", tracer=None):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def load():
+        calls.append("load")
+        return list(range(10))
+
+    def total(rows):
+        calls.append("total")
+        barrier.wait()  # only passes if "count" runs at the same time
+        return sum(rows)
+
+    def count(rows):
+        calls.append("count")
+        barrier.wait()
+        return len(rows)
+
+    def report(total, count, template):
+        calls.append("report")
+        return f"{template}: {total}/{count}"
+
+    dag = PipelineDAG(store=store, tracer=tracer)
+    dag.add_stage("load", load, inputs={"file": "purchases.csv"}, count=len)
+    dag.add_stage("total", total, deps=["load"])
+    dag.add_stage("count", count, deps=["load"])
+    dag.add_stage("report", report, deps=["total", "count"], params={"template": template})
+    return dag
+
+def test_independent_stages_run_concurrently():
+    calls = []
+    tracer = PipelineTracer()
+    outputs = build_dag(None, calls, tracer=tracer).run()
+
+    assert outputs["report"] == "v1: 45/10"
+    assert calls[0] == "load" and calls[-1] == "report"
+    assert [span.stage for span in tracer.spans][0] == "load"
+    assert {span.rows_in for span in tracer.spans if span.stage == "total"} == {10}
+
+def test_memoized_rerun_skips_unneeded_stages(tmp_path):
+    store = ModelStore(str(tmp_path))
+    build_dag(store, []).run()
+
+    calls = []
+    outputs = build_dag(store, calls).run()
+    assert calls == []
+    assert outputs["report"] == "v1: 45/10"
+    assert "load" not in outputs
+
+    # Only the report's own params changed: nothing upstream is recomputed
+    calls = []
+    outputs = build_dag(store, calls, template="v2").run()
+    assert calls == ["report"]
+    assert outputs["report"] == "v2: 45/10"
+
+def test_changed_inputs_change_every_downstream_key():
+    dag = build_dag(None, [])
+    keys = dag.keys()
+    dag.stages["load"].inputs = {"file": "other.csv"}
+    changed = dag.keys()
+    assert all(keys[name] != changed[name] for name in keys)
+
+def test_edited_stage_function_changes_its_key():
+    dag = build_dag(None, [])
+    keys = dag.keys()
+    assert build_dag(None, []).keys() == keys  # same code in new closures
+
+    def total(rows):
+        return sum(rows) + 1
+
+    dag.stages["total"].fn = total
+    changed = dag.keys()
+    assert changed["total"] != keys["total"] and changed["report"] != keys["report"]
+    assert changed["count"] == keys["count"]
+
+    dag.stages["count"].version = 2
+    assert dag.keys()["count"] != keys["count"]
+    assert function_digest(lambda x, y=1: x in {"a", "b"}) != function_digest(lambda x, y=2: x in {"a", "b"})
+    assert function_digest(len) is None
+
+def test_edited_module_a_stage_imports_changes_its_key(tmp_path, monkeypatch):
+    # stages.py imports helpers lazily, like the stages in main.py; helpers imports rates
+    (tmp_path / "rates.py").write_text("RATE = 2\n")
+    (tmp_path / "helpers.py").write_text("from rates import RATE\n\ndef scale(rows):\n    return [r * RATE for r in rows]\n")
+    (tmp_path / "other.py").write_text("X = 1\n")
+    (tmp_path / "stages.py").write_text(
+        "def scaled(rows):\n    from helpers import scale\n    return _total(scale(rows))\n\n"
+        "def _total(rows):\n    return sum(rows)\n\n"
+        "def unrelated(rows):\n    from other import X\n    return X\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    stages = importlib.import_module("stages")
+
+    def keys():
+        dag = PipelineDAG()
+        dag.add_stage("scaled", stages.scaled)
+        dag.add_stage("unrelated", stages.unrelated)
+        return dag.keys()
+
+    before = keys()
+    for path, text in [("rates.py", "RATE = 3\n"), ("stages.py", (tmp_path / "stages.py").read_text()
+                                                       .replace("return sum(rows)", "return sum(rows) + 1"))]:
+        (tmp_path / path).write_text(text)
+        stages = importlib.reload(stages)
+        after = keys()
+        assert after["scaled"] != before["scaled"]
+        assert after["unrelated"] == before["unrelated"]
+        before = after
+    assert code_digest(len) is None
+
+def test_unknown_dependency_is_rejected():
+    dag = PipelineDAG()
+    with pytest.raises(ValueError):
+        dag.add_stage("analyze", len, deps=["load"])
+    with pytest.raises(ValueError):
+        dag.add_stage("load", len, executor="gpu")
+
+if __name__ == "__main__":
+    test_independent_stages_run_concurrently()
+    test_changed_inputs_change_every_downstream_key()
+    test_edited_stage_function_changes_its_key()
+    test_unknown_dependency_is_rejected()
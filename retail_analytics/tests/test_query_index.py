@@ -0,0 +1,62 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import numpy as np
+import pandas as pd
+from src.data_loading import filter_data
+from src.filters import filter_by_category, filter_by_date_range
+from src.query_index import PurchaseIndex
+
+@pytest.mark.parametrize("presorted", [False, True])
+def test_index_matches_mask_filtering(presorted, make_purchases):
+    df = make_purchases()
+    if presorted:
+        df = df.sort_values("PurchaseDate", kind="stable").reset_index(drop=True)
+    index = PurchaseIndex(df)
+
+    queries = [
+        {},
+        {"start_date": "2024-03-01"},
+        {"end_date": "2024-06-30"},
+        {"start_date": "2024-03-01", "end_date": "2024-06-30", "category": "Books"},
+        {"category": "Toys!"},
+        {"category": "Garden"},
+        {"start_date": "2025-01-01"},
+    ]
+    for query in queries:
+        expected = filter_data(df, **query)
+        pd.testing.assert_frame_equal(filter_data(df, index=index, **query), expected)
+
+    pd.testing.assert_frame_equal(filter_by_category(df, "Electronics", index=index),
+                                  filter_by_category(df, "Electronics"))
+    pd.testing.assert_frame_equal(filter_by_date_range(df, "2024-02-01", "2024-02-29", index=index),
+                                  filter_by_date_range(df, "2024-02-01", "2024-02-29"))
+
+def test_filtered_frames_are_independent_of_the_input(make_purchases):
+    df = make_purchases().sort_values("PurchaseDate", kind="stable").reset_index(drop=True)
+    original = df.copy()
+    index = PurchaseIndex(df)
+    for filtered in (filter_data(df), filter_data(df, start_date="2024-03-01", index=index),
+                     filter_data(df, start_date="2024-03-01")):
+        filtered["PurchaseAmount"] = 0.0
+    pd.testing.assert_frame_equal(df, original)
+
+def test_selections_compose(make_purchases):
+    df = make_purchases()
+    index = PurchaseIndex(df)
+
+    either = index.category("Books") | index.category("Toys")
+    spring = index.date_range("2024-03-01", "2024-05-31")
+    selection = either & spring
+
+    expected = df[df["Category"].isin(["Books", "Toys"])
+                  & df["PurchaseDate"].between("2024-03-01", "2024-05-31")]
+    assert len(selection) == len(expected)
+    np.testing.assert_array_equal(selection.positions, np.flatnonzero(df.index.isin(expected.index)))
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    test_index_matches_mask_filtering(False, purchases_frame)
+    test_filtered_frames_are_independent_of_the_input(purchases_frame)
+    test_selections_compose(purchases_frame)
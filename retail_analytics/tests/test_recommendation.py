@@ -2,8 +2,10 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
 import pytest
+import numpy as np
 import pandas as pd
-from src.recommendations import build_collaborative_filtering_model, recommend_for_customer
+from src.recommendations import (build_collaborative_filtering_model, recommend_for_customer, recommend_for_all_customers,
+                                 top_recommendations)
 
 def test_recommend_for_customer():
     data = {
@@ -20,5 +22,48 @@ def test_recommend_for_customer():
 
     print(recommendations)
 
+def test_recommend_for_all_customers_matches_single():
+    data = {
+        "CustomerID": ["C1", "C2", "C3", "C1", "C2", "C3", "C4", "C4"],
+        "ProductID": ["P1", "P2", "P3", "P4", "P1", "P4", "P2", "P5"],
+        "Category": ["Books", "Electronics", "Toys", "Books", "Books", "Books", "Electronics", "Home"],
+        "PurchaseAmount": [10.5, 99.99, 5.0, 20.0, 12.0, 18.0, 80.0, 45.0],
+        "PurchaseDate": pd.to_datetime(["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04",
+                                        "2025-01-05", "2025-01-06", "2025-01-07", "2025-01-08"])
+    }
+    df = pd.DataFrame(data)
+    algo = build_collaborative_filtering_model(df)
+    batch = recommend_for_all_customers(algo, df, top_n=2, batch_size=3)
+
+    assert set(batch) == set(df["CustomerID"])
+    for customer_id, recommendations in batch.items():
+        single = recommend_for_customer(algo, customer_id, df, top_n=2)
+        assert [item for item, _ in recommendations] == [item for item, _ in single]
+        assert [est for _, est in recommendations] == pytest.approx([est for _, est in single])
+
+    print(batch)
+
+def test_tied_scores_keep_product_order():
+    scores = np.array([[1.0, 5.0, 5.0, 5.0, 5.0, 5.0, 0.0, 5.0, 5.0, 5.0],
+                       [-np.inf, 2.0, 2.0, -np.inf, 2.0, 3.0, 2.0, 2.0, 2.0, 2.0]])
+    items = np.array([f"P{i}" for i in range(10)])
+    assert top_recommendations(scores, items, top_n=3) == [
+        [("P1", 5.0), ("P2", 5.0), ("P3", 5.0)],
+        [("P5", 3.0), ("P1", 2.0), ("P2", 2.0)],
+    ]
+
+    # Every purchase has the same amount, so every estimate ties
+    df = pd.DataFrame({
+        "CustomerID": [f"C{i % 7}" for i in range(60)],
+        "ProductID": [f"P{(i * 7) % 30}" for i in range(60)],
+        "PurchaseAmount": 10.0,
+    })
+    algo = build_collaborative_filtering_model(df)
+    batch = recommend_for_all_customers(algo, df, top_n=4)
+    for customer_id, recommendations in batch.items():
+        assert recommendations == recommend_for_customer(algo, customer_id, df, top_n=4)
+
 if __name__ == "__main__":
     test_recommend_for_customer()
+    test_recommend_for_all_customers_matches_single()
+    test_tied_scores_keep_product_order()
@@ -0,0 +1,102 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import re
+import threading
+import pytest
+import pandas as pd
+import src.data_analysis as data_analysis
+from src.reporting import PdfConverter, category_report_jobs, render_reports, write_html_report
+
+ROWS = [
+    ("C1", "P1", "Electronics", 10.0, "2024-07-01"), ("C2", "P2", "Books", 20.0, "2024-07-01"),
+    ("C1", "P2", "Books", 5.0, "2024-07-02"), ("C3", "P3", "Toys", 7.5, "2024-07-03"),
+    ("C4", "P1", "Electronics", 12.0, "2024-07-04"),
+]
+
+def _clusters(n=4):
+    return pd.DataFrame({
+        "CustomerID": [f"C{i + 1}" for i in range(n)],
+        "TotalSpending": [float(i) for i in range(n)],
+        "PurchaseCount": [1] * n,
+        "ClusterLabel": ["Low Spenders" if i % 2 else "High Spenders" for i in range(n)],
+    })
+
+def _analysis():
+    return {
+        "top_products": pd.Series({"P1": 22.0, "P2": 25.0}),
+        "category_sales": pd.Series({"Books": 25.0}),
+        "avg_spend_per_customer": 13.6,
+    }
+
+def test_customer_tables_are_streamed_in_chunks(tmp_path):
+    path = str(tmp_path / "report.html")
+    write_html_report(path, _analysis(), _clusters(1001), "<p>none</p>", customer_tables=True, chunk_rows=64)
+
+    html = open(path).read()
+    assert os.listdir(tmp_path) == ["report.html"]
+    assert len(re.findall(r"<tr><td>C\d+</td><td>\$", html)) == 1001
+    assert "<li><strong>High Spenders</strong>: 501 customers</li>" in html
+    assert html.index("C1001") < html.index("C1</td>")  # biggest spenders first
+    assert "top_products.png" in html
+
+def test_category_reports_render_concurrently(tmp_path, make_purchases):
+    jobs = category_report_jobs(make_purchases(rows=ROWS), _clusters(), output_dir=str(tmp_path))
+    assert sorted(jobs) == ["Books", "Electronics", "Toys"]
+    assert list(jobs["Books"]["cluster_df"]["CustomerID"]) == ["C1", "C2"]
+
+    paths = render_reports(jobs, max_workers=3)
+    assert all(os.path.exists(path) for path in paths.values())
+    books = open(paths["Books"]).read()
+    assert "Retail Analytics Summary: Books" in books and "top_products.png" not in books
+
+def test_categories_are_analyzed_in_the_pool_into_separate_directories(tmp_path, make_purchases, monkeypatch):
+    rows = [("C1", "P1", "Home & Garden", 10.0, "2024-07-01"), ("C2", "P2", "Home/Garden", 20.0, "2024-07-01")]
+    analyzed_on = []
+    analyze_data = data_analysis.analyze_data
+
+    def recording_analyze_data(df):
+        analyzed_on.append(threading.current_thread())
+        return analyze_data(df)
+
+    monkeypatch.setattr(data_analysis, "analyze_data", recording_analyze_data)
+    jobs = category_report_jobs(make_purchases(rows=rows), _clusters(), output_dir=str(tmp_path))
+    assert analyzed_on == []
+
+    paths = render_reports(jobs, max_workers=2)
+    assert len(analyzed_on) == 2 and threading.main_thread() not in analyzed_on
+    # Both names sanitize to Home_Garden; each report keeps its own directory
+    assert len({os.path.dirname(path) for path in paths.values()}) == 2
+    assert all(os.path.basename(os.path.dirname(path)).startswith("Home_Garden-") for path in paths.values())
+    assert "Summary: Home/Garden" in open(paths["Home/Garden"]).read()
+    assert "Summary: Home &amp; Garden" in open(paths["Home & Garden"]).read()
+
+def _fake_wkhtmltopdf(tmp_path, seconds):
+    # Stands in for wkhtmltopdf: copies the input to the output, after a delay
+    script = tmp_path / f"wkhtmltopdf-{seconds}"
+    script.write_text(f"#!{sys.executable}\nimport shutil, sys, time\ntime.sleep({seconds})\n"
+                      "shutil.copyfile(sys.argv[-2], sys.argv[-1])\n")
+    script.chmod(0o755)
+    return str(script)
+
+def test_pdf_conversions_are_bounded_and_time_out(tmp_path):
+    html = str(tmp_path / "report.html")
+    write_html_report(html, _analysis(), _clusters(), "")
+
+    with PdfConverter(max_workers=2, timeout=10, wkhtmltopdf=_fake_wkhtmltopdf(tmp_path, 0)) as converter:
+        futures = [converter.submit(html, str(tmp_path / f"report-{i}.pdf")) for i in range(4)]
+    assert [future.result() for future in futures] == [str(tmp_path / f"report-{i}.pdf") for i in range(4)]
+    assert "--quiet" in converter.command(html, "out.pdf")
+
+    with PdfConverter(timeout=0.5, wkhtmltopdf=_fake_wkhtmltopdf(tmp_path, 5)) as converter:
+        assert converter.submit(html, str(tmp_path / "slow.pdf")).result() is None
+    assert not os.path.exists(tmp_path / "slow.pdf")
+
+    with PdfConverter(wkhtmltopdf=str(tmp_path / "missing")) as converter:
+        assert converter.submit(html, str(tmp_path / "none.pdf")).result() is None
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    import tempfile, pathlib
+    test_customer_tables_are_streamed_in_chunks(pathlib.Path(tempfile.mkdtemp()))
+    test_category_reports_render_concurrently(pathlib.Path(tempfile.mkdtemp()), purchases_frame)
@@ -0,0 +1,88 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import numpy as np
+import pandas as pd
+from src.aggregates import PurchaseAggregates
+from src.data_analysis import analyze_data
+from src.data_loading import filter_data
+from src.columnar_cache import cache_path
+from src.revenue_cube import RevenueCube, load_or_build_cube
+
+@pytest.mark.parametrize("query", [
+    {},
+    {"start_date": "2024-07-01", "end_date": "2024-09-30"},
+    {"start_date": "2024-03-15", "category": "Toys"},
+    {"end_date": "2024-02-01", "category": "Books!"},
+    {"category": "Garden"},
+])
+def test_query_matches_filtered_aggregates(query, make_purchases):
+    df = make_purchases(3000, 5, customers=400, products=30, product_format="P{:02d}")
+    cube_slice = RevenueCube.from_frame(df).query(**query)
+    filtered = filter_data(df, **query)
+    aggregates = PurchaseAggregates.from_frame(filtered)
+
+    pd.testing.assert_series_equal(cube_slice.product_sales, aggregates.product_sales, check_exact=False)
+    pd.testing.assert_series_equal(cube_slice.category_sales, aggregates.category_sales, check_exact=False)
+    assert cube_slice.purchase_count == len(filtered)
+    assert cube_slice.customer_count == pytest.approx(filtered["CustomerID"].nunique(), rel=0.05)
+
+def test_times_of_day_fall_back_to_scanning(make_purchases):
+    df = make_purchases(3000, 5, customers=400, products=30, product_format="P{:02d}")
+    df["PurchaseDate"] += pd.Timedelta(hours=12)
+    cube = RevenueCube.from_frame(df)
+
+    assert cube.query(end_date="2024-06-30") is None
+    assert cube.query(start_date="2024-06-01", end_date="2024-06-30 23:59:59.999999999").purchase_count == \
+        len(filter_data(df, start_date="2024-06-01", end_date="2024-06-30 23:59:59.999999999"))
+
+def test_cube_persisted_and_used_by_analyze_data(tmp_path, monkeypatch, make_purchases):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    df = make_purchases(3000, 5, customers=400, products=30, product_format="P{:02d}")
+    df.to_csv("data/purchases.csv", index=False)
+
+    cube = load_or_build_cube("data/purchases.csv", df, cache_dir="data/cache")
+    assert os.path.exists(cache_path("data/purchases.csv", "data/cache", ".cube.npz"))
+    reloaded = load_or_build_cube("data/purchases.csv", df.iloc[:0], cache_dir="data/cache")
+    np.testing.assert_array_equal(reloaded.registers, cube.registers)
+
+    # A same-named file elsewhere gets its own cube instead of overwriting this one
+    os.makedirs("archive")
+    other = make_purchases(500, 6, product_format="P{:02d}")
+    other.to_csv("archive/purchases.csv", index=False)
+    assert load_or_build_cube("archive/purchases.csv", other, cache_dir="data/cache").query().purchase_count == 500
+    assert load_or_build_cube("data/purchases.csv", df.iloc[:0], cache_dir="data/cache").query().purchase_count == 3000
+
+    query = {"start_date": "2024-07-01", "end_date": "2024-12-31", "category": "Electronics"}
+    filtered = filter_data(df, **query)
+    from_cube = analyze_data(filtered, cube=reloaded, **query)
+    scanned = analyze_data(filtered)
+    pd.testing.assert_series_equal(from_cube["top_products"], scanned["top_products"], check_exact=False)
+    assert from_cube["avg_spend_per_customer"] == pytest.approx(scanned["avg_spend_per_customer"], rel=0.05)
+    # With the exact totals of the filtered purchases, the average spend is exact too
+    exact = analyze_data(filtered, aggregates=PurchaseAggregates.from_frame(filtered), cube=reloaded, **query)
+    assert exact["avg_spend_per_customer"] == scanned["avg_spend_per_customer"]
+    pd.testing.assert_series_equal(exact["daily_revenue"], from_cube["daily_revenue"])
+    pd.testing.assert_series_equal(from_cube["daily_revenue"], scanned["daily_revenue"], check_exact=False,
+                                   check_index_type=False)
+
+def test_saved_cube_keeps_id_dtypes(tmp_path, make_purchases):
+    df = make_purchases(500, 6, customers=50)
+    df["ProductID"] = df["ProductID"].str[1:].astype(np.int64)
+    cube = RevenueCube.from_frame(df)
+    cube.save(str(tmp_path / "cube.npz"))
+    reloaded, _ = RevenueCube.load(str(tmp_path / "cube.npz"))
+
+    assert reloaded.products.dtype == np.int64
+    assert reloaded.categories.equals(cube.categories)
+    pd.testing.assert_series_equal(reloaded.query().product_sales, cube.query().product_sales)
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    from conftest import purchases_frame
+    test_query_matches_filtered_aggregates({}, purchases_frame)
+    test_times_of_day_fall_back_to_scanning(purchases_frame)
+    test_saved_cube_keeps_id_dtypes(pathlib.Path(tempfile.mkdtemp()), purchases_frame)
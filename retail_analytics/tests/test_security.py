@@ -0,0 +1,78 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import numpy as np
+import pandas as pd
+import src.security as security
+from src.aggregates import PurchaseAggregates
+from src.security import ColumnProtector
+
+@pytest.fixture(autouse=True)
+def aes_key(monkeypatch):
+    # The default SECRET_KEY is not a valid AES key length
+    monkeypatch.setattr(security, "SECRET_KEY", "k" * 32)
+
+ROWS = [
+    ("C1", "P1", "Books", 10.0, "2024-07-01"), ("C2", "P2", "Toys", 20.0, "2024-07-01"),
+    ("C1", "P2", "Toys", 5.0, "2024-07-01"), (None, "P3", "Home", 7.5, "2024-07-01"),
+    ("C3", "P1", "Books", 12.0, "2024-07-01"), ("C2", "P1", "Books", 1.0, "2024-07-01"),
+]
+
+def test_bulk_encryption_matches_single_values(make_purchases):
+    ids = make_purchases(rows=ROWS)["CustomerID"]
+    protector = ColumnProtector(batch_size=2)  # several batches, in threads
+    encrypted = protector.encrypt(ids)
+
+    assert encrypted.iloc[0] == security.encrypt_data("C1")
+    assert encrypted.iloc[0] == encrypted.iloc[2]
+    assert pd.isna(encrypted.iloc[3])
+    assert security.decrypt_data(encrypted.iloc[4]) == "C3"
+    pd.testing.assert_series_equal(protector.decrypt(encrypted), ids)
+    assert security.decrypt_data(protector.encrypt(pd.Series(["café-ünïcode"])).iloc[0]) == "café-ünïcode"
+
+def test_tokens_are_deterministic_and_memoized(make_purchases):
+    df = make_purchases(rows=ROWS)
+    protector = ColumnProtector(token_length=12)
+    tokens = protector.tokenize(df["CustomerID"])
+    assert tokens.str.len().dropna().eq(12).all()
+    assert tokens.nunique() == 3
+
+    again = protector.tokenize(df["CustomerID"].iloc[::-1])
+    assert protector.stats[-1]["processed_values"] == 0
+    assert protector.stats[-1]["rows_per_second"] > 0
+    pd.testing.assert_series_equal(again.sort_index(), tokens)
+    # Same key, fresh memo: same tokens
+    pd.testing.assert_series_equal(security.tokenize_column(df["CustomerID"], token_length=12), tokens)
+
+def test_memo_is_bounded_and_keyed_by_type():
+    protector = ColumnProtector(max_memo=3)
+    tokens = protector.tokenize(pd.Series(["C1", "C2", "C3", "C4", "C5"]))
+    assert list(protector.memo["tokenize"]) == [(str, "C3"), (str, "C4"), (str, "C5")]
+    # Values dropped from the memo are processed again, to the same tokens
+    pd.testing.assert_series_equal(protector.tokenize(pd.Series(["C1", "C2"])), tokens.iloc[:2])
+    assert protector.stats[-1]["processed_values"] == 2
+
+    protector.encrypt(pd.Series([1, "1", 1.5, "1.5"], dtype=object))
+    assert protector.stats[-1]["processed_values"] == 4
+    assert set(protector.memo["encrypt"]) == {(str, "1.5"), (float, 1.5), (str, "1")}
+
+def test_protected_frames_aggregate_like_the_originals(make_purchases):
+    df = make_purchases(rows=ROWS)
+    protected = ColumnProtector().protect_frame(df, columns=["CustomerID"])
+    original = PurchaseAggregates.from_frame(df).customer_spending
+    tokenized = PurchaseAggregates.from_frame(protected).customer_spending
+    np.testing.assert_allclose(np.sort(original.to_numpy()), np.sort(tokenized.to_numpy()))
+
+    customers = ColumnProtector().protect_frame(pd.DataFrame({"CustomerID": ["C1", "C2", "C3"]}))
+    assert len(protected.merge(customers, on="CustomerID")) == 5
+    with pytest.raises(ValueError):
+        ColumnProtector().protect_frame(df, method="rot13")
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    security.SECRET_KEY = "k" * 32
+    test_bulk_encryption_matches_single_values(purchases_frame)
+    test_tokens_are_deterministic_and_memoized(purchases_frame)
+    test_memo_is_bounded_and_keyed_by_type()
+    test_protected_frames_aggregate_like_the_originals(purchases_frame)
@@ -0,0 +1,33 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pickle
+import pytest
+import numpy as np
+from src.clustering import create_customer_clusters
+from src.model_store import ModelStore
+from src.segment_assigner import SegmentAssigner
+
+def test_assigner_matches_fitted_clusters(make_purchases):
+    customers, assigner = create_customer_clusters(make_purchases(4000, 3, customers=800, products=20, categories=["Books"], amounts="lognormal"), return_assigner=True)
+
+    np.testing.assert_array_equal(assigner.predict(customers), customers["Cluster"].to_numpy())
+    np.testing.assert_array_equal(assigner.assign(customers), customers["ClusterLabel"].to_numpy())
+
+    first = customers.iloc[0]
+    assert assigner.assign_customer(first["TotalSpending"], first["PurchaseCount"]) == first["ClusterLabel"]
+    assert assigner.assign([first["TotalSpending"], first["PurchaseCount"]])[0] == first["ClusterLabel"]
+
+def test_assigner_pickles_and_chunks(tmp_path, make_purchases):
+    store = ModelStore(str(tmp_path))
+    customers = create_customer_clusters(make_purchases(4000, 3, customers=800, products=20, categories=["Books"], amounts="lognormal"), model_store=store)
+    assigner = SegmentAssigner.from_store(store, n_clusters=4)
+    assigner.chunk_size = 100
+
+    restored = pickle.loads(pickle.dumps(assigner))
+    np.testing.assert_array_equal(restored.assign(customers), customers["ClusterLabel"].to_numpy())
+    assert SegmentAssigner.from_store(store, n_clusters=7) is None
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    test_assigner_matches_fitted_clusters(purchases_frame)
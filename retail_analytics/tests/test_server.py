@@ -0,0 +1,81 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pytest
+import asyncio
+import json
+from src.clustering import create_customer_clusters
+from src.recommendations import build_collaborative_filtering_model, recommend_for_customer
+from src.server import AnalyticsServer, AnalyticsService
+
+def _service(df):
+    algo = build_collaborative_filtering_model(df)
+    _, assigner = create_customer_clusters(df, return_assigner=True)
+    return AnalyticsService(df, algo, assigner)
+
+async def _get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+def test_concurrent_recommendations_are_batched(make_purchases):
+    df = make_purchases(400, 7, customers=40, products=15, start="2024-08-01", days=30)
+    service = _service(df)
+    customers = sorted(df["CustomerID"].unique())
+
+    async def scenario():
+        async with AnalyticsServer(service, port=0, max_batch_size=16, max_wait_ms=20) as server:
+            responses = await asyncio.gather(*[_get(server.port, f"/recommend?customer_id={c}&top_n=3")
+                                               for c in customers])
+            metrics = (await _get(server.port, "/metrics"))[1]
+        return responses, metrics
+
+    responses, metrics = asyncio.run(scenario())
+    for customer_id, (status, body) in zip(customers, responses):
+        assert status == 200
+        single = recommend_for_customer(service.algo, customer_id, df, top_n=3)
+        assert [r["product_id"] for r in body["recommendations"]] == [item for item, _ in single]
+        assert [r["predicted_amount"] for r in body["recommendations"]] == pytest.approx([est for _, est in single])
+
+    # Concurrent requests share scoring calls
+    assert metrics["recommendation_batches"] < len(customers)
+    recommend = metrics["endpoints"]["/recommend"]
+    assert recommend["requests"] == len(customers)
+    assert 0 < recommend["p50_ms"] <= recommend["p99_ms"]
+
+def test_segment_and_top_products(make_purchases):
+    df = make_purchases(400, 7, customers=40, products=15, start="2024-08-01", days=30)
+    service = _service(df)
+    customer_id = df["CustomerID"].iloc[0]
+
+    async def scenario():
+        async with AnalyticsServer(service, port=0) as server:
+            return [await _get(server.port, path) for path in (
+                f"/segment?customer_id={customer_id}",
+                "/segment?total_spending=100000&purchase_count=50",
+                "/top-products?n=3&category=Books",
+                "/top-products?n=3",
+                "/recommend?customer_id=unknown",
+                "/recommend?customer_id=C1&top_n=abc",
+                "/nowhere",
+            )]
+
+    segment, high, books, top, unknown, bad, missing = asyncio.run(scenario())
+    assert segment[0] == 200
+    assert segment[1]["total_spending"] == pytest.approx(df.loc[df["CustomerID"] == customer_id, "PurchaseAmount"].sum())
+    assert high[1]["segment"] == "Very High Spenders"
+
+    expected = df[df["Category"] == "Books"].groupby("ProductID")["PurchaseAmount"].sum().nlargest(3)
+    assert [p["product_id"] for p in books[1]["products"]] == list(expected.index)
+    assert [p["product_id"] for p in top[1]["products"]] == list(
+        df.groupby("ProductID")["PurchaseAmount"].sum().nlargest(3).index)
+    assert (unknown[0], bad[0], missing[0]) == (404, 400, 404)
+
+if __name__ == "__main__":
+    from conftest import purchases_frame
+    test_concurrent_recommendations_are_batched(purchases_frame)
+    test_segment_and_top_products(purchases_frame)
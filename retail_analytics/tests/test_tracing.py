@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../')))
+import pstats
+import pytest
+import numpy as np
+from src.tracing import PipelineTracer
+
+def test_spans_record_stage_metrics():
+    tracer = PipelineTracer()
+    with tracer.span("build", rows_in=1000) as span:
+        data = np.ones((1000, 1000))
+        span.rows_out = len(data)
+    with pytest.raises(RuntimeError):
+        with tracer.span("fail"):
+            raise RuntimeError("boom")
+
+    build, fail = tracer.spans
+    assert build.to_dict()["rows_out"] == 1000
+    assert build.wall_seconds >= 0 and build.cpu_seconds >= 0
+    assert build.peak_rss_delta_mb >= 0
+    assert build.profile_file is None
+    assert fail.status == "error"
+
+    print(tracer.summary_table())
+
+def test_profile_mode_writes_a_dump_per_stage(tmp_path):
+    tracer = PipelineTracer(profile_dir=str(tmp_path))
+    for stage in ("load", "analyze"):
+        with tracer.span(stage):
+            sorted(range(10_000), key=lambda x: -x)
+
+    assert sorted(os.listdir(tmp_path)) == ["01-load.prof", "02-analyze.prof"]
+    assert pstats.Stats(str(tmp_path / "01-load.prof")).total_calls > 0
+    assert "analyze (" in tracer.summary_table()
+
+if __name__ == "__main__":
+    test_spans_record_stage_metrics()